@@ -1,3 +1,6 @@
 from psychopy_session_webserver.main import main
 
-main()
+# the guard is needed as the experiment scanner spawns worker processes which import
+# this module.
+if __name__ == "__main__":
+    main()
@@ -1,59 +1,162 @@
 import asyncio
-from dataclasses import dataclass
+import itertools
+import threading
+import time
+from dataclasses import dataclass, field
+from enum import IntEnum
 from functools import partial
-from queue import Queue
+from queue import PriorityQueue
 from typing import Any, Awaitable, Callable, Optional
 
 import structlog
 
+from psychopy_session_webserver import metrics
+from psychopy_session_webserver.utils import format_ns
+
+_TASK_WAIT = metrics.histogram(
+    "psychopy_session_task_wait_seconds",
+    "Time spent by the tasks in the queue of the session thread.",
+    ["lane"],
+)
+_TASK_DURATION = metrics.histogram(
+    "psychopy_session_task_duration_seconds",
+    "Execution time of the tasks in the session thread.",
+    ["lane"],
+)
+
+
+class TaskQueueFull(Exception):
+    """Raised when a task is submitted to an AsyncTaskRunner whose queue is full."""
+
 
 class AsyncTaskRunner:
-    """An object that runs a threadsafe loop, and make the bridge with async call"""
+    """An object that runs a threadsafe loop, and make the bridge with async call.
+
+    Tasks are queued in lanes: the tasks of the CONTROL lane are run before the ones
+    of the WORK lane, in submission order within a lane. At most maxQueuedTasks WORK
+    tasks can wait at once, further submissions fail with TaskQueueFull. A task whose
+    caller stopped awaiting it before it started is dropped, and its onDropped
+    callback is called from the loop thread.
 
-    def __init__(self, logger=None):
-        self._tasks = Queue()
+    Tasks can also be queued without a future from any thread, e.g. by a timer, their
+    errors are then only logged.
+    """
+
+    class Lane(IntEnum):
+        CONTROL = 0
+        WORK = 1
+
+    # sorts after every lane, so the tasks queued before close() are still run.
+    _CLOSE = len(Lane)
+
+    def __init__(self, logger=None, maxQueuedTasks: Optional[int] = None):
+        self._tasks = PriorityQueue()
+        self._sequence = itertools.count()
+        self._queued = {lane: 0 for lane in AsyncTaskRunner.Lane}
+        self._queuedLock = threading.Lock()
+        self.maxQueuedTasks = maxQueuedTasks
         self.logfer = (logger or structlog.get_logger()).bind(group="loop")
 
     def close(self):
-        self._tasks.put(None)
+        self._tasks.put((AsyncTaskRunner._CLOSE, next(self._sequence), None))
 
     @dataclass
     class _Task:
         future: asyncio.Future
         task: Callable
+        lane: int
+        onDropped: Optional[Callable[[], None]] = None
+        queued: int = field(default_factory=time.monotonic_ns)
+
+    def queueDepth(self, lane: Optional[Lane] = None) -> int:
+        """Returns the number of tasks waiting in a lane, or in all lanes."""
+        if lane is None:
+            return sum(self._queued.values())
+        return self._queued[lane]
 
     def run(self):
 
         while True:
-            task = self._tasks.get()
+            task = self._tasks.get()[-1]
             if task is None:
                 return
+            with self._queuedLock:
+                self._queued[task.lane] -= 1
+            if task.future is not None and task.future.cancelled():
+                self.logfer.debug("dropped cancelled task", fn=task.task)
+                self._dropped(task)
+                continue
+
+            start = time.monotonic_ns()
             try:
                 res = task.task()
-                if task.future.done() is False:
-                    task.future.get_loop().call_soon_threadsafe(
-                        task.future.set_result, res
-                    )
+                if task.future is not None and task.future.done() is False:
+                    AsyncTaskRunner.resolve(task.future, res)
             except Exception as err:
-                if task.future.done() is False:
-                    task.future.get_loop().call_soon_threadsafe(
-                        task.future.set_exception, err
-                    )
+                if task.future is not None and task.future.done() is False:
+                    AsyncTaskRunner.resolve(task.future, exception=err)
                 else:
                     self.logfer.error("task error", exc_info=err)
+            finally:
+                end = time.monotonic_ns()
+                self._taskDone(task, wait=start - task.queued, duration=end - start)
+
+    def _dropped(self, task: _Task):
+        if task.onDropped is None:
+            return
+        try:
+            task.onDropped()
+        except Exception as err:
+            self.logfer.error("dropped task callback error", exc_info=err)
+
+    def _taskDone(self, task: _Task, wait: int, duration: int):
+        lane = AsyncTaskRunner.Lane(task.lane).name
+        _TASK_WAIT.labels(lane).observe(wait / 1e9)
+        _TASK_DURATION.labels(lane).observe(duration / 1e9)
+        self.logfer.debug(
+            "task done",
+            fn=task.task,
+            lane=lane,
+            wait=format_ns(wait),
+            duration=format_ns(duration),
+        )
+
+    @staticmethod
+    def resolve(future: asyncio.Future, result: Any = None, exception=None):
+        """Sets the result or the exception of a future from any thread, unless it
+        was cancelled in the meantime."""
+        future.get_loop().call_soon_threadsafe(_resolve, future, result, exception)
+
+    def _checkCapacity(self, lane: Lane):
+        if (
+            lane == AsyncTaskRunner.Lane.WORK
+            and self.maxQueuedTasks is not None
+            and self._queued[lane] >= self.maxQueuedTasks
+        ):
+            raise TaskQueueFull(f"{self._queued[lane]} tasks are already queued")
 
-    def _put_task(self, fn, future):
-        self.logfer.debug("add task", fn=fn, future=future)
-        self._tasks.put(AsyncTaskRunner._Task(task=fn, future=future))
+    def _put_task(self, fn, future, lane: Lane = Lane.WORK, onDropped=None):
+        with self._queuedLock:
+            self._checkCapacity(lane)
+            self._queued[lane] += 1
+        self.logfer.debug("add task", fn=fn, future=future, lane=lane.name)
+        task = AsyncTaskRunner._Task(
+            task=fn, future=future, lane=lane, onDropped=onDropped
+        )
+        self._tasks.put((lane, next(self._sequence), task))
 
     @staticmethod
-    def in_loop(*, runner=None, future=None):
+    def in_loop(*, runner=None, future=None, lane: Lane = Lane.WORK, onDropped=None):
         def decorator(fn) -> Callable[[], Awaitable]:
             async def call(*args, **kwargs):
                 _runner = runner or args[0]
                 _future = future or asyncio.get_event_loop().create_future()
-                _runner._put_task(partial(fn, *args, **kwargs), _future)
+                _runner._put_task(
+                    partial(fn, *args, **kwargs), _future, lane, onDropped=onDropped
+                )
 
+                # if the caller is cancelled, so is _future, and the task is dropped
+                # if it did not start yet.
                 await _future
                 exc = _future.exception()
                 if exc is not None:
@@ -63,3 +166,12 @@ class AsyncTaskRunner:
             return call
 
         return decorator
+
+
+def _resolve(future: asyncio.Future, result: Any, exception):
+    if future.done():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
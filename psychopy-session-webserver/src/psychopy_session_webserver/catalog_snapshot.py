@@ -0,0 +1,110 @@
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional
+
+from pydantic import BaseModel, ValidationError
+from pydantic_core import from_json, to_json
+from structlog import get_logger
+from xdg import BaseDirectory
+
+from psychopy_session_webserver.experiment_cache import (
+    CachedExperiment,
+    _environment_fingerprint,
+)
+
+
+class SnapshotEntry(BaseModel):
+    """A catalog entry, with the state of the .psyexp file it was computed from.
+
+    Attributes
+    ----------
+    experiment: CachedExperiment
+        the resources and expInfo of the experiment.
+    mtime: int
+        the modification time of the file in nanoseconds.
+    size: int
+        the size of the file in bytes.
+    """
+
+    experiment: CachedExperiment
+    mtime: int
+    size: int
+
+    @staticmethod
+    def fromStat(experiment: CachedExperiment, stat: os.stat_result):
+        return SnapshotEntry(
+            experiment=experiment, mtime=stat.st_mtime_ns, size=stat.st_size
+        )
+
+    def matches(self, stat: os.stat_result) -> bool:
+        """Tells if a file stat is the one this entry was computed from."""
+        return self.mtime == stat.st_mtime_ns and self.size == stat.st_size
+
+
+class CatalogSnapshot:
+    """Persists the catalog of a session directory across restarts.
+
+    The snapshot allows a Session to list its experiments right away, before it
+    reconciles it with the filesystem. A snapshot saved with another PsychoPy version
+    or set of plugins is ignored, as the experiments may compile differently.
+
+    Attributes
+    ----------
+    environment: str
+        the fingerprint of the PsychoPy version and plugins, see ExperimentCache.
+    """
+
+    _dirpath = Path(BaseDirectory.save_cache_path("psychopy_session_webserver"))
+
+    def __init__(self, root, environment: Optional[str] = None):
+        self._logger = get_logger().bind(module="CatalogSnapshot", root=str(root))
+        digest = hashlib.sha1(str(Path(root).resolve()).encode("utf-8")).hexdigest()
+        self._filename = f"catalog-{digest}.json"
+        if environment is None:
+            environment = _environment_fingerprint()
+        self.environment = environment
+
+    @property
+    def filepath(self) -> Path:
+        return CatalogSnapshot._dirpath.joinpath(self._filename)
+
+    def load(self) -> Dict[str, SnapshotEntry]:
+        """Returns the persisted entries, or an empty dict if there is none."""
+        try:
+            with open(self.filepath, "rb") as f:
+                data = from_json(f.read())
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            self._logger.warn("invalid snapshot", error=e)
+            return {}
+
+        if not isinstance(data, dict) or data.get("environment") != self.environment:
+            self._logger.info("ignoring snapshot of another environment")
+            return {}
+
+        entries = {}
+        for key, value in data.get("entries", {}).items():
+            try:
+                entries[key] = SnapshotEntry(**value)
+            except ValidationError:
+                self._logger.warn("invalid snapshot entry", key=key)
+        return entries
+
+    def save(self, entries: Dict[str, SnapshotEntry]) -> None:
+        """Atomically replaces the persisted entries. It can be called from several
+        threads at once."""
+        os.makedirs(CatalogSnapshot._dirpath, exist_ok=True)
+        data = {"environment": self.environment, "entries": entries}
+        # each save writes its own temporary file, so concurrent saves never rename
+        # a file being written.
+        with tempfile.NamedTemporaryFile(
+            dir=CatalogSnapshot._dirpath,
+            prefix=self._filename,
+            suffix=".tmp",
+            delete=False,
+        ) as f:
+            f.write(to_json(data, fallback=str))
+        os.replace(f.name, self.filepath)
@@ -0,0 +1,281 @@
+import threading
+import zlib
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def available_encodings() -> List[str]:
+    """Returns the supported content encodings, from the most to the least
+    preferred."""
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return encodings
+
+
+def negotiate_encoding(acceptEncoding: str, encodings: List[str]) -> Optional[str]:
+    """Returns the preferred encoding of encodings accepted by an Accept-Encoding
+    header, or None if none is."""
+    weights = {}
+    for item in acceptEncoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+
+    best = None
+    for encoding in encodings:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > 0 and (best is None or q > best[1]):
+            best = (encoding, q)
+    return best[0] if best is not None else None
+
+
+class _GzipStream:
+    def __init__(self, template):
+        self._c = template.copy()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.compress(data)
+
+    def flush(self) -> bytes:
+        return self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._c.flush(zlib.Z_FINISH)
+
+
+class _BrotliStream:
+    def __init__(self, quality):
+        self._c = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.process(data)
+
+    def flush(self) -> bytes:
+        return self._c.flush()
+
+    def finish(self) -> bytes:
+        return self._c.finish()
+
+
+class _ZstdStream:
+    def __init__(self, level):
+        # a ZstdCompressor runs a single operation at a time, each stream has its
+        # own.
+        self._c = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.compress(data)
+
+    def flush(self) -> bytes:
+        return self._c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._c.flush()
+
+
+class Compressor:
+    """Compresses bodies in a given encoding, reusing the compression contexts.
+
+    It can be used from several threads and streams at once.
+
+    Attributes
+    ----------
+    level: int
+        the compression level, clamped to the range of each encoding.
+    """
+
+    def __init__(self, level: int = 6):
+        self.level = level
+        self._gzip = zlib.compressobj(min(max(level, 1), 9), zlib.DEFLATED, 31)
+        self._zstdLevel = min(max(level, 1), 22)
+        self._zstd = None
+        self._zstdLock = threading.Lock()
+        if zstandard is not None:
+            self._zstd = zstandard.ZstdCompressor(level=self._zstdLevel)
+
+    def compress(self, encoding: str, data: bytes) -> bytes:
+        if encoding == "zstd":
+            # the one-shot context is only shared by the compress() calls.
+            with self._zstdLock:
+                return self._zstd.compress(data)
+        if encoding == "br":
+            return brotli.compress(data, quality=min(max(self.level, 0), 11))
+        c = self._gzip.copy()
+        return c.compress(data) + c.flush(zlib.Z_FINISH)
+
+    def stream(self, encoding: str):
+        """Returns an object compressing a stream with compress(), flush() and
+        finish()."""
+        if encoding == "zstd":
+            return _ZstdStream(self._zstdLevel)
+        if encoding == "br":
+            return _BrotliStream(min(max(self.level, 0), 11))
+        return _GzipStream(self._gzip)
+
+
+_COMPRESSIBLE_TYPES = ["application/json", "text/"]
+
+
+class CompressionMiddleware:
+    """An ASGI middleware compressing JSON and text responses with the best encoding
+    accepted by the client, among zstd, br and gzip.
+
+    Bodies smaller than minimumSize are sent as is. Server-sent events are compressed
+    as a stream flushed after each event, so they are not delayed. A response with an
+    ETag gets a weak one, since its bytes depend on the encoding, and its compressed
+    body is cached until the ETag of its path changes.
+    """
+
+    def __init__(self, app, level: int = 6, minimumSize: int = 512, cacheSize=32):
+        self.app = app
+        self.minimumSize = minimumSize
+        self.encodings = available_encodings()
+        self._compressor = Compressor(level)
+        # the (etag, compressed body) of the last response of each path and encoding.
+        self._cache: OrderedDict[Tuple[str, str], Tuple[str, bytes]] = OrderedDict()
+        self._cacheSize = cacheSize
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        acceptEncoding = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                acceptEncoding = value.decode("latin-1")
+        encoding = negotiate_encoding(acceptEncoding, self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(
+            scope, receive, _Responder(self, scope["path"], encoding, send).send
+        )
+
+    def _cached(self, path: str, etag: str, encoding: str, body: bytes) -> bytes:
+        # ETags are only unique for a given resource.
+        key = (path, encoding)
+        cached = self._cache.get(key, None)
+        if cached is not None and cached[0] == etag:
+            self._cache.move_to_end(key)
+            return cached[1]
+        compressed = self._compressor.compress(encoding, body)
+        # replaces the body of a previous ETag, which is stale.
+        self._cache[key] = (etag, compressed)
+        self._cache.move_to_end(key)
+        if len(self._cache) > self._cacheSize:
+            self._cache.popitem(last=False)
+        return compressed
+
+
+class _Responder:
+    def __init__(
+        self, middleware: CompressionMiddleware, path: str, encoding: str, send
+    ):
+        self._middleware = middleware
+        self._path = path
+        self._encoding = encoding
+        self._send = send
+        self._start = None
+        self._stream = None
+        self._eventStream = False
+        self._passthrough = False
+
+    def _headers(self, compressed: bool, length: Optional[int] = None):
+        headers = []
+        for name, value in self._start["headers"]:
+            if name == b"content-length":
+                continue
+            if name == b"etag" and compressed and value.startswith(b"W/") is False:
+                value = b"W/" + value
+            headers.append((name, value))
+        headers.append((b"vary", b"Accept-Encoding"))
+        if compressed:
+            headers.append((b"content-encoding", self._encoding.encode("latin-1")))
+        if length is not None:
+            headers.append((b"content-length", str(length).encode("latin-1")))
+        return headers
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self._start = message
+            headers = dict(message["headers"])
+            contentType = headers.get(b"content-type", b"").decode("latin-1")
+            self._passthrough = (
+                message["status"] in [204, 304]
+                or b"content-encoding" in headers
+                or not any(contentType.startswith(t) for t in _COMPRESSIBLE_TYPES)
+            )
+            if self._passthrough:
+                await self._send(message)
+                return
+            self._eventStream = contentType.startswith("text/event-stream")
+            if self._eventStream:
+                # events must reach the client right away.
+                await self._startStream()
+            return
+
+        if message["type"] != "http.response.body" or self._passthrough:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more = message.get("more_body", False)
+        if self._stream is None and more is False:
+            await self._sendWhole(body)
+            return
+        if self._stream is None:
+            await self._startStream()
+
+        data = self._stream.compress(body)
+        if more is False:
+            data += self._stream.finish()
+        elif self._eventStream and body.endswith(b"\n\n"):
+            data += self._stream.flush()
+        if len(data) > 0 or more is False:
+            await self._send(
+                {"type": "http.response.body", "body": data, "more_body": more}
+            )
+
+    async def _startStream(self):
+        self._stream = self._middleware._compressor.stream(self._encoding)
+        await self._send({**self._start, "headers": self._headers(compressed=True)})
+
+    async def _sendWhole(self, body: bytes):
+        if len(body) < self._middleware.minimumSize:
+            await self._send(
+                {**self._start, "headers": self._headers(False, len(body))}
+            )
+            await self._send({"type": "http.response.body", "body": body})
+            return
+
+        etag = dict(self._start["headers"]).get(b"etag", None)
+        if etag is not None:
+            compressed = self._middleware._cached(
+                self._path, etag.decode("latin-1"), self._encoding, body
+            )
+        else:
+            compressed = self._middleware._compressor.compress(self._encoding, body)
+        await self._send(
+            {**self._start, "headers": self._headers(True, len(compressed))}
+        )
+        await self._send({"type": "http.response.body", "body": compressed})
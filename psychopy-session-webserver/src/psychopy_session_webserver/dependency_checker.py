@@ -1,8 +1,68 @@
+import os
+import time
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, FrozenSet, List, Optional, Tuple
 
 from pydantic import BaseModel, computed_field
 
+from psychopy_session_webserver import metrics
+
+_VALIDATION = metrics.histogram(
+    "psychopy_session_resource_validation_seconds",
+    "Time spent checking the resources of the experiments after file changes.",
+)
+
+
+class DirectoryListing:
+    """DirectoryListing checks for file existence by listing their parent directory.
+
+    Listings are kept for ttl seconds, so checking many files in the same directory
+    costs a single os.scandir() call.
+
+    Attributes
+    ----------
+    ttl: float
+        the duration in seconds a directory listing is considered up to date.
+    """
+
+    def __init__(self, ttl=1.0):
+        self.ttl = ttl
+        self._listings: Dict[str, Tuple[float, FrozenSet[str]]] = {}
+
+    def exists(self, path) -> bool:
+        """Tells if a path exists, according to the listing of its parent."""
+        path = os.fspath(path)
+        if os.pardir in Path(path).parts:
+            # '..' follows symlinks on the filesystem, and must not be normalized
+            # away.
+            return os.path.exists(path)
+        directory, name = os.path.split(os.path.normpath(path))
+        return name in self._list(directory)
+
+    def invalidate(self, paths):
+        """Forgets the listings of the parent directories of paths."""
+        for p in paths:
+            self._listings.pop(os.path.dirname(os.path.normpath(p)), None)
+
+    def _list(self, directory) -> FrozenSet[str]:
+        now = time.monotonic()
+        cached = self._listings.get(directory)
+        if cached is not None and now - cached[0] < self.ttl:
+            return cached[1]
+
+        try:
+            with os.scandir(directory) as it:
+                names = frozenset(e.name for e in it)
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            names = frozenset()
+
+        if len(self._listings) > 1024:
+            self._listings = {
+                d: l for d, l in self._listings.items() if now - l[0] < self.ttl
+            }
+        self._listings[directory] = (now, names)
+        return names
+
 
 class DependencyChecker:
     """DependencyChecker efficiently keep record of presence of Dependencies for a
@@ -27,19 +87,28 @@ class DependencyChecker:
         root: Path
         resources: Dict[str, bool]
 
-        def __init__(self, key, root, resources):
+        def __init__(self, key, root, resources, listing=None):
             super(DependencyChecker.CollectionInfo, self).__init__(
                 key=key,
                 root=Path(root).resolve(),
                 resources={str(r): False for r in resources},
             )
-            self.validate()
+            self.validate(listing)
+
+        def validate(self, listing: Optional[DirectoryListing] = None):
+            """(re)Validate presence of dependencies on the filesystem.
 
-        def validate(self):
-            """(re)Validate presence of dependencies on the filesystem."""
+            Parameters
+            ----------
+            listing: DirectoryListing, optional
+                if given, existence is checked from the directory listings it holds.
+            """
             oldValid = self.valid
             for r in self.resources:
-                self.resources[r] = self.filepath(r).exists()
+                if listing is None:
+                    self.resources[r] = self.filepath(r).exists()
+                else:
+                    self.resources[r] = listing.exists(self.filepath(r))
             return oldValid != self.valid
 
         def filepath(self, path):
@@ -68,16 +137,21 @@ class DependencyChecker:
         def missing(self) -> List[str]:
             return [str(r) for r, ok in self.resources.items() if ok is False]
 
-    def __init__(self, root):
+    def __init__(self, root, listingTTL=1.0):
         """Intializer
 
         Parameters
         ----------
         root :
             a pathlib.Path like object that is the root for all dependencies to track.
+        listingTTL: float
+            duration in seconds directory listings are shared between collections.
         """
         self._root = Path(root).resolve()
-        self._resources = {}
+        self._listing = DirectoryListing(ttl=listingTTL)
+        # maps an absolute resource path to the keys depending on it, the size of the
+        # inner dict is the reference count of the resource.
+        self._resources: Dict[str, Dict[str, str]] = {}
         self.collections = {}
 
     def addDependencies(self, key, resources):
@@ -90,29 +164,38 @@ class DependencyChecker:
         resources: List[str]
             list of relative path to check for presence to consider the key valid.
         """
+        if key in self.collections:
+            self._unindex(self.collections[key])
+
         self.collections[key] = DependencyChecker.CollectionInfo(
             key=key,
             root=self._root,
             resources=resources,
+            listing=self._listing,
         )
 
-        self._rebuildReverseMap()
+        self._index(self.collections[key])
 
     def removeDependencies(self, key):
         """Removes tracking of dependencies for a key"""
         if key not in self.collections:
             return
+        self._unindex(self.collections[key])
         del self.collections[key]
-        self._rebuildReverseMap()
 
-    def _rebuildReverseMap(self):
-        self._resources = {}
-        for [key, info] in self.collections.items():
-            for r in info.resources:
-                r = self._filepath(r)
-                if r not in self._resources:
-                    self._resources[r] = []
-                self._resources[r].append(key)
+    def _index(self, info: "DependencyChecker.CollectionInfo"):
+        for r in info.resources:
+            self._resources.setdefault(self._filepath(r), {})[info.key] = r
+
+    def _unindex(self, info: "DependencyChecker.CollectionInfo"):
+        for r in info.resources:
+            path = self._filepath(r)
+            keys = self._resources.get(path)
+            if keys is None:
+                continue
+            keys.pop(info.key, None)
+            if len(keys) == 0:
+                del self._resources[path]
 
     def _filepath(self, path):
         if Path(path).is_absolute() is True:
@@ -126,14 +209,60 @@ class DependencyChecker:
         ----------
         paths: str | List[str]
             a str or list of relative path to recompute validity of dependant keys
+
+        Returns
+        -------
+        List[str]
+            the keys whose validity changed.
         """
+        oldValid = {key: self.collections[key].valid for key in self._dependants(paths)}
+        self.updateResources(paths)
+        return [
+            key
+            for key, valid in oldValid.items()
+            if self.collections[key].valid != valid
+        ]
+
+    def _dependants(self, paths):
         if not isinstance(paths, list):
             paths = [paths]
-        exps = {}
-
+        keys = set()
         for p in paths:
-            p = self._filepath(p)
-            for exp in self._resources.get(self._filepath(p), []):
-                exps[exp] = True
+            keys.update(self._resources.get(self._filepath(p), {}))
+        return keys
+
+    def updateResources(self, paths) -> Dict[str, Dict[str, bool]]:
+        """Checks the existence of a list of paths and updates the resources of the
+        keys depending on them.
 
-        return [key for key in exps if self.collections[key].validate() is True]
+        Parameters
+        ----------
+        paths: str | List[str]
+            a str or list of relative path that may have been created or removed.
+
+        Returns
+        -------
+        Dict[str, Dict[str, bool]]
+            the resources whose existence changed, by key.
+        """
+        start = time.perf_counter()
+        if not isinstance(paths, list):
+            paths = [paths]
+        paths = [self._filepath(p) for p in paths]
+        # the given paths changed, their directory listings are outdated.
+        self._listing.invalidate(paths)
+
+        changes = {}
+        for p in paths:
+            keys = self._resources.get(p)
+            if not keys:
+                continue
+            exists = self._listing.exists(p)
+            for key, r in keys.items():
+                info = self.collections[key]
+                if info.resources[r] == exists:
+                    continue
+                info.resources[r] = exists
+                changes.setdefault(key, {})[r] = exists
+        _VALIDATION.observe(time.perf_counter() - start)
+        return changes
@@ -0,0 +1,156 @@
+import hashlib
+import importlib.metadata
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, ValidationError
+from pydantic_core import from_json, to_json
+from structlog import get_logger
+from xdg import BaseDirectory
+
+
+class CachedExperiment(BaseModel):
+    """The result of compiling an experiment that is needed to list it in a catalog.
+
+    Attributes
+    ----------
+    resources: List[str]
+        the resource files the experiment depends on, relative to the session root
+        when possible, absolute otherwise.
+    expInfo: Dict[str, Any]
+        the expInfo template of the experiment, without the session parameters.
+    """
+
+    resources: List[str]
+    expInfo: Dict[str, Any]
+
+    @property
+    def parameters(self) -> List[str]:
+        return [p for p in self.expInfo if str(p).endswith("|hid") is False]
+
+
+def resource_paths(resources: List[Dict[str, str]]) -> List[str]:
+    """Converts psychopy.experiment.Experiment.getResourceFiles() to a list of path
+    relative to the session root, or absolute if they are outside of it."""
+    return [
+        r["rel"] if r["rel"].startswith("..") == False else r["abs"] for r in resources
+    ]
+
+
+def _environment_fingerprint() -> str:
+    # The compiled script depends on the PsychoPy version and on the installed
+    # plugins providing components, so both are part of the cache key.
+    packages = []
+    for dist in importlib.metadata.distributions():
+        name = dist.metadata["Name"]
+        if name is None:
+            continue
+        if name.lower() == "psychopy" or any(
+            ep.group.startswith("psychopy") for ep in dist.entry_points
+        ):
+            packages.append(f"{name.lower()}=={dist.version}")
+    return ";".join(sorted(packages))
+
+
+class ExperimentCache:
+    """A persistent, content addressed cache of compiled experiments.
+
+    Entries are keyed by the content of the .psyexp file, its key in the session, the
+    PsychoPy version and the set of installed PsychoPy plugins. An unchanged
+    experiment can therefore be listed without being compiled. The cache holds at
+    most maxEntries, least recently used entries are evicted first. Entries can be
+    stored from several threads at once.
+
+    Attributes
+    ----------
+    maxEntries: int
+        the maximal number of entries kept on disk.
+    environment: str
+        the fingerprint of the PsychoPy version and plugins of the entries.
+    """
+
+    _dirpath = Path(
+        BaseDirectory.save_cache_path("psychopy_session_webserver")
+    ).joinpath("experiments")
+
+    def __init__(self, maxEntries=1024):
+        self._logger = get_logger().bind(module="ExperimentCache")
+        self.maxEntries = maxEntries
+        self.environment = _environment_fingerprint()
+        self._environment = self.environment.encode("utf-8")
+        os.makedirs(ExperimentCache._dirpath, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = len(self._entries())
+
+    def digest(self, file, key: str) -> str:
+        """Computes the cache key of an experiment file.
+
+        Parameters
+        ----------
+        file: str | pathlib.Path
+            path to the .psyexp file.
+        key: str
+            the key of the experiment in the session.
+        """
+        h = hashlib.sha256()
+        h.update(self._environment)
+        h.update(b"\0")
+        h.update(key.encode("utf-8"))
+        h.update(b"\0")
+        with open(file, "rb") as f:
+            h.update(f.read())
+        return h.hexdigest()
+
+    def _entrypath(self, digest: str) -> Path:
+        return ExperimentCache._dirpath.joinpath(digest + ".json")
+
+    def _entries(self) -> List[Path]:
+        return list(ExperimentCache._dirpath.glob("*.json"))
+
+    def get(self, digest: str) -> Optional[CachedExperiment]:
+        """Returns the cached entry for digest or None if it is missing."""
+        path = self._entrypath(digest)
+        try:
+            with open(path, "rb") as f:
+                entry = CachedExperiment(**from_json(f.read()))
+        except FileNotFoundError:
+            return None
+        except (ValueError, ValidationError) as e:
+            self._logger.warn("invalid entry", digest=digest, error=e)
+            return None
+        # marks the entry as recently used.
+        os.utime(path)
+        return entry
+
+    def put(self, digest: str, entry: CachedExperiment) -> None:
+        """Stores an entry in the cache, evicting old entries if needed."""
+        path = self._entrypath(digest)
+        # each put writes its own temporary file, so concurrent puts of the same
+        # digest do not write to the same file.
+        with tempfile.NamedTemporaryFile(
+            dir=ExperimentCache._dirpath, suffix=".tmp", delete=False
+        ) as f:
+            f.write(to_json(entry, fallback=str))
+
+        with self._lock:
+            if path.exists() is False:
+                self._size += 1
+            os.replace(f.name, path)
+            if self._size > self.maxEntries:
+                self._evict()
+
+    def _evict(self):
+        entries = self._entries()
+        entries.sort(key=lambda p: p.stat().st_mtime_ns)
+        # evicts down to 90% so we do not list the directory on every put.
+        toRemove = len(entries) - int(0.9 * self.maxEntries)
+        for p in entries[: max(toRemove, 0)]:
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+        self._size = len(entries) - max(toRemove, 0)
+        self._logger.debug("evicted entries", count=toRemove)
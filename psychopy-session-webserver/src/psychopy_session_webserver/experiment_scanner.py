@@ -0,0 +1,61 @@
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable
+
+from psychopy_session_webserver.experiment_cache import CachedExperiment, resource_paths
+
+
+def _init_worker():
+    from psychopy import plugins
+
+    # components provided by plugins must be known to parse the experiments.
+    plugins.activatePlugins()
+
+
+def scan_experiment(file) -> CachedExperiment:
+    """Parses a .psyexp file and returns the data needed to list it in a catalog.
+
+    It does not write nor import the experiment script, it is meant to be run in a
+    worker process.
+    """
+    from psychopy import experiment
+
+    exp = experiment.Experiment()
+    exp.loadFromXML(str(file))
+
+    return CachedExperiment(
+        resources=resource_paths(exp.getResourceFiles()),
+        expInfo=exp.settings.getInfo(),
+    )
+
+
+class ExperimentScanner:
+    """ExperimentScanner parses experiments concurrently in a pool of processes.
+
+    Attributes
+    ----------
+    workers: int
+        the number of worker processes.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        # workers are spawned as forking a process which runs the watchdog threads is
+        # unsafe.
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+
+    def submit(self, file, callback: Callable[[Future], None]) -> Future:
+        """Schedules the scan of a file, callback is called with the completed
+        concurrent.futures.Future from a background thread."""
+        future = self._executor.submit(scan_experiment, str(file))
+        future.add_done_callback(callback)
+        return future
+
+    def shutdown(self, cancel=False):
+        """Releases the worker processes once all pending scans are done, or
+        immediately if cancel is True."""
+        self._executor.shutdown(wait=False, cancel_futures=cancel)
@@ -1,8 +1,93 @@
+import fnmatch
+import os
+import re
+import threading
 from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
 
 import structlog
 from watchdog import events
 
+from psychopy_session_webserver import metrics
+
+_FILE_EVENTS = metrics.counter(
+    "psychopy_session_file_events_total",
+    "Filesystem events received from watchdog in the session directory.",
+    ["type", "outcome"],
+)
+
+# files written by PsychoPy when compiling experiments.
+DEFAULT_IGNORED_PATTERNS = ["*.py", "*.pyc"]
+
+
+class PathFilter:
+    """PathFilter tells if a path should be ignored, using only string operations.
+
+    Patterns follow the .gitignore conventions: a pattern without a '/' is matched
+    against every component of the path relative to root, so it ignores a file or a
+    whole directory, e.g. '*.pyc' or '__pycache__'. A pattern with a '/' is matched
+    against the leading components of that path, e.g. 'stimuli/tmp'. A trailing
+    '/' only matches directories, e.g. '.git/'.
+
+    Attributes
+    ----------
+    root: str | pathlib.Path
+        absolute path the patterns are relative to.
+    directories: Iterable[str | pathlib.Path]
+        absolute path of directories whose whole content is ignored.
+    patterns: Iterable[str]
+        glob patterns matched against the path relative to root.
+    """
+
+    def __init__(
+        self, root=None, directories: Iterable = (), patterns: Iterable[str] = ()
+    ):
+        self._root = None
+        if root is not None:
+            self._root = os.path.join(os.path.normpath(str(root)), "")
+        self._prefixes = tuple(
+            os.path.join(os.path.normpath(str(d)), "") for d in directories
+        )
+        names: Dict[bool, List[str]] = {False: [], True: []}
+        # the patterns with a '/', as the regexes of their components.
+        self._paths: List[Tuple[bool, List[re.Pattern]]] = []
+        for p in patterns:
+            directoryOnly = p.endswith("/")
+            p = p.rstrip("/")
+            if "/" in p:
+                components = [
+                    re.compile(fnmatch.translate(c)) for c in p.lstrip("/").split("/")
+                ]
+                self._paths.append((directoryOnly, components))
+            else:
+                names[directoryOnly].append(p)
+        # directories only -> regex of the names.
+        self._names = {
+            directoryOnly: re.compile("|".join(fnmatch.translate(p) for p in patterns))
+            for directoryOnly, patterns in names.items()
+            if len(patterns) > 0
+        }
+
+    def __call__(self, path: str) -> bool:
+        if path.startswith(self._prefixes):
+            return True
+        if len(self._names) == 0 and len(self._paths) == 0:
+            return False
+        if self._root is not None and path.startswith(self._root):
+            path = path[len(self._root) :]
+        parts = path.split(os.sep)
+        # the last component is the file itself, it is not a directory.
+        for directoryOnly, regex in self._names.items():
+            candidates = parts[:-1] if directoryOnly else parts
+            if any(regex.match(c) is not None for c in candidates):
+                return True
+        for directoryOnly, components in self._paths:
+            if len(parts) - directoryOnly < len(components):
+                continue
+            if all(r.match(c) is not None for r, c in zip(components, parts)):
+                return True
+        return False
+
 
 class FileEventHandler(events.FileSystemEventHandler):
     """A watchdog.events.FileEventHandler for a psychopy_session_webserver.Session
@@ -18,65 +103,155 @@ class FileEventHandler(events.FileSystemEventHandler):
     root: str | pathlib.Path
         the folder to watch for change. any experiment or resource notification will be
     relative path to root
+    window: float
+        if positive, events are collected for window seconds. Changes are then
+        deduplicated per path and applied at once, with a single resource validation.
+    ignore: PathFilter
+        events on paths matching this filter are dropped.
+    dataDir: str | pathlib.Path
+        the data directory of the session.
+    dataHandler: watchdog.events.FileSystemEventHandler
+        if given, the events in dataDir are dispatched to it, so that the directory
+        is not watched twice.
+    filtered: int
+        the number of events dropped by ignore.
+    processed: int
+        the number of events that were not dropped.
 
     """
 
-    def __init__(self, session, root, logger=None):
+    def __init__(
+        self,
+        session,
+        root,
+        logger=None,
+        window=0.0,
+        ignore=None,
+        dataDir=None,
+        dataHandler=None,
+    ):
         if logger is None:
             logger = structlog.get_logger()
         self.session = session
         self.root = root
+        self.window = window
+        self.ignore = ignore or PathFilter()
+        self.dataHandler = dataHandler
+        self._dataPrefix = None
+        if dataDir is not None:
+            self._dataPrefix = os.path.join(os.path.normpath(str(dataDir)), "")
+        self.filtered = 0
+        self.processed = 0
         self.modified = {}
         self.logger = logger.bind(module="FileEvent", root=root)
+        self._lock = threading.Lock()
+        # maps a path to its last known existence, in order of last change.
+        self._pending: Dict[str, bool] = {}
+        self._timer = None
 
     def on_any_event(self, event: events.FileSystemEvent) -> None:
-        deletedPaths = []
-        modifiedPaths = []
+        if (
+            self.dataHandler is not None
+            and self._dataPrefix is not None
+            and (
+                event.src_path.startswith(self._dataPrefix)
+                or event.dest_path.startswith(self._dataPrefix)
+            )
+        ):
+            self.dataHandler.dispatch(event)
+
+        srcIgnored = self.ignore(event.src_path)
+        destIgnored = not event.dest_path or self.ignore(event.dest_path)
+        if srcIgnored and destIgnored:
+            self.filtered += 1
+            _FILE_EVENTS.labels(event.event_type, "ignored").inc()
+            return
+        self.processed += 1
+        _FILE_EVENTS.labels(event.event_type, "processed").inc()
+
+        changes = []
         self.logger.debug("new event", file_event=event)
 
         if event.is_directory == True:
             return
 
         if isinstance(event, events.FileMovedEvent):
-            deletedPaths.append(event.src_path)
-            modifiedPaths.append(event.dest_path)
+            if not srcIgnored:
+                changes.append((event.src_path, False))
+            if not destIgnored:
+                changes.append((event.dest_path, True))
         elif isinstance(event, events.FileDeletedEvent):
-            deletedPaths.append(event.src_path)
+            changes.append((event.src_path, False))
         elif isinstance(event, events.FileModifiedEvent) or isinstance(
             event, events.FileCreatedEvent
         ):
             self.modified[event.src_path] = True
         elif isinstance(event, events.FileClosedEvent):
             if event.src_path in self.modified:
-                modifiedPaths.append(event.src_path)
+                changes.append((event.src_path, True))
                 del self.modified[event.src_path]
 
-        toValidate = []
+        if len(changes) == 0:
+            return
 
-        for p in deletedPaths:
-            if Path(p).suffix == ".psyexp":
-                try:
-                    key = str(Path(p).relative_to(self.root))
-                    self.session.removeExperiment(key=key)
-                except Exception as err:
-                    self.logger.error(
-                        "could not remove experiment:", error=err, key=key
-                    )
+        if self.window <= 0:
+            self._apply(changes)
+            return
 
-            else:
+        with self._lock:
+            for path, exists in changes:
+                self._pending.pop(path, None)
+                self._pending[path] = exists
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Applies all the changes collected during the current window."""
+        with self._lock:
+            changes = list(self._pending.items())
+            self._pending = {}
+            self._timer = None
+        if len(changes) > 0:
+            self.logger.debug("applying changes", count=len(changes))
+            self._apply(changes)
+
+    def close(self):
+        """Drops the changes not applied yet."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = None
+            self._pending = {}
+
+    def _apply(self, changes):
+        toValidate = []
+        added = []
+        removed = []
+
+        for p, exists in changes:
+            if Path(p).suffix != ".psyexp":
                 toValidate.append(p)
+                continue
 
-        for p in modifiedPaths:
-            if Path(p).suffix == ".psyexp":
-                try:
-                    key = str(Path(p).relative_to(self.root))
-                    self.session.addExperiment(file=str(Path(p).relative_to(self.root)))
-                except Exception as err:
-                    self.logger.error(
-                        "could not remove experiment:", error=err, key=key
-                    )
+            key = str(Path(p).relative_to(self.root))
+            if exists:
+                added.append(key)
             else:
-                toValidate.append(p)
+                removed.append(key)
+
+        if len(added) > 0 or len(removed) > 0:
+            try:
+                # a single catalog update is sent for all the experiments.
+                self.session.updateExperiments(added=added, removed=removed)
+            except Exception as err:
+                self.logger.error(
+                    "could not update experiments:",
+                    error=err,
+                    added=added,
+                    removed=removed,
+                )
 
         if len(toValidate) > 0:
             try:
@@ -0,0 +1,120 @@
+import threading
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+from structlog import get_logger
+
+from psychopy_session_webserver.types import FrameStats
+
+
+def dropped_frames(intervals: np.ndarray, expected: float) -> int:
+    """Returns the number of refresh periods missed by intervals, an interval longer
+    than 1.5 expected intervals missing all but one of the periods it spans."""
+    late = intervals[intervals > 1.5 * expected]
+    return int(np.sum(np.rint(late / expected) - 1))
+
+
+def interval_stats(intervals: np.ndarray) -> Tuple[float, float, float]:
+    """Returns the mean, the 99th percentile and the maximum of intervals."""
+    if len(intervals) == 0:
+        return 0.0, 0.0, 0.0
+    return (
+        float(np.mean(intervals)),
+        float(np.percentile(intervals, 99)),
+        float(np.max(intervals)),
+    )
+
+
+class FrameMonitor:
+    """Records the frame intervals of a PsychoPy window during a run.
+
+    Every interval seconds, the statistics of the last window frames are passed to
+    onStats, while dropped frames are counted since the start. Only the intervals
+    recorded since the previous update are processed each time.
+
+    Attributes
+    ----------
+    interval: float
+        the period in seconds of the live statistics.
+    window: int
+        the number of recent frames of the live statistics.
+    """
+
+    def __init__(
+        self,
+        win,
+        run: int,
+        experiment: str,
+        frameRate: Optional[float] = None,
+        onStats: Optional[Callable[[FrameStats], None]] = None,
+        interval: float = 1.0,
+        window: int = 600,
+    ):
+        self._logger = get_logger().bind(module="FrameMonitor", run=run)
+        self._win = win
+        self._run = run
+        self._experiment = experiment
+        self._expected = 1.0 / frameRate if frameRate else None
+        self._onStats = onStats
+        self.interval = interval
+        self.window = window
+        self._seen = 0
+        self._dropped = 0
+        self._recent = np.zeros(0)
+        self._recording = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._recording = self._win.recordFrameIntervals
+        self._win.frameIntervals = []
+        self._win.recordFrameIntervals = True
+        if self._onStats is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+
+    def stop(self) -> FrameStats:
+        """Stops recording and returns the statistics of the whole run."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._win.recordFrameIntervals = self._recording
+        self._update()
+        return self._stats(np.asarray(self._win.frameIntervals, dtype=np.float64))
+
+    def _sample(self):
+        while self._stop.wait(self.interval) is False:
+            try:
+                self._onStats(self.stats())
+            except Exception as e:
+                self._logger.error("could not compute frame statistics", exc_info=e)
+
+    def stats(self) -> FrameStats:
+        """Returns the statistics of the last window frames."""
+        self._update()
+        return self._stats(self._recent)
+
+    def _update(self):
+        # the window appends to the list while the run goes on, a slice is a
+        # consistent copy.
+        new = np.asarray(self._win.frameIntervals[self._seen :], dtype=np.float64)
+        self._seen += len(new)
+        self._recent = np.concatenate((self._recent, new))[-self.window :]
+        expected = self._expected
+        if expected is None and len(self._recent) > 0:
+            expected = float(np.median(self._recent))
+        if expected is not None:
+            self._dropped += dropped_frames(new, expected)
+
+    def _stats(self, intervals: np.ndarray) -> FrameStats:
+        mean, p99, max = interval_stats(intervals)
+        return FrameStats(
+            run=self._run,
+            experiment=self._experiment,
+            frames=self._seen,
+            dropped=self._dropped,
+            expectedInterval=self._expected,
+            meanInterval=mean,
+            p99Interval=p99,
+            maxInterval=max,
+        )
@@ -3,20 +3,53 @@ import ipaddress
 import logging
 import os
 import time
-from typing import Dict
+from typing import Dict, List, Literal, Optional
 
-from pydantic_core import ValidationError, to_json
+from pydantic_core import ValidationError
 import structlog
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import (
+    FastAPI,
+    HTTPException,
+    Query,
+    Request,
+    WebSocket,
+    WebSocketDisconnect,
+    WebSocketException,
+    status,
+)
+from fastapi.responses import (
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
 from hypercorn.config import Config
 from psychopy.session import asyncio
 from pydantic import BaseModel
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from psychopy_session_webserver import metrics
+from psychopy_session_webserver.async_task_runner import (
+    AsyncTaskRunner,
+    TaskQueueFull,
+)
+from psychopy_session_webserver.compression import CompressionMiddleware
 from psychopy_session_webserver.options import parse_options
 from psychopy_session_webserver.server import BackgroundServer
 from psychopy_session_webserver.session import Session
-from psychopy_session_webserver.types import Catalog, Experiment, Parameter, Participant
+from psychopy_session_webserver.types import (
+    Catalog,
+    Experiment,
+    Parameter,
+    Participant,
+    ParticipantPage,
+    RunTimeline,
+    SubscriberStats,
+)
 from psychopy_session_webserver.utils import format_ns
 
 app = FastAPI()
@@ -50,6 +83,24 @@ structlog.configure(
 
 logger = structlog.get_logger()
 
+_REQUEST_DURATION = metrics.histogram(
+    "psychopy_session_http_request_duration_seconds",
+    "Latency of the HTTP requests, by route.",
+    ["method", "route", "status"],
+)
+_TASK_QUEUE_DEPTH = metrics.gauge(
+    "psychopy_session_task_queue_depth",
+    "Number of tasks waiting for the session thread.",
+    ["lane"],
+)
+_SUBSCRIBERS = metrics.gauge(
+    "psychopy_session_update_subscribers", "Number of connected update subscribers."
+)
+_SUBSCRIBER_LAG = metrics.gauge(
+    "psychopy_session_update_subscriber_lag_seconds",
+    "Age of the oldest update waiting to be sent to a subscriber.",
+)
+
 
 @app.middleware("http")
 async def log_access(request: Request, call_next):
@@ -64,6 +115,11 @@ async def log_access(request: Request, call_next):
 
     response = await call_next(request)
     end = time.time_ns()
+    # the route template keeps the number of label values bounded.
+    route = getattr(request.scope.get("route"), "path", "<unmatched>")
+    _REQUEST_DURATION.labels(request.method, route, response.status_code).observe(
+        (end - request.state.start) / 1e9
+    )
     if response.status_code < 400:
         await slog.ainfo(
             "OK", status=response.status_code, time=format_ns(end - request.state.start)
@@ -83,6 +139,52 @@ async def handle_session_error(request: Request, exc: Exception):
     return JSONResponse(status_code=500, content={"detail": str(exc)})
 
 
+@app.exception_handler(TaskQueueFull)
+async def handle_queue_full(request: Request, exc: TaskQueueFull):
+    end = time.time_ns()
+    await request.state.slog.awarn(
+        "BUSY", error=str(exc), time=format_ns(end - request.state.start)
+    )
+    return JSONResponse(
+        status_code=429, content={"detail": str(exc)}, headers={"Retry-After": "1"}
+    )
+
+
+async def wait_disconnect(request: Request):
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def cancel_on_disconnect(request: Request, coro):
+    """Awaits coro, or cancels it if the client disconnects first. A cancelled
+    AsyncTaskRunner task that did not start yet is never run."""
+    task = asyncio.ensure_future(coro)
+    disconnected = asyncio.ensure_future(wait_disconnect(request))
+    try:
+        await asyncio.wait([task, disconnected], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnected.cancel()
+    if task.done() is False:
+        task.cancel()
+        await request.state.slog.ainfo("client disconnected, request cancelled")
+        return None
+    return task.result()
+
+
+def cached_json_response(request: Request, store: str) -> Response:
+    etag, body = session.encodedStore(store)
+    headers = {"ETag": etag}
+    ifNoneMatch = request.headers.get("if-none-match", None)
+    if ifNoneMatch is not None:
+        # If-None-Match uses the weak comparison.
+        tags = [t.strip().removeprefix("W/") for t in ifNoneMatch.split(",")]
+        if etag in tags or "*" in tags:
+            return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 @app.get(
     "/experiments",
     responses={
@@ -112,20 +214,81 @@ async def handle_session_error(request: Request, exc: Exception):
         },
     },
 )
-async def get_experiments() -> Catalog:
-    return session.experiments
+async def get_experiments(request: Request) -> Catalog:
+    return cached_json_response(request, "catalog")
 
 
 async def send_server_side_event(agen):
-    async for event in agen:
-        dump = to_json(event.data, indent=None)
-        yield f"event:{event.type}\ndata:{dump.decode(encoding='utf-8')}\n\n"
+    async for id, event in agen:
+        # the id is sent separately so the encoded event is not copied.
+        yield f"id:{id}\n".encode("utf-8")
+        yield event.frame
 
 
 @app.get("/events")
-async def get_events():
+async def get_events(request: Request):
+    lastEventId = request.headers.get("last-event-id", None)
     return StreamingResponse(
-        send_server_side_event(session.updates()), media_type="text/event-stream"
+        send_server_side_event(session.events(lastEventId)),
+        media_type="text/event-stream",
+    )
+
+
+@app.websocket("/events/ws")
+async def events_websocket(
+    websocket: WebSocket, topics: Optional[str] = None, encoding: str = "json"
+):
+    """Sends the events as {"type": ..., "data": ...} messages, either JSON text or
+    msgpack binary messages. topics is a comma separated list of the stores to
+    receive the events of, e.g. 'experiment,window', all if omitted."""
+    if encoding not in ["json", "msgpack"]:
+        raise WebSocketException(
+            code=status.WS_1008_POLICY_VIOLATION,
+            reason=f"unsupported encoding '{encoding}'",
+        )
+    if encoding == "msgpack" and msgpack is None:
+        raise WebSocketException(
+            code=status.WS_1008_POLICY_VIOLATION, reason="msgpack is not installed"
+        )
+
+    if topics is not None:
+        topics = [t for t in topics.split(",") if len(t) > 0]
+
+    await websocket.accept()
+    events = session.events(topics=topics)
+    try:
+        async for _, event in events:
+            if encoding == "msgpack":
+                await websocket.send_bytes(event.packedMessage)
+            else:
+                await websocket.send_text(event.message)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await events.aclose()
+
+
+@app.get("/events/subscribers")
+async def get_event_subscribers() -> List[SubscriberStats]:
+    return session.subscriberStats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics() -> PlainTextResponse:
+    """Returns the server metrics in the Prometheus text exposition format."""
+    return PlainTextResponse(
+        metrics.REGISTRY.render(), media_type=metrics.Registry.CONTENT_TYPE
+    )
+
+
+def bind_session_metrics(session: Session):
+    for lane in AsyncTaskRunner.Lane:
+        _TASK_QUEUE_DEPTH.labels(lane.name).setFunction(
+            lambda lane=lane: session.queueDepth(lane)
+        )
+    _SUBSCRIBERS.setFunction(lambda: len(session.subscriberStats()))
+    _SUBSCRIBER_LAG.setFunction(
+        lambda: max((s.lag for s in session.subscriberStats()), default=0.0)
     )
 
 
@@ -150,8 +313,27 @@ async def close_window(request: Request) -> None:
         }
     },
 )
-async def get_participants() -> Dict[str, Participant]:
-    return session.participants
+async def get_participants(request: Request) -> Dict[str, Participant]:
+    return cached_json_response(request, "participants")
+
+
+@app.get("/participants/search")
+async def search_participants(
+    prefix: Optional[str] = None,
+    contains: Optional[str] = None,
+    sort: Literal["name", "recent"] = "name",
+    limit: int = Query(default=50, ge=1, le=1000),
+    cursor: Optional[str] = None,
+) -> ParticipantPage:
+    """Returns a page of the participants whose name starts with prefix and contains
+    a substring (ignoring case), sorted by name or by most recent activity. The next
+    page is requested by passing the returned nextCursor."""
+    try:
+        return session.searchParticipants(
+            prefix=prefix, contains=contains, sort=sort, limit=limit, cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 class RunExperimentRequest(BaseModel):
@@ -161,11 +343,38 @@ class RunExperimentRequest(BaseModel):
 
 @app.post("/experiment")
 async def run_experiment(body: RunExperimentRequest, request: Request) -> None:
-    await session.asyncRunExperiment(
+    # a run still queued when the tablet gives up on the request is not started.
+    await cancel_on_disconnect(
+        request,
+        session.asyncRunExperiment(
+            body.key, logger=request.state.slog, **body.parameters
+        ),
+    )
+
+
+class PrepareExperimentRequest(BaseModel):
+    key: str
+    parameters: Parameter = {}
+
+
+@app.post("/experiment/prepare")
+async def prepare_experiment(body: PrepareExperimentRequest, request: Request) -> None:
+    """Checks an experiment, compiles it and opens the window with its settings, so
+    that a following POST /experiment starts right away. The window is closed if the
+    experiment is not run within the prepare timeout. Parameters are optional, the
+    given ones are checked."""
+    await session.asyncPrepareExperiment(
         body.key, logger=request.state.slog, **body.parameters
     )
 
 
+@app.get("/runs")
+async def get_runs() -> List[RunTimeline]:
+    """Returns the timelines of the last experiment runs, from the oldest to the
+    newest. They are also sent as runsUpdate events."""
+    return session.runs()
+
+
 @app.delete("/experiment")
 async def stop_experiment(request: Request) -> None:
     session.stopExperiment(logger=request.state.slog)
@@ -215,7 +424,27 @@ def main():
 
     loop = asyncio.new_event_loop()
 
-    session = Session(root=opts["session_dir"], loop=loop, dataDir=opts["data_dir"])
+    scanWorkers = opts["scan_workers"]
+    if scanWorkers is None:
+        # each worker imports PsychoPy, which costs hundreds of MB.
+        scanWorkers = min(4, os.cpu_count() or 1)
+
+    session = Session(
+        root=opts["session_dir"],
+        loop=loop,
+        dataDir=opts["data_dir"],
+        scanWorkers=scanWorkers,
+        maxLoadedExperiments=opts["max_loaded_experiments"],
+        fileEventWindow=opts["event_window"],
+        ignoredPatterns=opts["ignore"],
+        updateInterval=opts["update_interval"],
+        maxQueuedTasks=opts["max_queued_tasks"],
+        prepareTimeout=opts["prepare_timeout"],
+    )
+    bind_session_metrics(session)
+
+    if opts["compression_level"] > 0:
+        app.add_middleware(CompressionMiddleware, level=opts["compression_level"])
 
     config = Config()
     port = opts["port"]
@@ -0,0 +1,278 @@
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# in seconds, from a fast API call to an experiment run.
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+    1800.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    labels = list(labels)
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelNames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelNames = tuple(labelNames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values, **kwargs):
+        """Returns the child metric of a set of label values."""
+        if len(kwargs) > 0:
+            values = tuple(kwargs[n] for n in self.labelNames)
+        values = tuple(str(v) for v in values)
+        if len(values) != len(self.labelNames):
+            raise ValueError(f"{self.name} expects labels {list(self.labelNames)}")
+        child = self._children.get(values)
+        if child is not None:
+            return child
+        with self._lock:
+            return self._children.setdefault(values, self._newChild())
+
+    def _newChild(self):
+        raise NotImplementedError()
+
+    def _default(self):
+        if len(self.labelNames) > 0:
+            raise ValueError(f"{self.name} expects labels {list(self.labelNames)}")
+        return self.labels()
+
+    def samples(self) -> Iterable[Tuple[str, List[Tuple[str, str]], float]]:
+        for values, child in list(self._children.items()):
+            labels = list(zip(self.labelNames, values))
+            yield from child.samples(self.name, labels)
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {_escape(self.documentation)}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class _CounterChild:
+    def __init__(self):
+        # updated from many short-lived threads, e.g. timers, any per-thread state
+        # would never be released.
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def value(self) -> float:
+        with self._lock:
+            return self._value
+
+    def samples(self, name, labels):
+        yield (name, labels, self.value())
+
+
+class Counter(_Metric):
+    """A monotonically increasing value, like a number of events."""
+
+    type = "counter"
+
+    def _newChild(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+
+class _GaugeChild:
+    def __init__(self):
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self._value = value
+
+    def setFunction(self, function: Callable[[], float]):
+        """Computes the value with function when the metrics are collected."""
+        self._function = function
+
+    def value(self) -> float:
+        if self._function is not None:
+            return self._function()
+        return self._value
+
+    def samples(self, name, labels):
+        yield (name, labels, self.value())
+
+
+class Gauge(_Metric):
+    """A value that can go up and down, like a queue depth."""
+
+    type = "gauge"
+
+    def _newChild(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self._default().set(value)
+
+    def setFunction(self, function: Callable[[], float]):
+        self._default().setFunction(function)
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._buckets = buckets
+        # one count per bucket, the +Inf bucket, then the sum of the observations.
+        self._values = [0] * (len(buckets) + 2)
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self._buckets, value)
+        with self._lock:
+            self._values[index] += 1
+            self._values[-1] += value
+
+    @contextmanager
+    def time(self):
+        """Observes the duration in seconds of the with block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self, name, labels):
+        with self._lock:
+            values = list(self._values)
+        cumulative = 0
+        for bound, count in zip(self._buckets + (math.inf,), values[:-1]):
+            cumulative += count
+            yield (
+                f"{name}_bucket",
+                labels + [("le", _format_value(bound))],
+                cumulative,
+            )
+        yield (f"{name}_sum", labels, values[-1])
+        yield (f"{name}_count", labels, cumulative)
+
+
+class Histogram(_Metric):
+    """Counts observations, like durations, in cumulative buckets.
+
+    Attributes
+    ----------
+    buckets: Tuple[float, ...]
+        the sorted upper bounds of the buckets, without +Inf.
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelNames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super(Histogram, self).__init__(name, documentation, labelNames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _newChild(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+
+class Registry:
+    """A set of metrics rendered together in the Prometheus text exposition
+    format."""
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric '{metric.name}' is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> _Metric:
+        return self._metrics[name]
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "".join(m.render() for m in metrics)
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelNames: Sequence[str] = ()) -> Counter:
+    """Creates a Counter in the default registry."""
+    return REGISTRY.register(Counter(name, documentation, labelNames))
+
+
+def gauge(name: str, documentation: str, labelNames: Sequence[str] = ()) -> Gauge:
+    """Creates a Gauge in the default registry."""
+    return REGISTRY.register(Gauge(name, documentation, labelNames))
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    labelNames: Sequence[str] = (),
+    buckets: Sequence[float] = DEFAULT_BUCKETS,
+) -> Histogram:
+    """Creates a Histogram in the default registry."""
+    return REGISTRY.register(Histogram(name, documentation, labelNames, buckets))
@@ -1,5 +1,7 @@
 import argparse
 
+from psychopy_session_webserver.file_event_handler import DEFAULT_IGNORED_PATTERNS
+
 
 def parse_options(args=None):
 
@@ -36,6 +38,78 @@ def parse_options(args=None):
         "--data-dir",
         help="directory to store the session data, default to <session_dir>/data",
     )
+    parser.add_argument(
+        "-j",
+        "--scan-workers",
+        help=(
+            "number of processes used to scan the experiments at startup, defaults to"
+            " the number of CPUs up to 4, as each process imports PsychoPy, 0 scans"
+            " them in the main process"
+        ),
+        type=int,
+    )
+    parser.add_argument(
+        "--max-loaded-experiments",
+        help="number of compiled experiments kept in memory, defaults to 8",
+        default=8,
+        type=int,
+    )
+    parser.add_argument(
+        "--event-window",
+        help=(
+            "duration in seconds filesystem events are collected before being"
+            " applied at once, defaults to 0.2"
+        ),
+        default=0.2,
+        type=float,
+    )
+    parser.add_argument(
+        "--update-interval",
+        help=(
+            "duration in seconds updates are collected and merged before being sent"
+            " to the clients, 0 sends them once per event loop iteration, defaults"
+            " to 0"
+        ),
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--max-queued-tasks",
+        help=(
+            "number of experiment runs that can wait to be started, further"
+            " requests are answered with 429, defaults to 4"
+        ),
+        default=4,
+        type=int,
+    )
+    parser.add_argument(
+        "--prepare-timeout",
+        help=(
+            "duration in seconds the window opened by a prepared experiment is kept"
+            " if the experiment is not run, defaults to 60"
+        ),
+        default=60.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--compression-level",
+        help=(
+            "level of the gzip, brotli or zstd compression of the responses, 0"
+            " disables it, defaults to 6"
+        ),
+        default=6,
+        type=int,
+    )
+    parser.add_argument(
+        "--ignore",
+        help=(
+            "glob pattern of files or directories in session_dir to ignore, a"
+            " trailing '/' only matches directories, defaults to the python files"
+            " generated by PsychoPy"
+        ),
+        default=list(DEFAULT_IGNORED_PATTERNS),
+        action=OverrideDefaultAppend,
+    )
     parser.add_argument(
         "session_dir",
         help="directory containing all .psyexp file available in the session",
@@ -0,0 +1,169 @@
+from bisect import bisect_left, bisect_right, insort
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+# substrings up to this length are looked up directly, longer ones are looked up by
+# their trigrams.
+_GRAM_SIZE = 3
+
+
+def _grams(name: str) -> Set[str]:
+    name = name.lower()
+    return {
+        name[i : i + n]
+        for n in range(1, _GRAM_SIZE + 1)
+        for i in range(len(name) - n + 1)
+    }
+
+
+class ParticipantIndex:
+    """Indexes participant names for prefix and substring lookups, and orders them by
+    last activity.
+
+    Names are kept sorted, so a prefix is found by bisection. Every substring of up to
+    three characters maps to the names containing it, longer substrings are found by
+    intersecting the names of their trigrams. Substring lookups ignore case.
+    """
+
+    def __init__(self):
+        self._names: List[str] = []
+        self._grams: Dict[str, Set[str]] = {}
+        self._activity: Dict[str, int] = {}
+        # (-activity, name), the most recently active first.
+        self._recent: List[Tuple[int, str]] = []
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._activity
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def add(self, name: str, activity: int = 0):
+        """Adds a name, or updates its activity if it is more recent."""
+        if name not in self._activity:
+            insort(self._names, name)
+            for g in _grams(name):
+                self._grams.setdefault(g, set()).add(name)
+            self._activity[name] = activity
+            insort(self._recent, (-activity, name))
+            return
+        self.touch(name, activity)
+
+    def touch(self, name: str, activity: int):
+        """Updates the activity of an indexed name, if it is more recent."""
+        previous = self._activity[name]
+        if activity <= previous:
+            return
+        i = bisect_left(self._recent, (-previous, name))
+        del self._recent[i]
+        insort(self._recent, (-activity, name))
+        self._activity[name] = activity
+
+    def activity(self, name: str) -> int:
+        return self._activity[name]
+
+    def withPrefix(self, prefix: str) -> List[str]:
+        """Returns the names starting with prefix, in order."""
+        start = bisect_left(self._names, prefix)
+        # every name with the prefix sorts before prefix + the last code point.
+        end = bisect_right(self._names, prefix + "\U0010ffff", lo=start)
+        return self._names[start:end]
+
+    def containing(self, substring: str) -> Set[str]:
+        """Returns the names containing substring, ignoring case."""
+        substring = substring.lower()
+        if len(substring) <= _GRAM_SIZE:
+            return set(self._grams.get(substring, ()))
+        trigrams = [
+            substring[i : i + _GRAM_SIZE]
+            for i in range(len(substring) - _GRAM_SIZE + 1)
+        ]
+        # starts from the rarest trigram to keep the intersections small.
+        trigrams.sort(key=lambda g: len(self._grams.get(g, ())))
+        candidates = set(self._grams.get(trigrams[0], ()))
+        for g in trigrams[1:]:
+            if len(candidates) == 0:
+                break
+            candidates &= self._grams.get(g, set())
+        return {n for n in candidates if substring in n.lower()}
+
+    def _cursor(self, sort: str, name: str) -> str:
+        if sort == "recent":
+            return f"{self._activity[name]}_{name}"
+        return name
+
+    @staticmethod
+    def _parseCursor(sort: str, cursor: str):
+        if sort == "recent":
+            activity, sep, name = cursor.partition("_")
+            if sep == "" or activity.lstrip("-").isdigit() is False:
+                raise ValueError(f"invalid cursor '{cursor}'")
+            return (-int(activity), name)
+        return cursor
+
+    def search(
+        self,
+        prefix: Optional[str] = None,
+        contains: Optional[str] = None,
+        sort: str = "name",
+        limit: int = 50,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[str], Optional[str]]:
+        """Returns a page of names matching the query, and the cursor of the next page
+        or None if it is the last one.
+
+        Parameters
+        ----------
+        prefix: Optional[str]
+            only returns the names starting with prefix.
+        contains: Optional[str]
+            only returns the names containing this substring, ignoring case.
+        sort: str
+            'name' for alphabetical order, 'recent' for the most recently active
+            first.
+        limit: int
+            the maximal number of names to return.
+        cursor: Optional[str]
+            the cursor returned with the previous page.
+        """
+        if sort not in ["name", "recent"]:
+            raise ValueError(f"invalid sort '{sort}'")
+
+        if sort == "name" and contains is None:
+            # pages through the sorted names without copying them.
+            prefix = prefix or ""
+            start = bisect_left(self._names, prefix)
+            if cursor is not None:
+                start = max(start, bisect_right(self._names, cursor))
+            page = []
+            for name in self._names[start : start + limit + 1]:
+                if name.startswith(prefix) is False:
+                    break
+                page.append(name)
+        elif sort == "recent" and prefix is None and contains is None:
+            start = 0
+            if cursor is not None:
+                start = bisect_right(self._recent, self._parseCursor(sort, cursor))
+            page = [n for _, n in self._recent[start : start + limit + 1]]
+        else:
+            if sort == "name":
+                key: Callable[[str], object] = lambda n: n
+            else:
+                key = lambda n: (-self._activity[n], n)
+            ordered = sorted(self._filtered(prefix, contains), key=key)
+            start = 0
+            if cursor is not None:
+                start = bisect_right(ordered, self._parseCursor(sort, cursor), key=key)
+            page = ordered[start : start + limit + 1]
+
+        if len(page) <= limit:
+            return page, None
+        page = page[:limit]
+        return page, self._cursor(sort, page[-1])
+
+    def _filtered(self, prefix: Optional[str], contains: Optional[str]):
+        if contains is None:
+            return self.withPrefix(prefix or "")
+        names = self.containing(contains)
+        if prefix is not None:
+            names = {n for n in names if n.startswith(prefix)}
+        return names
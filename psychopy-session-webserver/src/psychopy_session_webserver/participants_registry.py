@@ -1,10 +1,15 @@
-from glob import glob
+import os
+import threading
+import time
 from pathlib import Path
+from typing import Optional
 
 from numpy import true_divide
 from pydantic import ValidationError
 from structlog import get_logger
-from psychopy_session_webserver.types import Participant
+from psychopy_session_webserver.participant_index import ParticipantIndex
+from psychopy_session_webserver.psydat_index import PsydatEventHandler, PsydatIndex
+from psychopy_session_webserver.types import Participant, ParticipantPage
 from psychopy_session_webserver.update_broadcaster import UpdateBroadcaster
 from pydantic_core import to_json, from_json
 
@@ -13,62 +18,249 @@ from xdg import BaseDirectory
 
 
 class ParticipantRegistry:
+    """The participants known to the session, persisted in XDG_DATA_HOME.
 
-    def __init__(self, updates: UpdateBroadcaster, dataDir=None):
+    Updates are appended to a journal next to the participants file, which is fsynced
+    at most every fsyncInterval seconds. Once it holds more than compactThreshold
+    records, it is compacted by atomically rewriting the participants file.
+
+    The sessions of each participant are also counted from the .psydat files in the
+    subdirectories of dataDir, see PsydatIndex. The .psydat files created while running
+    are counted as well from the events passed to dataEventHandler, which is scheduled
+    on observer if one is given.
+
+    Participants are indexed for searches, see search(). A participant is active when
+    its next session increases. When one of its .psydat files is created or modified,
+    onData is called with its name.
+
+    Attributes
+    ----------
+    fsyncInterval: float
+        the maximal duration in seconds an update is not synced to disk.
+    compactThreshold: int
+        the number of journal records that triggers a compaction.
+    """
+
+    def __init__(
+        self,
+        updates: UpdateBroadcaster,
+        dataDir=None,
+        fsyncInterval=1.0,
+        compactThreshold=1024,
+        observer=None,
+        onData=None,
+    ):
         self._logger = get_logger().bind(module="ParticipantRegistry")
+        self._onData = onData
         self._updates = updates
         self._participants = dict[str, Participant]({})
+        self.fsyncInterval = fsyncInterval
+        self.compactThreshold = compactThreshold
+        self._lock = threading.RLock()
+        self._journal = None
+        self._journalRecords = 0
+        self._fsyncTimer = None
+        # the time in nanoseconds each participant was last active.
+        self._activity = dict[str, int]({})
         self._load_from_xdg()
-        self._update_from_data(dataDir)
+        self._open_journal()
+        self._psydat = PsydatIndex(Path(dataDir or "data"))
+        self._update_from_data()
+        self._index = ParticipantIndex()
+        for name in self._participants:
+            self._index.add(name, self._activity.get(name, 0))
         self._updates.broadcast("participants", self._participants)
+        self.dataEventHandler = PsydatEventHandler(
+            self._psydat.dataDir, self._on_data_changed, self._on_data_written
+        )
+        if observer is not None:
+            os.makedirs(self._psydat.dataDir, exist_ok=True)
+            observer.schedule(
+                self.dataEventHandler, self._psydat.dataDir, recursive=True
+            )
 
     def __setitem__(self, name: str, session: int) -> None:
-        updated = False
-        if name not in self._participants:
-            self._participants[name] = Participant(name=name, nextSession=session)
-            updated = True
+        with self._lock:
+            updated = False
+            if name not in self._participants:
+                self._participants[name] = Participant(name=name, nextSession=session)
+                updated = True
 
-        if updated == False and self._participants[name].update(session) == False:
-            return
+            if updated == False and self._participants[name].update(session) == False:
+                return
 
-        self._save_to_xdg()
-        self._updates.broadcastDict("participants", name, self._participants[name])
+            self._activity[name] = time.time_ns()
+            self._index.add(name, self._activity[name])
+            self._append_to_journal(self._participants[name])
+            self._updates.broadcastDict("participants", name, self._participants[name])
 
     def __getitem__(self, name: str) -> Participant:
         return self._participants[name]
 
+    def search(
+        self,
+        prefix: Optional[str] = None,
+        contains: Optional[str] = None,
+        sort: str = "name",
+        limit: int = 50,
+        cursor: Optional[str] = None,
+    ) -> ParticipantPage:
+        """Returns a page of the participants matching a query, see
+        ParticipantIndex.search()."""
+        with self._lock:
+            names, nextCursor = self._index.search(
+                prefix=prefix, contains=contains, sort=sort, limit=limit, cursor=cursor
+            )
+            return ParticipantPage(
+                participants=[self._participants[n] for n in names],
+                nextCursor=nextCursor,
+            )
+
+    def _record(self, participant: Participant) -> dict:
+        return {
+            **participant.model_dump(),
+            "lastActive": self._activity.get(participant.name, 0),
+        }
+
     _filepath = Path(
         BaseDirectory.save_data_path("psychopy_session_webserver")
     ).joinpath("participants.json")
 
+    @staticmethod
+    def _journalpath() -> Path:
+        return ParticipantRegistry._filepath.with_suffix(".journal")
+
     def _load_from_xdg(self):
-        if ParticipantRegistry._filepath.exists() == False:
-            return
-        self._logger.info(
-            "opening persistent file", path=str(ParticipantRegistry._filepath)
-        )
-        with open(ParticipantRegistry._filepath, "r") as f:
-            for k, v in from_json(f.read()).items():
-                try:
-                    self._participants[k] = Participant(**v)
-                except ValidationError as e:
-                    self._logger.warn("invalid data", key=k, **v)
+        if ParticipantRegistry._filepath.exists() == True:
+            self._logger.info(
+                "opening persistent file", path=str(ParticipantRegistry._filepath)
+            )
+            with open(ParticipantRegistry._filepath, "r") as f:
+                for k, v in from_json(f.read()).items():
+                    try:
+                        self._participants[k] = Participant(**v)
+                    except ValidationError as e:
+                        self._logger.warn("invalid data", key=k, **v)
+                        continue
+                    self._activity[k] = v.get("lastActive", 0)
 
-    def _save_to_xdg(self):
-        with open(ParticipantRegistry._filepath, "wb") as f:
-            f.write(to_json(self._participants, indent=2))
+        self._journalRecords = self._replay_journal()
+
+    def _replay_journal(self) -> int:
+        try:
+            with open(ParticipantRegistry._journalpath(), "rb") as f:
+                lines = f.read().split(b"\n")
+        except FileNotFoundError:
+            return 0
+
+        records = 0
+        for i, line in enumerate(lines):
+            if len(line) == 0:
+                continue
+            try:
+                record = from_json(line)
+                p = Participant(**record)
+            except (ValueError, ValidationError, TypeError) as e:
+                # the last record may have been cut by a crash.
+                if i != len(lines) - 1:
+                    self._logger.warn("invalid journal record", line=i + 1, error=e)
+                continue
+            records += 1
+            self._activity[p.name] = max(
+                self._activity.get(p.name, 0), record.get("lastActive", 0)
+            )
+            if p.name not in self._participants:
+                self._participants[p.name] = p
+            else:
+                self._participants[p.name].update(p.nextSession)
+        return records
+
+    def _open_journal(self):
+        # the journal is compacted on startup, so appends never follow a record cut
+        # by a crash.
+        journal = ParticipantRegistry._journalpath()
+        if journal.exists() and journal.stat().st_size > 0:
+            self._compact()
+        else:
+            self._journal = open(ParticipantRegistry._journalpath(), "ab")
+
+    def _append_to_journal(self, participant: Participant):
+        with self._lock:
+            self._journal.write(to_json(self._record(participant)) + b"\n")
+            self._journal.flush()
+            self._journalRecords += 1
+            if self._journalRecords >= self.compactThreshold:
+                self._compact()
+            elif self._fsyncTimer is None:
+                self._fsyncTimer = threading.Timer(self.fsyncInterval, self._fsync)
+                self._fsyncTimer.daemon = True
+                self._fsyncTimer.start()
+
+    def _fsync(self):
+        with self._lock:
+            self._fsyncTimer = None
+            if self._journal is not None:
+                os.fsync(self._journal.fileno())
 
-    def _update_from_data(self, dataDir):
-        nextSessionBounds = {}
-        for f in glob(str(Path(dataDir or "data").joinpath("**/*.psydat"))):
-            # this formula below is only valid when Participant.name validation forbids
-            # the use of '_' in the name, this is the case as it as a pattern
-            # r'^[a-zA-Z0-9\-]+$' set.
-            name = Path(f).stem.split("_")[0]
+    def _compact(self):
+        self._save_to_xdg()
+        if self._journal is not None:
+            self._journal.close()
+        # the snapshot is durable, the journal can be emptied.
+        self._journal = open(ParticipantRegistry._journalpath(), "wb")
+        self._journalRecords = 0
+        self._logger.debug("compacted journal", participants=len(self._participants))
+
+    def _save_to_xdg(self):
+        path = ParticipantRegistry._filepath
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            f.write(
+                to_json(
+                    {k: self._record(p) for k, p in self._participants.items()},
+                    indent=2,
+                )
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        # makes the rename durable.
+        fd = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
 
-            nextSessionBounds[name] = nextSessionBounds.get(name, 1) + 1
+    def close(self):
+        """Syncs the pending updates to disk and closes the journal."""
+        with self._lock:
+            if self._fsyncTimer is not None:
+                self._fsyncTimer.cancel()
+                self._fsyncTimer = None
+            if self._journal is None:
+                return
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._journal.close()
+            self._journal = None
 
-        for name, nextSession in nextSessionBounds.items():
+    def _update_from_data(self):
+        for name, count in self._psydat.scan().items():
             if name not in self._participants:
                 self._participants[name] = Participant(name=name, nextSession=1)
-            self._participants[name].update(nextSession)
+            self._participants[name].update(count + 1)
+            self._activity[name] = max(
+                self._activity.get(name, 0), self._psydat.latest.get(name, 0)
+            )
+
+    def _on_data_changed(self, subdir):
+        with self._lock:
+            for name, count in self._psydat.rescan(subdir).items():
+                try:
+                    self[name] = count + 1
+                except ValidationError:
+                    self._logger.warn("invalid participant", name=name)
+
+    def _on_data_written(self, name):
+        if self._onData is not None and name in self._participants:
+            self._onData(name)
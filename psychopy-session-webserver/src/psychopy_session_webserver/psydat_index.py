@@ -0,0 +1,190 @@
+import hashlib
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+from pydantic import BaseModel, ValidationError
+from pydantic_core import from_json, to_json
+from structlog import get_logger
+from watchdog.events import FileSystemEvent, FileSystemEventHandler
+from xdg import BaseDirectory
+
+
+def participant_name(filename: str) -> str:
+    # this formula below is only valid when Participant.name validation forbids the
+    # use of '_' in the name, this is the case as it as a pattern r'^[a-zA-Z0-9\-]+$'
+    # set.
+    return Path(filename).stem.split("_")[0]
+
+
+class DirectoryEntry(BaseModel):
+    """The .psydat files of a data subdirectory.
+
+    Attributes
+    ----------
+    mtime: int
+        the modification time of the directory in nanoseconds when it was scanned.
+    counts: Dict[str, int]
+        the number of .psydat files of each participant.
+    latest: Dict[str, int]
+        the modification time in nanoseconds of the latest .psydat file of each
+        participant.
+    """
+
+    mtime: int
+    counts: Dict[str, int]
+    latest: Dict[str, int] = {}
+
+
+class PsydatIndex:
+    """Counts the .psydat files of each participant in the subdirectories of a data
+    directory.
+
+    The counts are persisted per subdirectory with its modification time, so only the
+    subdirectories where files were added or removed are scanned again.
+    """
+
+    _dirpath = Path(BaseDirectory.save_cache_path("psychopy_session_webserver"))
+
+    def __init__(self, dataDir):
+        self.dataDir = Path(dataDir)
+        self._logger = get_logger().bind(module="PsydatIndex", dataDir=str(dataDir))
+        digest = hashlib.sha1(str(self.dataDir.resolve()).encode("utf-8")).hexdigest()
+        self._filename = f"psydat-{digest}.json"
+        self._entries: Dict[str, DirectoryEntry] = {}
+        self.totals: Dict[str, int] = {}
+        self.latest: Dict[str, int] = {}
+
+    @property
+    def filepath(self) -> Path:
+        return PsydatIndex._dirpath.joinpath(self._filename)
+
+    def load(self):
+        try:
+            with open(self.filepath, "rb") as f:
+                data = from_json(f.read())
+            self._entries = {k: DirectoryEntry(**v) for k, v in data.items()}
+        except FileNotFoundError:
+            pass
+        except (ValueError, ValidationError) as e:
+            self._logger.warn("invalid index", error=e)
+            self._entries = {}
+
+    def save(self):
+        os.makedirs(PsydatIndex._dirpath, exist_ok=True)
+        tmp = self.filepath.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            f.write(to_json(self._entries))
+        os.replace(tmp, self.filepath)
+
+    def scan(self) -> Dict[str, int]:
+        """Updates the index from the data directory and returns the number of .psydat
+        files of each participant."""
+        self.load()
+        try:
+            subdirs = [e for e in os.scandir(self.dataDir) if e.is_dir()]
+        except FileNotFoundError:
+            subdirs = []
+
+        modified = len(subdirs) != len(self._entries)
+        entries = {}
+        rescanned = 0
+        for d in subdirs:
+            mtime = d.stat().st_mtime_ns
+            entry = self._entries.get(d.name)
+            if entry is None or entry.mtime != mtime:
+                entry = self._scanDirectory(d.path, mtime)
+                modified = True
+                rescanned += 1
+            entries[d.name] = entry
+        self._entries = entries
+        self._logger.debug(
+            "scanned data directory", directories=len(entries), rescanned=rescanned
+        )
+
+        self.totals = {}
+        self.latest = {}
+        for entry in self._entries.values():
+            for name, count in entry.counts.items():
+                self.totals[name] = self.totals.get(name, 0) + count
+            for name, mtime in entry.latest.items():
+                self.latest[name] = max(self.latest.get(name, 0), mtime)
+
+        if modified:
+            self.save()
+        return self.totals
+
+    def _scanDirectory(self, path, mtime) -> DirectoryEntry:
+        counts = {}
+        latest = {}
+        for e in os.scandir(path):
+            if e.name.endswith(".psydat") and e.is_file():
+                name = participant_name(e.name)
+                counts[name] = counts.get(name, 0) + 1
+                latest[name] = max(latest.get(name, 0), e.stat().st_mtime_ns)
+        return DirectoryEntry(mtime=mtime, counts=counts, latest=latest)
+
+    def rescan(self, subdir) -> Dict[str, int]:
+        """Scans again a subdirectory of the data directory and returns the updated
+        totals of the participants whose count changed."""
+        path = self.dataDir.joinpath(subdir)
+        try:
+            entry = self._scanDirectory(path, path.stat().st_mtime_ns)
+        except FileNotFoundError:
+            entry = DirectoryEntry(mtime=0, counts={})
+        previous = self._entries.get(subdir, DirectoryEntry(mtime=0, counts={}))
+        self._entries[subdir] = entry
+
+        changed = {}
+        for name in set(previous.counts) | set(entry.counts):
+            diff = entry.counts.get(name, 0) - previous.counts.get(name, 0)
+            if diff == 0:
+                continue
+            self.totals[name] = self.totals.get(name, 0) + diff
+            changed[name] = self.totals[name]
+        # the next start does not need to scan it again.
+        self.save()
+        return changed
+
+
+class PsydatEventHandler(FileSystemEventHandler):
+    """Notifies the changes of the .psydat files in the subdirectories of a data
+    directory.
+
+    onChange is called with the subdirectory where .psydat files were added or
+    removed, and onWritten with the participant whose .psydat file was created or
+    modified.
+    """
+
+    def __init__(self, dataDir, onChange, onWritten=None):
+        self._dataDir = Path(dataDir)
+        self._onChange = onChange
+        self._onWritten = onWritten
+
+    def _subdir(self, path) -> Optional[str]:
+        path = Path(path)
+        if path.suffix != ".psydat" or path.parent.parent != self._dataDir:
+            return None
+        return path.parent.name
+
+    def on_any_event(self, event: FileSystemEvent):
+        if event.is_directory or event.event_type not in [
+            "created",
+            "modified",
+            "moved",
+            "deleted",
+        ]:
+            return
+        paths = [event.src_path]
+        if event.event_type == "moved":
+            paths.append(event.dest_path)
+        if event.event_type != "modified":
+            for subdir in set(self._subdir(p) for p in paths):
+                if subdir is not None:
+                    self._onChange(subdir)
+        if (
+            event.event_type in ["created", "modified"]
+            and self._onWritten is not None
+            and self._subdir(event.src_path) is not None
+        ):
+            self._onWritten(participant_name(event.src_path))
@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from structlog import get_logger
+
+from psychopy_session_webserver.types import RunTimeline
+from psychopy_session_webserver.update_broadcaster import UpdateBroadcaster
+
+
+class RunHistory:
+    """The timelines of the last experiment runs, broadcast in the 'runs' store.
+
+    Each step of a run is recorded with mark(), which broadcasts the updated
+    timeline. Only the last size runs are kept.
+
+    Attributes
+    ----------
+    size: int
+        the number of runs kept.
+    """
+
+    def __init__(self, updates: UpdateBroadcaster, size: int = 64):
+        self._logger = get_logger().bind(module="RunHistory")
+        self._updates = updates
+        self.size = size
+        self._lock = threading.Lock()
+        self._runs: OrderedDict[int, RunTimeline] = OrderedDict()
+        self._nextId = 1
+        self._updates.broadcast("runs", {})
+
+    def start(
+        self,
+        experiment: str,
+        requested: int,
+        participant=None,
+        session=None,
+        revision: Optional[int] = None,
+    ) -> int:
+        """Records a new run whose request was received at requested and was just
+        prepared, and returns its id."""
+        with self._lock:
+            run = RunTimeline(
+                id=self._nextId,
+                experiment=experiment,
+                revision=revision,
+                participant=str(participant) if participant is not None else None,
+                session=int(session) if session is not None else None,
+                requested=requested,
+                prepared=time.time_ns(),
+            )
+            self._nextId += 1
+            self._runs[run.id] = run
+            evicted = []
+            while len(self._runs) > self.size:
+                evicted.append(self._runs.popitem(last=False)[0])
+            self._broadcast(run)
+            for id in evicted:
+                self._updates.broadcastDict("runs", str(id), None)
+        return run.id
+
+    def mark(self, id: int, step: str, at: Optional[int] = None, **kwargs) -> None:
+        """Records the time of a step of a run, unless it was already recorded.
+
+        Parameters
+        ----------
+        id: int
+            the run id.
+        step: str
+            the RunTimeline field of the step, e.g. 'firstFrame'.
+        at: Optional[int]
+            the time of the step in nanoseconds, now if None.
+        kwargs:
+            other fields to update, like error.
+        """
+        at = at or time.time_ns()
+        with self._lock:
+            run = self._runs.get(id)
+            if run is None or getattr(run, step) is not None:
+                return
+            # the broadcast timelines are shared with the subscribers and never
+            # modified.
+            run = run.model_copy(update={step: at, **kwargs})
+            self._runs[id] = run
+            self._broadcast(run)
+
+    def dataSaved(self, participant: str) -> None:
+        """Records that a data file of participant was written, for its last started
+        run."""
+        with self._lock:
+            ids = [
+                run.id
+                for run in reversed(self._runs.values())
+                if run.participant == participant and run.started is not None
+            ]
+        if len(ids) > 0:
+            self.mark(ids[0], "dataSaved")
+
+    def runs(self) -> List[RunTimeline]:
+        with self._lock:
+            return list(self._runs.values())
+
+    def _broadcast(self, run: RunTimeline) -> None:
+        self._logger.debug("run updated", run=run)
+        self._updates.broadcastDict("runs", str(run.id), run)
@@ -1,35 +1,114 @@
 import asyncio
 import importlib
 import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from gettext import Catalog
 from glob import glob
 from pathlib import Path
-from queue import Queue
 from typing import Dict, Optional
 
 import structlog
+from pydantic_core import to_json
 from watchdog import observers
 
+from psychopy_session_webserver import metrics
 from psychopy_session_webserver.async_task_runner import AsyncTaskRunner
+from psychopy_session_webserver.catalog_snapshot import CatalogSnapshot, SnapshotEntry
 from psychopy_session_webserver.dependency_checker import DependencyChecker
-from psychopy_session_webserver.file_event_handler import FileEventHandler
+from psychopy_session_webserver.experiment_cache import (
+    CachedExperiment,
+    ExperimentCache,
+    resource_paths,
+)
+from psychopy_session_webserver.experiment_scanner import ExperimentScanner
+from psychopy_session_webserver.file_event_handler import (
+    DEFAULT_IGNORED_PATTERNS,
+    FileEventHandler,
+    PathFilter,
+)
+from psychopy_session_webserver.frame_monitor import FrameMonitor
 from psychopy_session_webserver.participants_registry import ParticipantRegistry
-from psychopy_session_webserver.types import Catalog, Experiment, Participant
+from psychopy_session_webserver.run_history import RunHistory
+from psychopy_session_webserver.types import (
+    Catalog,
+    Experiment,
+    FrameStats,
+    Participant,
+    ParticipantPage,
+)
 from psychopy_session_webserver.update_broadcaster import UpdateBroadcaster
 
+# the window is reopened when an experiment differs from the one that opened it in one
+# of these settings.
+WINDOW_SETTINGS = [
+    "Full-screen window",
+    "Window size (pixels)",
+    "Screen",
+    "Monitor",
+    "winBackend",
+    "Units",
+    "color",
+    "colorSpace",
+    "blendMode",
+]
+
+_EXPERIMENT_PHASES = metrics.histogram(
+    "psychopy_session_experiment_phase_seconds",
+    "Duration of the checks before a run (prepare), of opening the window (window),"
+    " of a preparation ahead of a run (preload) and of the runs themselves (run).",
+    ["phase"],
+)
+
 
 class Session(AsyncTaskRunner):
 
-    def __init__(self, root, session=None, loop=None, dataDir=None, logger=None):
+    def __init__(
+        self,
+        root,
+        session=None,
+        loop=None,
+        dataDir=None,
+        logger=None,
+        scanWorkers=0,
+        maxLoadedExperiments=8,
+        fileEventWindow=0.0,
+        ignoredPatterns=DEFAULT_IGNORED_PATTERNS,
+        updateInterval=None,
+        maxQueuedTasks=None,
+        prepareTimeout=60.0,
+    ):
         root = Path(root).resolve()
         self._root = str(root)
         self.logger = None
         self.logger = self._bind_logger(logger)
-        super(Session, self).__init__(logger=self.logger)
+        super(Session, self).__init__(logger=self.logger, maxQueuedTasks=maxQueuedTasks)
 
         self._resourceChecker = DependencyChecker(root)
+        self._cache = ExperimentCache()
         self._experiments = {}
+        self._lock = threading.RLock()
+        # serialises changes to the experiments compiled in self._session
+        self._compileLock = threading.RLock()
+        # compilations triggered by file changes are done in a single background
+        # thread, a newer request for the same key supersedes older ones.
+        self._compiler = ThreadPoolExecutor(max_workers=1)
+        self._generations = {}
+        self._scanner = None
+        self._snapshot = CatalogSnapshot(root, environment=self._cache.environment)
+        self._snapshotEntries = {}
+        self._snapshotTimer = None
+        self._scanThread = None
+        # keys of the experiments actually compiled in self._session, from the least
+        # to the most recently used.
+        self._loaded = OrderedDict()
+        # loaded experiments whose unloading waits for the end of their run.
+        self._stale = set()
+        self.maxLoadedExperiments = maxLoadedExperiments
         if session is None:
             from psychopy import session
 
@@ -37,22 +116,144 @@ class Session(AsyncTaskRunner):
         else:
             self._session = session
 
-        self._updates = UpdateBroadcaster(loop)
-        self._tasks = Queue()
+        self._updates = UpdateBroadcaster(loop, coalesceInterval=updateInterval)
 
         self._currentExperiment = None
         self._updates.broadcast("experiment", "")
         self._updates.broadcast("window", False)
         self._updates.broadcast("catalog", {})
-        self._participants = ParticipantRegistry(self._updates, dataDir=dataDir)
 
         self._observer = observers.Observer()
-        self._event_handler = FileEventHandler(session=self, root=root)
+        # PsychoPy data files are written in the session directory by default, and
+        # are frequently flushed during a run.
+        self._dataDir = Path(dataDir or root.joinpath("data")).resolve()
+        self._runs = RunHistory(self._updates)
+        self._currentRun = None
+        # the frame rate of the window, see FrameMonitor. It is measured once for each
+        # screen, as measuring it takes about a second.
+        self._frameRate = None
+        self._frameRates: Dict[Optional[str], float] = {}
+        # the settings of the experiment that opened the window.
+        self._windowSettings = None
+        # the experiment prepared with prepareExperiment(), and if it opened the
+        # window.
+        self.prepareTimeout = prepareTimeout
+        self._prepared = None
+        self._preparedWindow = False
+        self._preparedTimer = None
+        # identifies each prepareExperiment() call, so that an expired timer does
+        # not release a later one.
+        self._preparedGeneration = 0
+        # a data directory in the session directory is already watched, its events
+        # are forwarded by the FileEventHandler.
+        dataInRoot = root in self._dataDir.parents
+        self._participants = ParticipantRegistry(
+            self._updates,
+            dataDir=self._dataDir,
+            observer=None if dataInRoot else self._observer,
+            onData=self._runs.dataSaved,
+        )
+        if dataInRoot:
+            os.makedirs(self._dataDir, exist_ok=True)
+        self._event_handler = FileEventHandler(
+            session=self,
+            root=root,
+            window=fileEventWindow,
+            ignore=PathFilter(
+                root=root, directories=[self._dataDir], patterns=ignoredPatterns
+            ),
+            dataDir=self._dataDir,
+            dataHandler=self._participants.dataEventHandler if dataInRoot else None,
+        )
         self._observer.schedule(self._event_handler, root, recursive=True)
         self._observer.start()
 
-        for p in glob("**/*.psyexp", root_dir=root, recursive=True):
-            self.addExperiment(file=p)
+        # serves the last known catalog right away, it is reconciled with the
+        # filesystem afterwards.
+        snapshot = self._snapshot.load()
+        for key, entry in snapshot.items():
+            self._publishExperiment(key, entry, cached=True)
+
+        if scanWorkers == 0:
+            self._scanExperiments(snapshot, scanWorkers)
+        else:
+            self._scanThread = threading.Thread(
+                target=self._scanExperiments, args=(snapshot, scanWorkers), daemon=True
+            )
+            self._scanThread.start()
+
+    def _scanExperiments(self, snapshot, workers):
+        files = glob("**/*.psyexp", root_dir=self._root, recursive=True)
+        for key in snapshot.keys() - set(files):
+            try:
+                self.removeExperiment(key)
+            except KeyError:
+                pass
+
+        if workers > 0:
+            self._scanner = ExperimentScanner(workers)
+
+        for key in files:
+            file = Path(self._root).joinpath(key)
+            try:
+                stat = os.stat(file)
+            except FileNotFoundError:
+                continue
+            if key in snapshot and snapshot[key].matches(stat):
+                continue
+
+            if self._scanner is None:
+                self.addExperiment(file=key)
+                continue
+
+            with self._lock:
+                generation = self._generations.get(key, 0) + 1
+                self._generations[key] = generation
+            digest = self._cache.digest(file, key)
+            entry = self._cache.get(digest)
+            if entry is not None:
+                self._publishScanned(key, generation, entry, stat, cached=True)
+                continue
+            self._scanner.submit(
+                file, partial(self._onScanned, key, digest, generation, stat)
+            )
+
+        if self._scanner is not None:
+            self._scanner.shutdown()
+
+    def _onScanned(self, key, digest, generation, stat, future):
+        try:
+            entry = future.result()
+        except Exception as err:
+            self._bind_logger().error("could not scan experiment", key=key, error=err)
+            return
+
+        self._cache.put(digest, entry)
+        self._publishScanned(key, generation, entry, stat, cached=False)
+
+    def _publishScanned(self, key, generation, entry, stat, cached):
+        with self._lock:
+            # the file was modified or removed while it was scanned, the newer
+            # version is published by the file event handler instead.
+            if self._superseded(key, generation):
+                self._bind_logger().debug("superseded", key=key)
+                return
+            self._publishExperiment(
+                key, SnapshotEntry.fromStat(entry, stat), cached=cached
+            )
+
+    def _scheduleSnapshot(self):
+        if self._snapshotTimer is not None:
+            return
+        self._snapshotTimer = threading.Timer(5.0, self._saveSnapshot)
+        self._snapshotTimer.daemon = True
+        self._snapshotTimer.start()
+
+    def _saveSnapshot(self):
+        with self._lock:
+            self._snapshotTimer = None
+            entries = dict(self._snapshotEntries)
+        self._snapshot.save(entries)
 
     def _bind_logger(self, logger=None):
         if logger is not None:
@@ -69,6 +270,13 @@ class Session(AsyncTaskRunner):
     def participants(self) -> Dict[str, Participant]:
         return self._participants._participants
 
+    def searchParticipants(self, **kwargs) -> ParticipantPage:
+        return self._participants.search(**kwargs)
+
+    def encodedStore(self, name: str):
+        """Returns the ETag and the JSON encoding of 'catalog' or 'participants'."""
+        return self._updates.body(name)
+
     def closeWindow(self, logger=None):
         if self._session.win is None:
             raise RuntimeError("window is already closed")
@@ -78,21 +286,126 @@ class Session(AsyncTaskRunner):
 
         self._session.win.close()
         self._session.win = None
+        self._frameRate = None
+        self._windowSettings = None
         self._bind_logger(logger).info("closed window")
         self._updates.broadcast("window", False)
 
-    @AsyncTaskRunner.in_loop()
+    @AsyncTaskRunner.in_loop(lane=AsyncTaskRunner.Lane.CONTROL)
     def asyncCloseWindow(self, logger=None):
         self.closeWindow(logger)
 
-    def addExperiment(self, file, key=None):
+    def addExperiment(self, file, key=None, blocking=True):
         if Path(file).is_absolute() is False:
             file = Path(self._session.root).joinpath(file)
 
         if key is None:
             key = str(Path(file).relative_to(self._session.root))
 
+        with self._lock:
+            generation = self._generations.get(key, 0) + 1
+            self._generations[key] = generation
+
+        if blocking:
+            self._addExperiment(file, key, generation)
+            return
+
+        future = self._compiler.submit(self._addExperiment, file, key, generation)
+        future.add_done_callback(partial(self._onCompiled, key))
+
+    def _onCompiled(self, key, future):
+        if future.cancelled():
+            return
+        err = future.exception()
+        if err is not None:
+            self._bind_logger().error("could not add experiment", key=key, error=err)
+
+    def _superseded(self, key, generation):
+        return self._generations.get(key) != generation
+
+    def updateExperiments(self, added=(), removed=()):
+        """Adds and removes experiments after file changes.
+
+        The added experiments are compiled in the background, and all the changes are
+        broadcast in a single catalog update once they are done.
+        """
+        changes = {}
+        with self._lock:
+            for key in removed:
+                if self._removeExperimentLocked(key):
+                    changes[key] = None
+            jobs = []
+            for key in added:
+                generation = self._generations.get(key, 0) + 1
+                self._generations[key] = generation
+                jobs.append((Path(self._session.root).joinpath(key), key, generation))
+
+        # changes are broadcast in the order of the compilations they follow.
+        future = self._compiler.submit(self._addExperiments, jobs, changes)
+        future.add_done_callback(partial(self._onCompiled, list(added)))
+
+    def _addExperiments(self, jobs, changes):
+        for file, key, generation in jobs:
+            try:
+                self._addExperiment(file, key, generation, changes=changes)
+            except FileNotFoundError:
+                # a temporary file, its removal comes with the next changes.
+                self._bind_logger().debug("experiment disappeared", key=key)
+            except Exception as err:
+                self._bind_logger().error(
+                    "could not add experiment", key=key, error=err
+                )
+        self._updates.broadcastDictItems("catalog", changes)
+
+    def _addExperiment(self, file, key, generation, changes=None):
+        if self._superseded(key, generation):
+            return
+
+        stat = os.stat(file)
+        digest = self._cache.digest(file, key)
+        entry = self._cache.get(digest)
+        cached = entry is not None
+        if not cached:
+            entry = self._compileExperiment(file, key)
+            self._cache.put(digest, entry)
+
+        with self._lock:
+            # a newer version was requested while this one was compiled: it will be
+            # published instead.
+            if self._superseded(key, generation):
+                self._bind_logger().debug("superseded", key=key)
+                return
+            if cached:
+                # A previous version may have been compiled, it will be compiled
+                # again once it is needed.
+                self._unloadExperiment(key)
+            self._publishExperiment(
+                key, SnapshotEntry.fromStat(entry, stat), cached=cached, changes=changes
+            )
+
+    def _publishExperiment(self, key, entry: SnapshotEntry, cached, changes=None):
+        """Adds an experiment to the catalog, and broadcasts it unless changes is given,
+        in which case it is added to changes."""
+        with self._lock:
+            self._resourceChecker.addDependencies(key, entry.experiment.resources)
+            self._experiments[key] = self._buildExperimentInfo(key, entry.experiment)
+            self._snapshotEntries[key] = entry
+            self._scheduleSnapshot()
+            self._bind_logger().info("added experiment", key=key, cached=cached)
+            if changes is None:
+                self._updates.broadcastDict("catalog", key, self._experiments[key])
+            else:
+                changes[key] = self._experiments[key]
+
+    def _compileExperiment(self, file, key) -> CachedExperiment:
+        with self._compileLock:
+            return self._compileExperimentLocked(file, key)
+
+    def _compileExperimentLocked(self, file, key) -> CachedExperiment:
         self._session.addExperiment(file, key)
+        self._loaded[key] = True
+        self._stale.discard(key)
+        self._evictExperiments(keep=key)
 
         # Fixing a very bug because of how psychopy is built. If the experiment has
         # runned already, the expInfo object in the module has many value set, which
@@ -105,37 +418,80 @@ class Session(AsyncTaskRunner):
             pass
         resources = self._session.experimentObjects[key].getResourceFiles()
 
-        self._resourceChecker.addDependencies(
-            key,
-            [
-                r["rel"] if r["rel"].startswith("..") == False else r["abs"]
-                for r in resources
-            ],
+        return CachedExperiment(
+            resources=resource_paths(resources),
+            expInfo=self._session.getExpInfoFromExperiment(key, sessionParams=False),
         )
-        self._experiments[key] = self._buildExperimentInfo(key)
-        self._bind_logger().info("added experiment", key=key)
-        self._updates.broadcastDict("catalog", key, self._experiments[key])
-
-    def _buildExperimentInfo(self, key):
-        expInfo = self._session.getExpInfoFromExperiment(key, sessionParams=False)
 
+    def _loadExperiment(self, key):
+        with self._compileLock:
+            if key in self._loaded and key not in self._stale:
+                self._loaded.move_to_end(key)
+                return
+            self._bind_logger().info("compiling experiment", key=key)
+            self._compileExperiment(Path(self._session.root).joinpath(key), key)
+
+    def _unloadExperiment(self, key):
+        with self._compileLock:
+            self._unloadExperimentLocked(key)
+
+    def _running(self):
+        return {self._currentExperiment, self._session.currentExperiment} - {None}
+
+    def _unloadExperimentLocked(self, key):
+        if key not in self._loaded:
+            return
+        if key in self._running():
+            # the module of a running experiment is still in use.
+            self._stale.add(key)
+            return
+        self._stale.discard(key)
+        del self._loaded[key]
+        self._session.experimentObjects.pop(key, None)
+        module = self._session.experiments.pop(key, None)
+        # the module must also be forgotten by the import system to be garbage
+        # collected.
+        name = getattr(module, "__name__", None)
+        if name is not None:
+            sys.modules.pop(name, None)
+
+    def _evictExperiments(self, keep):
+        with self._compileLock:
+            for key in list(self._stale):
+                self._unloadExperimentLocked(key)
+            inUse = self._running() | {keep}
+            evictable = [k for k in self._loaded if k not in inUse]
+            count = max(len(self._loaded) - self.maxLoadedExperiments, 0)
+            for key in evictable[:count]:
+                self._bind_logger().debug("evicting experiment", key=key)
+                self._unloadExperimentLocked(key)
+
+    def _buildExperimentInfo(self, key, entry: CachedExperiment):
         return Experiment(
             key=key,
             resources=self._resourceChecker.collections[key].resources,
-            parameters=[p for p in expInfo if str(p).endswith("|hid") is False],
+            parameters=entry.parameters,
         )
 
     def removeExperiment(self, key):
+        with self._lock:
+            if self._removeExperimentLocked(key) is False:
+                raise KeyError(key)
+            self._updates.broadcastDict("catalog", key, None)
+
+    def _removeExperimentLocked(self, key) -> bool:
+        # cancels any pending compilation of the key
+        self._generations[key] = self._generations.get(key, 0) + 1
         if key not in self._experiments:
-            raise KeyError(key)
+            return False
         self._resourceChecker.removeDependencies(key)
         del self._experiments[key]
-        del self._session.experimentObjects[key]
-        del self._session.experiments[key]
-        self._updates.broadcastDict("catalog", key, None)
+        self._snapshotEntries.pop(key, None)
+        self._scheduleSnapshot()
+        self._unloadExperiment(key)
+        return True
 
-    def _prepareExperiment(self, key: str, *, logger, **kwargs):
-        logger.debug("preparing", current=self._currentExperiment)
+    def _checkExperiment(self, key: str, parameters, partial=False):
         if key not in self._experiments:
             raise RuntimeError(f"unknown experiment '{key}'")
 
@@ -145,13 +501,13 @@ class Session(AsyncTaskRunner):
             )
 
         missingParameters = [
-            k for k in self._experiments[key].parameters if k not in kwargs
+            k for k in self._experiments[key].parameters if k not in parameters
         ]
-        if len(missingParameters) > 0:
+        if len(missingParameters) > 0 and partial is False:
             raise RuntimeError(f"missing required parameter(s) {missingParameters}")
 
         invalidParameters = [
-            k for k in kwargs if k not in self._experiments[key].parameters
+            k for k in parameters if k not in self._experiments[key].parameters
         ]
         if len(invalidParameters) > 0:
             raise RuntimeError(f"invalid experiment parameter(s) {invalidParameters}")
@@ -162,95 +518,356 @@ class Session(AsyncTaskRunner):
                 f"{self._resourceChecker.collections[key].missing}"
             )
 
+    def _prepareExperiment(self, key: str, *, logger, **kwargs):
+        start = time.perf_counter()
+        logger.debug("preparing", current=self._currentExperiment)
+        self._checkExperiment(key, kwargs)
+
+        self._loadExperiment(key)
+        expInfo = self._buildExpInfo(key, kwargs)
+
+        _EXPERIMENT_PHASES.labels("prepare").observe(time.perf_counter() - start)
+        return expInfo
+
+    async def _asyncPrepareExperiment(self, key: str, *, logger, **kwargs):
+        start = time.perf_counter()
+        logger.debug("preparing", current=self._currentExperiment)
+        self._checkExperiment(key, kwargs)
+
+        # an evicted experiment is compiled again, which must not block the event
+        # loop.
+        await asyncio.get_running_loop().run_in_executor(
+            self._compiler, self._loadExperiment, key
+        )
+        expInfo = self._buildExpInfo(key, kwargs)
+
+        _EXPERIMENT_PHASES.labels("prepare").observe(time.perf_counter() - start)
+        return expInfo
+
+    def _buildExpInfo(self, key: str, parameters):
         expInfo = self._session.getExpInfoFromExperiment(key, sessionParams=False)
-        expInfo.update(kwargs)
+        expInfo.update(parameters)
 
         if int(expInfo.get("session", 1)) < 1:
             raise RuntimeError(
                 f"session value should be at least 1 (got: {expInfo['session']})"
             )
+        return expInfo
 
+    def _registerSession(self, expInfo):
         if "participant" in expInfo and "session" in expInfo:
             self._participants[expInfo["participant"]] = int(expInfo["session"]) + 1
 
-        return expInfo
+    def _startRun(self, key, expInfo, requested: int) -> int:
+        entry = self._snapshotEntries.get(key, None)
+        return self._runs.start(
+            key,
+            requested=requested,
+            participant=expInfo.get("participant", None),
+            session=expInfo.get("session", None),
+            revision=entry.mtime if entry is not None else None,
+        )
 
     def _runExperiment(
-        self, key, *, expInfo, logger, earlyFuture: Optional[asyncio.Future] = None
+        self,
+        key,
+        *,
+        expInfo,
+        logger,
+        run: int,
+        earlyFuture: Optional[asyncio.Future] = None,
     ):
-        if self._session.win is None:
-            logger.debug("opening window")
-            self._session.setupWindowFromExperiment(key, blocking=True)
-            self._updates.broadcast("window", True)
-
-            self._currentExperiment = key
-
-        self._updates.broadcast("experiment", key)
-
-        logger.info("starting", current=self._currentExperiment)
-
-        if earlyFuture is not None:
-            earlyFuture.get_loop().call_soon_threadsafe(earlyFuture.set_result, None)
-
+        self._currentRun = run
+        # the experiment is no longer evicted from now on.
+        self._currentExperiment = key
+        frames = None
+        error = None
         try:
-            self._session.runExperiment(key, expInfo, blocking=True)
+            # the run takes over a prepared window, it is no longer closed on
+            # timeout.
+            self._releasePrepared(closeWindow=False)
+            # the experiment may have been evicted since it was prepared, and must be
+            # loaded before its window settings are read.
+            self._loadExperiment(key)
+            opened = self._openWindow(key, logger)
+            if opened is not None:
+                self._runs.mark(run, "windowOpened", at=opened)
+
+            self._updates.broadcast("experiment", key)
+
+            logger.info("starting", current=self._currentExperiment)
+
+            if earlyFuture is not None:
+                AsyncTaskRunner.resolve(earlyFuture)
+            self._runs.mark(run, "started")
+            # called right after the first flip of the experiment.
+            self._session.win.callOnFlip(self._runs.mark, run, "firstFrame")
+            frames = FrameMonitor(
+                self._session.win,
+                run,
+                key,
+                frameRate=self._frameRate,
+                onStats=partial(self._updates.broadcast, "frames"),
+            )
+            frames.start()
+
+            with _EXPERIMENT_PHASES.labels("run").time():
+                self._session.runExperiment(key, expInfo, blocking=True)
+        except Exception as e:
+            error = str(e)
+            raise
         finally:
+            if frames is not None:
+                stats = frames.stop()
+                self._updates.broadcast("frames", stats)
+                self._saveFrameStats(stats, expInfo.get("participant", None), logger)
+            self._runs.mark(run, "returned", error=error)
+            self._currentRun = None
             self._currentExperiment = None
+            # unloads the experiments changed or evicted during the run.
+            self._evictExperiments(keep=None)
             self._updates.broadcast("experiment", "")
             logger.debug("done", current=self._currentExperiment)
 
+    def _saveFrameStats(self, stats: FrameStats, participant, logger):
+        date = time.strftime("%Y-%m-%d_%Hh%M.%S")
+        parts = [Path(stats.experiment).stem, date, "frames.json"]
+        if participant is not None:
+            parts.insert(0, str(participant))
+        filename = "_".join(parts)
+        try:
+            os.makedirs(self._dataDir, exist_ok=True)
+            with open(self._dataDir.joinpath(filename), "wb") as f:
+                f.write(to_json(stats, indent=2))
+        except OSError as e:
+            logger.error("could not save frame statistics", error=e)
+
+    def _experimentWindowSettings(self, key) -> Optional[Dict[str, str]]:
+        try:
+            params = self._session.experimentObjects[key].settings.params
+            return {
+                name: str(params[name].val) if name in params else None
+                for name in WINDOW_SETTINGS
+            }
+        except (AttributeError, KeyError, TypeError):
+            return None
+
+    def _openWindow(self, key, logger) -> Optional[int]:
+        """Opens the window with the settings of an experiment, unless it is opened
+        with compatible settings. Returns the time in nanoseconds the window was
+        (re)opened, or None if it was reused."""
+        settings = self._experimentWindowSettings(key)
+        if self._session.win is not None:
+            # a window whose settings are unknown may not match, it is reopened.
+            if settings is not None and settings == self._windowSettings:
+                return None
+            logger.info("reopening window with different or unknown settings")
+            self._session.win.close()
+            self._session.win = None
+
+        logger.debug("opening window")
+        with _EXPERIMENT_PHASES.labels("window").time():
+            self._session.setupWindowFromExperiment(key, blocking=True)
+        opened = time.time_ns()
+        self._windowSettings = settings
+        self._frameRate = self._measureFrameRate(settings, logger)
+        self._updates.broadcast("window", True)
+        return opened
+
+    def _measureFrameRate(self, settings, logger) -> Optional[float]:
+        # the screen of a window whose settings are unknown is unknown too.
+        screen = settings.get("Screen", None) if settings is not None else None
+        if settings is not None and screen in self._frameRates:
+            return self._frameRates[screen]
+        frameRate = self._session.win.getActualFrameRate()
+        logger.debug("measured frame rate", frameRate=frameRate)
+        if settings is not None and frameRate is not None:
+            self._frameRates[screen] = frameRate
+        return frameRate
+
+    def _preloadResources(self, key):
+        # asks the kernel to read the resources ahead, without waiting for it.
+        if hasattr(os, "posix_fadvise") is False:
+            return
+        collection = self._resourceChecker.collections[key]
+        for resource in collection.resources:
+            try:
+                fd = os.open(collection.filepath(resource), os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+
+    def prepareExperiment(self, key: str, logger=None, **kwargs):
+        """Checks that an experiment can be run, compiles it and opens the window with
+        its settings, so that a following run starts right away.
+
+        The parameters of the run may be given to be checked, but not all are
+        required. If the experiment is not run within prepareTimeout seconds, the
+        window it opened is closed.
+        """
+        logger = self._bind_logger(logger).bind(experiment=key)
+        start = time.perf_counter()
+        self._checkExperiment(key, kwargs, partial=True)
+        # a window opened by a previous prepare is still released on timeout.
+        owned = self._releasePrepared(closeWindow=False)
+
+        self._loadExperiment(key)
+        self._preloadResources(key)
+        opened = self._openWindow(key, logger) is not None
+
+        with self._lock:
+            self._prepared = key
+            self._preparedGeneration += 1
+            # a window reused from a previous run is not released.
+            self._preparedWindow = opened or (owned and self._session.win is not None)
+            self._preparedTimer = threading.Timer(
+                self.prepareTimeout,
+                self._onPreparedTimeout,
+                args=(self._preparedGeneration,),
+            )
+            self._preparedTimer.daemon = True
+            self._preparedTimer.start()
+        _EXPERIMENT_PHASES.labels("preload").observe(time.perf_counter() - start)
+        logger.info("prepared", windowOpened=opened)
+
+    @AsyncTaskRunner.in_loop()
+    def asyncPrepareExperiment(self, key: str, logger=None, **kwargs):
+        self.prepareExperiment(key, logger=logger, **kwargs)
+
+    def _onPreparedTimeout(self, generation):
+        # the window must be closed by the session thread.
+        self._put_task(
+            partial(self._expirePrepared, generation),
+            None,
+            AsyncTaskRunner.Lane.CONTROL,
+        )
+
+    def _expirePrepared(self, generation):
+        with self._lock:
+            if self._prepared is None or self._preparedGeneration != generation:
+                return
+            key = self._prepared
+        self._bind_logger().info("prepared experiment expired", experiment=key)
+        self._releasePrepared(closeWindow=True)
+
+    def _releasePrepared(self, closeWindow: bool) -> bool:
+        """Forgets the prepared experiment and returns if it opened the window."""
+        with self._lock:
+            if self._preparedTimer is not None:
+                self._preparedTimer.cancel()
+            opened = self._prepared is not None and self._preparedWindow
+            self._prepared = None
+            self._preparedWindow = False
+            self._preparedTimer = None
+        if (
+            closeWindow
+            and opened
+            and self._session.win is not None
+            and self._currentExperiment is None
+        ):
+            self.closeWindow()
+        return opened
+
     def runExperiment(self, key: str, logger=None, **kwargs):
+        requested = time.time_ns()
         logger = self._bind_logger(logger).bind(experiment=key)
         expInfo = self._prepareExperiment(key, logger=logger, **kwargs)
-        self._runExperiment(key, logger=logger, expInfo=expInfo)
+        self._registerSession(expInfo)
+        run = self._startRun(key, expInfo, requested)
+        self._runExperiment(key, logger=logger, expInfo=expInfo, run=run)
 
     async def asyncRunExperiment(self, key: str, logger=None, **kwargs):
+        requested = time.time_ns()
         logger = self._bind_logger(logger).bind(experiment=key)
+        # fails before recording the run if it could not be queued.
+        self._checkCapacity(AsyncTaskRunner.Lane.WORK)
         # we make all necessary check before sending the task
-        expInfo = self._prepareExperiment(key, logger=logger, **kwargs)
+        expInfo = await self._asyncPrepareExperiment(key, logger=logger, **kwargs)
+        runId = self._startRun(key, expInfo, requested)
 
         # we inject our own future to return early from the experiment run
         future = asyncio.get_event_loop().create_future()
 
-        @AsyncTaskRunner.in_loop(runner=self, future=future)
+        # the client left before the run started.
+        @AsyncTaskRunner.in_loop(
+            runner=self,
+            future=future,
+            onDropped=partial(self._runs.mark, runId, "returned", error="cancelled"),
+        )
         def run():
+            # the participant session is only used once the run starts.
+            self._registerSession(expInfo)
             # by passing early future, it will be done before the completion of the
             # experiment.
-            self._runExperiment(key, logger=logger, expInfo=expInfo, earlyFuture=future)
+            self._runExperiment(
+                key, logger=logger, expInfo=expInfo, run=runId, earlyFuture=future
+            )
 
-        await run()
+        try:
+            await run()
+        except Exception as err:
+            # the run could not be queued or failed before it started, e.g. with an
+            # invalid participant. A run that returned is already marked.
+            self._runs.mark(runId, "returned", error=str(err))
+            raise
 
     def stopExperiment(self, logger=None):
         if self._session.currentExperiment is None:
             raise RuntimeError("no experiment is running")
 
         self._bind_logger(logger).info("stopping experiment")
+        if self._currentRun is not None:
+            self._runs.mark(self._currentRun, "stopRequested")
         self._session.stopExperiment()
 
-    @AsyncTaskRunner.in_loop()
+    @AsyncTaskRunner.in_loop(lane=AsyncTaskRunner.Lane.CONTROL)
     def asyncStopExperiment(self, logger=None):
         self.stopExperiment(logger)
 
     def validateResources(self, paths):
-        modifiedExperiments = self._resourceChecker.validate(paths)
-        for key in modifiedExperiments:
-            self._experiments[key].resources = self._resourceChecker.collections[
-                key
-            ].resources
+        with self._lock:
+            changes = self._resourceChecker.updateResources(paths)
+            for key, resources in changes.items():
+                self._experiments[key].resources.update(resources)
 
-        if len(modifiedExperiments) > 0:
-            self._updates.broadcast("catalog", self._experiments)
+            if len(changes) > 0:
+                # only the changed resources are sent, not the whole catalog.
+                self._updates.broadcastPatch("catalog", "resources", changes)
 
     def updates(self):
         return self._updates.updates()
 
+    def events(self, lastEventId=None, topics=None):
+        return self._updates.events(lastEventId, topics=topics)
+
+    def runs(self):
+        return self._runs.runs()
+
+    def subscriberStats(self):
+        return self._updates.subscriberStats()
+
     def close(self):
         super(Session, self).close()
 
         self._updates.close()
+        self._compiler.shutdown(cancel_futures=True)
+        self._participants.close()
+        if self._scanner is not None:
+            self._scanner.shutdown(cancel=True)
+        if self._snapshotTimer is not None:
+            self._snapshotTimer.cancel()
+        if self._preparedTimer is not None:
+            self._preparedTimer.cancel()
+        self._saveSnapshot()
         try:
             self._session.stop()
         finally:
             pass
         self._observer.stop()
         self._observer.join()
+        self._event_handler.close()
@@ -1,5 +1,12 @@
-from typing import Any, Dict, List, TypeAlias, Union
+from functools import cached_property
+from typing import Any, Dict, List, Optional, TypeAlias, Union
 from pydantic import BaseModel, Field
+from pydantic_core import to_json, to_jsonable_python
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 
 ParameterDeclaration: TypeAlias = List[str]
@@ -27,6 +34,101 @@ class Participant(BaseModel):
         return True
 
 
+class ParticipantPage(BaseModel):
+    participants: List[Participant]
+    nextCursor: Optional[str] = Field(
+        default=None,
+        description="cursor of the next page, None if it is the last one.",
+    )
+
+
+class RunTimeline(BaseModel):
+    """The timeline of an experiment run. Times are in nanoseconds since the epoch,
+    and are None until the step happened.
+
+    Attributes
+    ----------
+    id: int
+        identifies the run, increases with each run.
+    experiment: str
+        the key of the experiment.
+    revision: Optional[int]
+        the modification time in nanoseconds of the .psyexp file that was run.
+    participant: Optional[str]
+        the participant of the run, if the experiment has one.
+    session: Optional[int]
+        the session of the participant.
+    requested: int
+        when the run request was received.
+    prepared: Optional[int]
+        when the run request was checked and the experiment loaded.
+    windowOpened: Optional[int]
+        when the window was opened, None if it was already opened.
+    started: Optional[int]
+        when the request was answered, right before the experiment is run.
+    firstFrame: Optional[int]
+        when the first frame of the experiment was flipped.
+    stopRequested: Optional[int]
+        when the run was requested to stop.
+    returned: Optional[int]
+        when the run ended.
+    dataSaved: Optional[int]
+        when a data file of the participant was written after the run started.
+    error: Optional[str]
+        the error that ended the run, if any.
+    """
+
+    id: int
+    experiment: str
+    revision: Optional[int] = None
+    participant: Optional[str] = None
+    session: Optional[int] = None
+    requested: int
+    prepared: Optional[int] = None
+    windowOpened: Optional[int] = None
+    started: Optional[int] = None
+    firstFrame: Optional[int] = None
+    stopRequested: Optional[int] = None
+    returned: Optional[int] = None
+    dataSaved: Optional[int] = None
+    error: Optional[str] = None
+
+
+class FrameStats(BaseModel):
+    """Frame timing statistics of an experiment run. Intervals are in seconds.
+
+    Attributes
+    ----------
+    run: int
+        the id of the run.
+    experiment: str
+        the key of the experiment.
+    frames: int
+        the number of frames flipped since the run started.
+    dropped: int
+        the number of frames dropped since the run started, i.e. the refresh periods
+        missed by intervals longer than 1.5 expected intervals.
+    expectedInterval: Optional[float]
+        the refresh period measured with getActualFrameRate(), None if the
+        measurement failed, in which case the median interval is used.
+    meanInterval: float
+        the mean of the recent intervals.
+    p99Interval: float
+        the 99th percentile of the recent intervals.
+    maxInterval: float
+        the longest of the recent intervals.
+    """
+
+    run: int
+    experiment: str
+    frames: int = 0
+    dropped: int = 0
+    expectedInterval: Optional[float] = None
+    meanInterval: float = 0.0
+    p99Interval: float = 0.0
+    maxInterval: float = 0.0
+
+
 Catalog: TypeAlias = Dict[str, Experiment]
 
 Updatable: TypeAlias = Union[
@@ -34,9 +136,62 @@ Updatable: TypeAlias = Union[
     bool,
     Dict[str, Union[None, Experiment]],
     Dict[str, Union[None, Participant]],
+    Dict[str, Union[None, RunTimeline]],
+    Dict[str, Dict[str, bool]],
+    FrameStats,
 ]
 
 
 class UpdateEvent(BaseModel):
     type: str
     data: Updatable
+
+    @cached_property
+    def frame(self) -> bytes:
+        """The event encoded as a server-sent event.
+
+        The encoding is done once and shared by all the subscribers, the event must
+        therefore not be modified afterwards.
+        """
+        data = to_json(self.data, indent=None)
+        return b"event:" + self.type.encode("utf-8") + b"\ndata:" + data + b"\n\n"
+
+    @cached_property
+    def message(self) -> str:
+        """The event encoded as a JSON text message."""
+        return to_json({"type": self.type, "data": self.data}).decode("utf-8")
+
+    @cached_property
+    def packedMessage(self) -> bytes:
+        """The event encoded as a msgpack binary message, requires msgpack."""
+        return msgpack.packb({"type": self.type, "data": to_jsonable_python(self.data)})
+
+
+class SubscriberStats(BaseModel):
+    """Delivery statistics of an update subscriber.
+
+    Attributes
+    ----------
+    id: int
+        identifies the subscriber while it is connected.
+    pending: int
+        the number of events waiting to be sent.
+    maxPending: int
+        the maximal number of events that were waiting to be sent.
+    lag: float
+        the age in seconds of the oldest event waiting to be sent.
+    delivered: int
+        the number of events sent.
+    coalesced: int
+        the number of events merged with later ones because the subscriber was slow.
+    resyncs: int
+        the number of times the pending events were replaced by a snapshot.
+    """
+
+    id: int
+    pending: int
+    maxPending: int
+    lag: float
+    delivered: int
+    coalesced: int
+    resyncs: int
@@ -1,60 +1,436 @@
-from asyncio.queues import Queue
-from typing import Any, Mapping, Union
+import asyncio
+import itertools
+import secrets
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Mapping, Optional, Set, Tuple, Union
 
-from psychopy_session_webserver.types import Experiment, Participant, UpdateEvent
+from pydantic_core import to_json
+
+from psychopy_session_webserver.types import (
+    Experiment,
+    Participant,
+    SubscriberStats,
+    UpdateEvent,
+)
+
+# returned by SubscriberQueue.get() when the pending events were dropped.
+_RESYNC = object()
+
+
+def _merge(a: dict, b: dict) -> dict:
+    # the web UI merges dict updates, a None value deleting the key. Patches are
+    # merged one level deeper.
+    merged = {**a}
+    for key, value in b.items():
+        if isinstance(value, dict) and isinstance(merged.get(key, None), dict):
+            merged[key] = {**merged[key], **value}
+        else:
+            merged[key] = value
+    return merged
+
+
+class SubscriberQueue:
+    """A bounded queue of the events not yet sent to a subscriber.
+
+    When more than maxsize events are pending, the subscriber is too slow: pending
+    events of the same store are merged in a single one. If this is not enough, all
+    pending events are dropped and the subscriber is sent a snapshot of the stores
+    instead.
+
+    It must only be used from the event loop of its subscriber.
+    """
+
+    def __init__(self, id: int, maxsize: int, related=None, topics=None):
+        self.id = id
+        self.maxsize = maxsize
+        # the stores the subscriber is interested in, or None for all of them.
+        self.topics: Optional[Set[str]] = topics
+        # event types that must not be reordered with respect to each other.
+        self._related: Dict[str, Set[str]] = related if related is not None else {}
+        self._events = deque()
+        self._ready = asyncio.Event()
+        self._closed = False
+        self._resync = False
+        self.maxPending = 0
+        self.delivered = 0
+        self.coalesced = 0
+        self.resyncs = 0
+
+    def put_nowait(self, item: Optional[Tuple[int, UpdateEvent]]):
+        if item is None:
+            self._closed = True
+            self._ready.set()
+            return
+        if self._resync:
+            # the snapshot will contain this event.
+            return
+
+        seq, event = item
+        self._events.append((time.monotonic(), seq, event))
+        if len(self._events) > self.maxsize:
+            self._coalesce()
+        if len(self._events) > self.maxsize:
+            self.coalesced += len(self._events)
+            self.resyncs += 1
+            self._events.clear()
+            self._resync = True
+        self.maxPending = max(self.maxPending, len(self._events))
+        self._ready.set()
+
+    def _coalesce(self):
+        merged = []
+        index: Dict[str, int] = {}
+        for timestamp, seq, event in self._events:
+            for related in self._related.get(event.type, ()):
+                index.pop(related, None)
+            i = index.get(event.type, None)
+            if i is not None:
+                previous = merged[i]
+                merged[i] = None
+                if isinstance(previous[2].data, dict) and isinstance(event.data, dict):
+                    event = UpdateEvent(
+                        type=event.type, data=_merge(previous[2].data, event.data)
+                    )
+                timestamp = previous[0]
+            # the merged event is identified as the latest one, and takes its place
+            # so that the sequence numbers stay in order.
+            index[event.type] = len(merged)
+            merged.append((timestamp, seq, event))
+        merged = [item for item in merged if item is not None]
+        self.coalesced += len(self._events) - len(merged)
+        self._events = deque(merged)
+
+    async def get(self):
+        """Returns the next (sequence number, event), _RESYNC if a snapshot must be
+        sent or None once closed."""
+        while True:
+            if self._resync:
+                self._resync = False
+                return _RESYNC
+            if len(self._events) > 0:
+                self.delivered += 1
+                _, seq, event = self._events.popleft()
+                return seq, event
+            if self._closed:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+
+    def stats(self) -> SubscriberStats:
+        lag = 0.0
+        if len(self._events) > 0:
+            lag = time.monotonic() - self._events[0][0]
+        return SubscriberStats(
+            id=self.id,
+            pending=len(self._events),
+            maxPending=self.maxPending,
+            lag=lag,
+            delivered=self.delivered,
+            coalesced=self.coalesced,
+            resyncs=self.resyncs,
+        )
 
 
 class UpdateBroadcaster:
+    """Broadcasts the updates of named stores to asynchronous subscribers.
+
+    Events are encoded once when they are broadcasted, and the events describing the
+    current value of each store are cached until it changes, so the cost of a new
+    subscriber or of an update does not depend on the number of subscribers.
 
-    def __init__(self, loop=None):
+    Each event sent is identified by a monotonic sequence number, and the latest
+    events are kept in a replay ring: a subscriber resuming from a known event id is
+    only sent the events it missed, unless they were dropped from the ring.
+
+    Attributes
+    ----------
+    maxQueueSize: int
+        the maximal number of events pending for a subscriber, see SubscriberQueue.
+    coalesceInterval: Optional[float]
+        if not None, events are delivered in batches at most every coalesceInterval
+        seconds, or once per loop iteration if it is 0, and updates of a dict store
+        within a batch are merged in a single event. It requires a loop. A
+        subscriber may receive the events of the batch pending when it subscribed
+        after its initial snapshot.
+    replaySize: int
+        the number of events kept to resume subscriptions.
+    epoch: str
+        identifies this broadcaster in event ids, so that ids of a previous process
+        are not mistaken for ids of this one.
+    """
+
+    def __init__(
+        self, loop=None, maxQueueSize=256, coalesceInterval=None, replaySize=1024
+    ):
+        if coalesceInterval is not None and loop is None:
+            raise ValueError("coalescing updates requires a loop")
         self._queues = []
         self._stores = {}
+        # the encoded snapshot event of each store, dropped when it changes.
+        self._snapshots: Dict[str, UpdateEvent] = {}
+        # the version of each store, and its cached (etag, JSON body).
+        self._versions: Dict[str, int] = {}
+        self._bodies: Dict[str, Tuple[str, bytes]] = {}
+        self._lock = threading.Lock()
         self._loop = loop
+        self._ids = itertools.count(1)
+        # the events of a store and of its patches, by event type.
+        self._related: Dict[str, Set[str]] = {}
+        # the store of each event type.
+        self._topics: Dict[str, str] = {}
+        self.maxQueueSize = maxQueueSize
+        self.coalesceInterval = coalesceInterval
+        # events waiting for the next batch, and the index of the pending dict
+        # update of each store.
+        self._pending: List[Optional[UpdateEvent]] = []
+        self._pendingDicts: Dict[str, int] = {}
+        self._pendingLock = threading.Lock()
+        self.epoch = secrets.token_hex(4)
+        self.replaySize = replaySize
+        # the last sequence number, and the (sequence number, event) sent lately.
+        self._seq = 0
+        self._ring = deque(maxlen=replaySize)
+        self._ringLock = threading.Lock()
 
     def _push_all(self, value):
-        for q in self._queues:
-            if self._loop is None:
-                q.put_nowait(value)
-            else:
-                self._loop.call_soon_threadsafe(q.put_nowait, value)
+        if self.coalesceInterval is not None:
+            self._enqueue(value)
+            return
+        self._publish(value, threadsafe=self._loop is not None)
+
+    def _publish(self, value, threadsafe):
+        with self._ringLock:
+            item = None
+            topic = None
+            if value is not None:
+                if len(self._queues) > 0:
+                    # encodes the event once, before it is shared by the subscribers.
+                    value.frame
+                self._seq += 1
+                item = (self._seq, value)
+                self._ring.append(item)
+                topic = self._topics.get(value.type, None)
+            for q in self._queues:
+                if item is not None and q.topics is not None and topic not in q.topics:
+                    continue
+                if threadsafe:
+                    self._loop.call_soon_threadsafe(q.put_nowait, item)
+                else:
+                    q.put_nowait(item)
+
+    def _enqueue(self, value):
+        with self._pendingLock:
+            if len(self._pending) == 0:
+                self._scheduleFlush()
+
+            if value is not None:
+                # merging into an earlier event would reorder it with the related
+                # events sent since.
+                for related in self._related.get(value.type, ()):
+                    self._pendingDicts.pop(related, None)
+
+            index = self._pendingDicts.get(value.type, None) if value else None
+            if index is not None and isinstance(value.data, dict):
+                merged = self._pending[index]
+                self._pending[index] = UpdateEvent(
+                    type=merged.type, data=_merge(merged.data, value.data)
+                )
+                return
+
+            if value is not None and isinstance(value.data, dict):
+                self._pendingDicts[value.type] = len(self._pending)
+            elif value is not None:
+                # a full value replaces the store, it must not be merged with the
+                # updates sent before it.
+                self._pendingDicts.pop(value.type, None)
+            self._pending.append(value)
+
+    def _scheduleFlush(self):
+        if self.coalesceInterval == 0:
+            self._loop.call_soon_threadsafe(self._flush)
+        else:
+            self._loop.call_soon_threadsafe(
+                self._loop.call_later, self.coalesceInterval, self._flush
+            )
+
+    def _flush(self):
+        with self._pendingLock:
+            pending = self._pending
+            self._pending = []
+            self._pendingDicts = {}
+
+        for value in pending:
+            self._publish(value, threadsafe=False)
 
     def close(self):
         self._push_all(None)
 
     def broadcastDict(self, name: str, key: str, value):
-        if name not in self._stores:
-            self._stores[name] = {}
-        if isinstance(self._stores, dict) == False:
-            raise RuntimeError(f"'{name}' is not a dict")
-        if value is None and key in self._stores[name]:
-            del self._stores[name][key]
-        else:
-            self._stores[name][key] = value
+        self.broadcastDictItems(name, {key: value})
 
-        self._push_all(UpdateEvent(type=name + "Update", data={key: value}))
+    def broadcastDictItems(self, name: str, items: Dict[str, Any]):
+        """Broadcasts the changes of several keys of the dict store name in a single
+        event, a None value deleting its key."""
+        if len(items) == 0:
+            return
+        with self._lock:
+            self._topics[name + "Update"] = name
+            if name not in self._stores:
+                self._stores[name] = {}
+            if isinstance(self._stores, dict) == False:
+                raise RuntimeError(f"'{name}' is not a dict")
+            for key, value in items.items():
+                if value is None and key in self._stores[name]:
+                    del self._stores[name][key]
+                else:
+                    self._stores[name][key] = value
+            self._changed(name)
+
+        self._push_all(UpdateEvent(type=name + "Update", data=dict(items)))
 
     def broadcast(self, name: str, value: Any):
-        if isinstance(value, dict) and isinstance(self._stores.get(name, None), dict):
-            deletedKeys = [
-                k for k in self._stores.get(name, {}).keys() if k not in value.keys()
-            ]
-            for k in deletedKeys:
-                self._push_all(UpdateEvent(type=name + "Update", data={k: None}))
-
-        self._stores[name] = value
+        with self._lock:
+            self._topics[name + "Update"] = name
+            if isinstance(value, dict) and isinstance(
+                self._stores.get(name, None), dict
+            ):
+                deletedKeys = [
+                    k
+                    for k in self._stores.get(name, {}).keys()
+                    if k not in value.keys()
+                ]
+                for k in deletedKeys:
+                    self._push_all(UpdateEvent(type=name + "Update", data={k: None}))
+
+            self._stores[name] = value
+            self._changed(name)
+
         event = UpdateEvent(type=name + "Update", data=value)
         self._push_all(event)
 
-    async def updates(self):
-        q = Queue()
-        self._queues.append(q)
-        for key in sorted(self._stores):
-            q.put_nowait(UpdateEvent(type=key + "Update", data=self._stores[key]))
+    def broadcastPatch(self, name: str, patch: str, value: Dict[str, Any]):
+        """Broadcasts a partial update of the values of the dict store name, as a
+        <patch>Update event.
+
+        The values of the store must already be modified, the patch only avoids to
+        send them entirely.
+        """
+        with self._lock:
+            self._changed(name)
+            self._related.setdefault(name + "Update", set()).add(patch + "Update")
+            self._related.setdefault(patch + "Update", set()).add(name + "Update")
+            self._topics[patch + "Update"] = name
+
+        self._push_all(UpdateEvent(type=patch + "Update", data=value))
+
+    def _changed(self, name: str):
+        self._versions[name] = self._versions.get(name, 0) + 1
+        self._snapshots.pop(name, None)
+        self._bodies.pop(name, None)
+
+    def body(self, name: str) -> Tuple[str, bytes]:
+        """Returns a strong ETag of the current value of a store and its JSON encoding.
+
+        The ETag identifies the store, so that stores with the same version never
+        share it. The encoding is cached until the store changes.
+        """
+        with self._lock:
+            cached = self._bodies.get(name, None)
+            if cached is None:
+                etag = f'"{self.epoch}-{name}-{self._versions.get(name, 0)}"'
+                cached = (etag, to_json(self._stores[name]))
+                self._bodies[name] = cached
+            return cached
+
+    def _snapshot(self, name: str) -> UpdateEvent:
+        event = self._snapshots.get(name, None)
+        if event is None:
+            event = UpdateEvent(type=name + "Update", data=self._stores[name])
+            # encoded under the lock since the store may be modified afterwards.
+            event.frame
+            self._snapshots[name] = event
+        return event
+
+    def _snapshotAll(self, topics=None) -> List[UpdateEvent]:
+        with self._lock:
+            return [self._snapshot(key) for key in self._storeNames(topics)]
+
+    def _storeNames(self, topics) -> List[str]:
+        return [k for k in sorted(self._stores) if topics is None or k in topics]
+
+    def eventId(self, seq: int) -> str:
+        """Formats a sequence number as an event id."""
+        return f"{self.epoch}-{seq}"
+
+    def _parseEventId(self, eventId: Optional[str]) -> Optional[int]:
+        if eventId is None:
+            return None
+        epoch, _, seq = eventId.partition("-")
+        if epoch != self.epoch or seq.isdigit() is False:
+            return None
+        return int(seq)
+
+    def subscriberStats(self) -> List[SubscriberStats]:
+        """Returns the delivery statistics of the current subscribers."""
+        return [q.stats() for q in list(self._queues)]
+
+    def _subscribe(self, q: SubscriberQueue, lastSeq: Optional[int]):
+        with self._lock, self._ringLock:
+            self._queues.append(q)
+            if lastSeq is not None and lastSeq <= self._seq:
+                missed = self._seq - lastSeq
+                if missed == 0 or (
+                    missed <= len(self._ring) and self._ring[-missed][0] == lastSeq + 1
+                ):
+                    for i in range(len(self._ring) - missed, len(self._ring)):
+                        seq, event = self._ring[i]
+                        if q.topics is None or self._topics[event.type] in q.topics:
+                            q.put_nowait((seq, event))
+                    return
+            for key in self._storeNames(q.topics):
+                q.put_nowait((self._seq, self._snapshot(key)))
+
+    async def events(
+        self, lastEventId: Optional[str] = None, topics: Optional[List[str]] = None
+    ):
+        """Yields the (event id, event) sent to a subscriber.
+
+        Parameters
+        ----------
+        lastEventId: Optional[str]
+            the id of the last event received by a previous subscription. The events
+            sent since are replayed if they are still known, otherwise the
+            subscription starts with a snapshot of every store.
+        topics: Optional[List[str]]
+            the names of the stores to receive the events of, all of them if None.
+        """
+        q = SubscriberQueue(
+            next(self._ids),
+            self.maxQueueSize,
+            self._related,
+            topics=set(topics) if topics is not None else None,
+        )
+        self._subscribe(q, self._parseEventId(lastEventId))
         try:
             while True:
                 update = await q.get()
                 if update is None:
                     return
-                yield update
+                if update is _RESYNC:
+                    with self._ringLock:
+                        seq = self._seq
+                    for event in self._snapshotAll(q.topics):
+                        yield self.eventId(seq), event
+                    continue
+                seq, event = update
+                yield self.eventId(seq), event
         finally:
-            self._queues.remove(q)
+            # the queues are published to from other threads.
+            with self._ringLock:
+                self._queues.remove(q)
+
+    async def updates(self):
+        async for _, event in self.events():
+            yield event
@@ -1,8 +1,10 @@
+import asyncio
 import contextlib
 import threading
 import unittest
-from unittest.mock import Mock
-from psychopy_session_webserver.async_task_runner import AsyncTaskRunner
+from unittest.mock import Mock, call
+
+from psychopy_session_webserver.async_task_runner import AsyncTaskRunner, TaskQueueFull
 
 
 class MyClass(AsyncTaskRunner):
@@ -59,3 +61,80 @@ class AsyncRunnerTestCase(unittest.IsolatedAsyncioTestCase):
             await self.obj.nestedCommand("foo")
 
         self.obj.command.assert_called_once_with("foo")
+
+    async def test_control_lane_runs_first(self):
+        order = []
+
+        @AsyncTaskRunner.in_loop(runner=self.obj)
+        def work(i):
+            order.append(f"work{i}")
+
+        @AsyncTaskRunner.in_loop(runner=self.obj, lane=AsyncTaskRunner.Lane.CONTROL)
+        def control():
+            order.append("control")
+
+        # queued before the loop starts, so they are all waiting at once.
+        tasks = [asyncio.create_task(work(i)) for i in range(2)]
+        tasks.append(asyncio.create_task(control()))
+        await asyncio.sleep(0)
+        self.assertEqual(self.obj.queueDepth(), 3)
+        self.assertEqual(self.obj.queueDepth(AsyncTaskRunner.Lane.CONTROL), 1)
+
+        with self.with_loop():
+            await asyncio.gather(*tasks)
+
+        self.assertEqual(order, ["control", "work0", "work1"])
+        self.assertEqual(self.obj.queueDepth(), 0)
+
+    async def test_drops_cancelled_tasks(self):
+        task = asyncio.create_task(self.obj.asyncCommand("dropped"))
+        await asyncio.sleep(0)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+        with self.with_loop():
+            await self.obj.asyncCommand("run")
+
+        self.obj.command.assert_called_once_with("run")
+
+    async def test_signals_dropped_tasks(self):
+        onDropped = Mock()
+
+        @AsyncTaskRunner.in_loop(runner=self.obj, onDropped=onDropped)
+        def fn(arg):
+            self.obj.command(arg)
+
+        dropped = asyncio.create_task(fn("dropped"))
+        await asyncio.sleep(0)
+        dropped.cancel()
+        with self.with_loop():
+            await fn("run")
+
+        self.obj.command.assert_called_once_with("run")
+        onDropped.assert_called_once_with()
+
+    async def test_limits_queue_depth(self):
+        self.obj.maxQueuedTasks = 1
+
+        first = asyncio.create_task(self.obj.asyncCommand(1))
+        await asyncio.sleep(0)
+        with self.assertRaises(TaskQueueFull):
+            await self.obj.asyncCommand(2)
+
+        # the control lane is not limited.
+        @AsyncTaskRunner.in_loop(runner=self.obj, lane=AsyncTaskRunner.Lane.CONTROL)
+        def control():
+            pass
+
+        with self.with_loop():
+            await asyncio.gather(first, control())
+            await self.obj.asyncCommand(3)
+
+        self.assertEqual(self.obj.command.call_args_list, [call(1), call(3)])
+
+    async def test_reports_errors(self):
+        self.obj.command.side_effect = RuntimeError("boom")
+        with self.with_loop():
+            with self.assertRaises(RuntimeError):
+                await self.obj.asyncCommand()
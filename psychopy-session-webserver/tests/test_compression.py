@@ -0,0 +1,187 @@
+import gzip
+import unittest
+import zlib
+
+from psychopy_session_webserver import compression
+from psychopy_session_webserver.compression import (
+    CompressionMiddleware,
+    negotiate_encoding,
+)
+
+
+def json_app(body: bytes, status=200, etag=None):
+    async def app(scope, receive, send):
+        headers = [(b"content-type", b"application/json")]
+        if etag is not None:
+            headers.append((b"etag", etag))
+        headers.append((b"content-length", str(len(body)).encode()))
+        await send(
+            {"type": "http.response.start", "status": status, "headers": headers}
+        )
+        await send({"type": "http.response.body", "body": body})
+
+    return app
+
+
+def events_app(events):
+    async def app(scope, receive, send):
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream; charset=utf-8")],
+        })
+        for e in events:
+            await send({"type": "http.response.body", "body": e, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    return app
+
+
+async def request(middleware, acceptEncoding=None, path="/"):
+    headers = []
+    if acceptEncoding is not None:
+        headers.append((b"accept-encoding", acceptEncoding.encode()))
+    scope = {"type": "http", "path": path, "headers": headers}
+    messages = []
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+
+    await middleware(scope, receive, send)
+    return messages
+
+
+class NegotiationTest(unittest.TestCase):
+    def test_picks_preferred_encoding(self):
+        self.assertEqual(negotiate_encoding("gzip, br, zstd", ["zstd", "gzip"]), "zstd")
+        self.assertEqual(negotiate_encoding("gzip;q=0.5, br", ["br", "gzip"]), "br")
+        self.assertEqual(negotiate_encoding("br;q=0.5, gzip", ["br", "gzip"]), "gzip")
+        self.assertEqual(negotiate_encoding("*", ["br", "gzip"]), "br")
+
+    def test_refuses_encodings(self):
+        self.assertIsNone(negotiate_encoding("", ["gzip"]))
+        self.assertIsNone(negotiate_encoding("identity", ["gzip"]))
+        self.assertIsNone(negotiate_encoding("gzip;q=0", ["gzip"]))
+        self.assertIsNone(negotiate_encoding("*, gzip;q=0", ["gzip"]))
+
+
+class CompressionMiddlewareTest(unittest.IsolatedAsyncioTestCase):
+    body = b'{"experiments":' + b'"some/resource.png",' * 100 + b"}"
+
+    def gzipOnly(self, middleware):
+        middleware.encodings = ["gzip"]
+        return middleware
+
+    async def test_passthrough_without_accept_encoding(self):
+        m = CompressionMiddleware(json_app(self.body))
+        start, body = await request(m)
+        self.assertNotIn(b"content-encoding", dict(start["headers"]))
+        self.assertEqual(body["body"], self.body)
+
+    async def test_compresses_json(self):
+        m = self.gzipOnly(CompressionMiddleware(json_app(self.body, etag=b'"ab-1"')))
+        start, body = await request(m, "gzip, deflate")
+        headers = dict(start["headers"])
+        self.assertEqual(headers[b"content-encoding"], b"gzip")
+        self.assertEqual(headers[b"vary"], b"Accept-Encoding")
+        self.assertEqual(headers[b"etag"], b'W/"ab-1"')
+        self.assertEqual(int(headers[b"content-length"]), len(body["body"]))
+        self.assertLess(len(body["body"]), len(self.body))
+        self.assertEqual(gzip.decompress(body["body"]), self.body)
+
+    async def test_caches_compressed_bodies_by_etag(self):
+        m = self.gzipOnly(CompressionMiddleware(json_app(self.body, etag=b'"ab-1"')))
+        _, first = await request(m, "gzip")
+        _, second = await request(m, "gzip")
+        self.assertIs(first["body"], second["body"])
+
+    async def test_caches_compressed_bodies_by_path(self):
+        catalog = self.body
+        participants = b'{"participants":' + b'"asari",' * 100 + b"}"
+        apps = {
+            "/experiments": json_app(catalog, etag=b'"ab-1"'),
+            "/participants": json_app(participants, etag=b'"ab-1"'),
+        }
+
+        async def app(scope, receive, send):
+            await apps[scope["path"]](scope, receive, send)
+
+        m = self.gzipOnly(CompressionMiddleware(app))
+        _, body = await request(m, "gzip", path="/experiments")
+        self.assertEqual(gzip.decompress(body["body"]), catalog)
+        _, body = await request(m, "gzip", path="/participants")
+        self.assertEqual(gzip.decompress(body["body"]), participants)
+
+        # a new ETag replaces the cached body of its path.
+        apps["/participants"] = json_app(participants + b" ", etag=b'"ab-2"')
+        _, body = await request(m, "gzip", path="/participants")
+        self.assertEqual(gzip.decompress(body["body"]), participants + b" ")
+        self.assertEqual(len(m._cache), 2)
+
+    async def test_does_not_compress_small_bodies(self):
+        m = self.gzipOnly(CompressionMiddleware(json_app(b"{}", etag=b'"ab-1"')))
+        start, body = await request(m, "gzip")
+        headers = dict(start["headers"])
+        self.assertNotIn(b"content-encoding", headers)
+        self.assertEqual(headers[b"etag"], b'"ab-1"')
+        self.assertEqual(body["body"], b"{}")
+
+    async def test_passthrough_not_modified(self):
+        m = self.gzipOnly(CompressionMiddleware(json_app(b"", status=304)))
+        start, _ = await request(m, "gzip")
+        self.assertEqual(start["status"], 304)
+        self.assertNotIn(b"content-encoding", dict(start["headers"]))
+
+    async def test_flushes_each_event(self):
+        events = [b"event:fooUpdate\ndata:%d\n\n" % i for i in range(3)]
+        m = self.gzipOnly(CompressionMiddleware(events_app(events)))
+        messages = await request(m, "gzip")
+
+        self.assertEqual(dict(messages[0]["headers"])[b"content-encoding"], b"gzip")
+        decompressor = zlib.decompressobj(31)
+        for event, message in zip(events, messages[1:]):
+            # each chunk is decodable on its own, without waiting for the next one.
+            self.assertEqual(decompressor.decompress(message["body"]), event)
+        self.assertFalse(messages[-1]["more_body"])
+        decompressor.decompress(messages[-1]["body"])
+        self.assertTrue(decompressor.eof)
+
+    @unittest.skipIf(compression.brotli is None, "brotli is not installed")
+    async def test_brotli(self):
+        m = CompressionMiddleware(json_app(self.body))
+        m.encodings = ["br", "gzip"]
+        start, body = await request(m, "gzip, br")
+        self.assertEqual(dict(start["headers"])[b"content-encoding"], b"br")
+        self.assertEqual(compression.brotli.decompress(body["body"]), self.body)
+
+    @unittest.skipIf(compression.zstandard is None, "zstandard is not installed")
+    async def test_zstd_events(self):
+        events = [b"event:fooUpdate\ndata:%d\n\n" % i for i in range(3)]
+        m = CompressionMiddleware(events_app(events))
+        messages = await request(m, "zstd")
+        self.assertEqual(dict(messages[0]["headers"])[b"content-encoding"], b"zstd")
+        decompressor = compression.zstandard.ZstdDecompressor().decompressobj()
+        for event, message in zip(events, messages[1:]):
+            self.assertEqual(decompressor.decompress(message["body"]), event)
+
+    @unittest.skipIf(compression.zstandard is None, "zstandard is not installed")
+    def test_interleaved_zstd_streams(self):
+        compressor = compression.Compressor()
+        streams = [compressor.stream("zstd") for _ in range(2)]
+        decompressors = [
+            compression.zstandard.ZstdDecompressor().decompressobj() for _ in streams
+        ]
+        body = b'{"foo.psyexp": {"key": "foo.psyexp"}}' * 20
+        for i in range(3):
+            for j, (stream, decompressor) in enumerate(zip(streams, decompressors)):
+                event = b"event:fooUpdate\ndata:%d\n\n" % (10 * j + i)
+                chunk = stream.compress(event) + stream.flush()
+                self.assertEqual(decompressor.decompress(chunk), event)
+            # a one-shot body between the events of the streams.
+            compressed = compressor.compress("zstd", body)
+            self.assertEqual(
+                compression.zstandard.ZstdDecompressor().decompress(compressed), body
+            )
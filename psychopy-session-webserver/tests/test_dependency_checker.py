@@ -2,8 +2,12 @@ import os
 import tempfile
 import unittest
 from pathlib import Path
+from unittest.mock import patch
 
-from psychopy_session_webserver.dependency_checker import DependencyChecker
+from psychopy_session_webserver.dependency_checker import (
+    DependencyChecker,
+    DirectoryListing,
+)
 
 
 class DependencyCheckerTest(unittest.TestCase):
@@ -84,3 +88,101 @@ class DependencyCheckerTest(unittest.TestCase):
         self.assertFalse(self.checker.validate("a"))
         self.assertFalse(self.checker.validate("b"))
         self.assertFalse(self.checker.validate("c"))
+
+    def test_reports_changed_resources(self):
+        a = str(self.local_filepath("a"))
+        self.assertEqual(self.checker.updateResources(["a", "b"]), {})
+
+        os.remove(a)
+        self.assertEqual(
+            self.checker.updateResources(["a", "b"]),
+            {"a": {a: False}, "c": {a: False}},
+        )
+        self.assertEqual(self.checker.updateResources("a"), {})
+
+    def test_shared_resources_are_reference_counted(self):
+        self.checker.removeDependencies("a")
+        self.assertDictEqual(
+            self.checker._resources[str(self.local_filepath("a"))],
+            {"c": str(self.local_filepath("a"))},
+        )
+
+        self.checker.removeDependencies("c")
+        self.assertNotIn(str(self.local_filepath("a")), self.checker._resources)
+        self.assertIn(str(self.local_filepath("b")), self.checker._resources)
+
+    def test_updates_dependencies(self):
+        self.checker.addDependencies("c", ["c", "d"])
+        self.assertDictEqual(
+            self.checker._resources[str(self.local_filepath("a"))],
+            {"a": str(self.local_filepath("a"))},
+        )
+        self.assertDictEqual(
+            self.checker._resources[str(self.local_filepath("d"))], {"c": "d"}
+        )
+        self.assertFalse(self.checker.collections["c"].valid)
+
+        self.local_filepath("d").touch()
+        self.assertListEqual(self.checker.validate("d"), ["c"])
+        self.assertTrue(self.checker.collections["c"].valid)
+
+    def test_lists_directories_once(self):
+        images = Path(self.tmpdir.name).joinpath("images")
+        os.makedirs(images)
+        for i in range(100):
+            images.joinpath(f"{i}.png").touch()
+
+        with patch("os.scandir", wraps=os.scandir) as scandir, patch.object(
+            Path, "exists"
+        ) as exists:
+            self.checker.addDependencies(
+                "images", [f"images/{i}.png" for i in range(101)]
+            )
+            self.checker.addDependencies("more", ["images/1.png", "a"])
+
+        # the listing of the root directory is still cached from setUp().
+        self.assertEqual(scandir.call_count, 1)
+        exists.assert_not_called()
+        self.assertListEqual(
+            self.checker.collections["images"].missing, ["images/100.png"]
+        )
+        self.assertTrue(self.checker.collections["more"].valid)
+
+    def test_validate_invalidates_listings(self):
+        self.checker.addDependencies("d", ["d"])
+        self.assertFalse(self.checker.collections["d"].valid)
+
+        self.local_filepath("d").touch()
+        self.assertListEqual(self.checker.validate("d"), ["d"])
+        self.assertTrue(self.checker.collections["d"].valid)
+
+
+class DirectoryListingTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.root = Path(self.tmpdir.name)
+        self.root.joinpath("a").touch()
+
+    def test_listings_expire(self):
+        listing = DirectoryListing(ttl=0.0)
+        self.assertTrue(listing.exists(self.root.joinpath("a")))
+        self.assertFalse(listing.exists(self.root.joinpath("b")))
+        self.root.joinpath("b").touch()
+        self.assertTrue(listing.exists(self.root.joinpath("b")))
+
+    def test_missing_directories(self):
+        listing = DirectoryListing()
+        self.assertFalse(listing.exists(self.root.joinpath("missing/a")))
+        # like the filesystem, '..' is not applied to a missing directory.
+        self.assertFalse(listing.exists(self.root.joinpath("missing/../a")))
+
+    def test_parent_of_symlinks(self):
+        self.root.joinpath("real/sub").mkdir(parents=True)
+        self.root.joinpath("real/a").touch()
+        self.root.joinpath("link").symlink_to(self.root.joinpath("real/sub"))
+        self.root.joinpath("a").unlink()
+        listing = DirectoryListing()
+        # link/.. is real, not the root.
+        self.assertTrue(listing.exists(self.root.joinpath("link/../a")))
+        self.assertFalse(listing.exists(self.root.joinpath("real/sub/../../a")))
@@ -0,0 +1,68 @@
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from psychopy_session_webserver.dependency_checker import DependencyChecker
+
+EXPERIMENTS = int(os.environ.get("PSYSW_BENCHMARK_EXPERIMENTS", 10_000))
+RESOURCES = int(os.environ.get("PSYSW_BENCHMARK_RESOURCES", 50))
+BATCH = EXPERIMENTS // 10
+
+
+@unittest.skipUnless(
+    "PSYSW_BENCHMARK" in os.environ, "set PSYSW_BENCHMARK to run benchmarks"
+)
+class DependencyCheckerBenchmark(unittest.TestCase):
+    """Checks that the cost of DependencyChecker operations does not grow with the
+    number of tracked experiments."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.checker = DependencyChecker(self.tmpdir.name)
+
+    def resources(self, i):
+        # half of the resources are shared by all experiments.
+        return [f"shared/{j}.png" for j in range(RESOURCES // 2)] + [
+            f"exp{i}/{j}.png" for j in range(RESOURCES - RESOURCES // 2)
+        ]
+
+    def timeit(self, fn, keys):
+        start = time.perf_counter()
+        for i in keys:
+            fn(i)
+        return (time.perf_counter() - start) / len(keys)
+
+    def report(self, name, first, last):
+        print(
+            f"\n{name}: {first * 1e6:.1f}µs -> {last * 1e6:.1f}µs per experiment"
+            f" ({EXPERIMENTS} experiments x {RESOURCES} resources)"
+        )
+        self.assertLess(last, 3 * first)
+
+    def test_add_remove_validate(self):
+        add = lambda i: self.checker.addDependencies(f"exp{i}", self.resources(i))
+        remove = lambda i: self.checker.removeDependencies(f"exp{i}")
+        validate = lambda i: self.checker.validate(f"exp{i}/0.png")
+
+        firstAdd = self.timeit(add, range(BATCH))
+        firstValidate = self.timeit(validate, range(BATCH))
+        firstRemove = self.timeit(remove, range(BATCH // 2))
+        self.timeit(add, range(BATCH // 2))
+
+        for start in range(BATCH, EXPERIMENTS - BATCH, BATCH):
+            self.timeit(add, range(start, start + BATCH))
+
+        lastAdd = self.timeit(add, range(EXPERIMENTS - BATCH, EXPERIMENTS))
+        lastValidate = self.timeit(validate, range(EXPERIMENTS - BATCH, EXPERIMENTS))
+        lastRemove = self.timeit(remove, range(EXPERIMENTS - BATCH, EXPERIMENTS))
+
+        self.report("add", firstAdd, lastAdd)
+        self.report("validate", firstValidate, lastValidate)
+        self.report("remove", firstRemove, lastRemove)
+
+
+if __name__ == "__main__":
+    unittest.main()
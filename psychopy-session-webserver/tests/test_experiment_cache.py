@@ -0,0 +1,97 @@
+import os
+import threading
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from psychopy_session_webserver.experiment_cache import (
+    CachedExperiment,
+    ExperimentCache,
+)
+
+
+class ExperimentCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        tempdir = TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        self.tempdir = Path(tempdir.name)
+
+        actualDir = ExperimentCache._dirpath
+        ExperimentCache._dirpath = self.tempdir.joinpath("xdg_cache_home")
+
+        def reset():
+            ExperimentCache._dirpath = actualDir
+
+        self.addCleanup(reset)
+
+        self.cache = ExperimentCache(maxEntries=10)
+
+    def write(self, path, content):
+        path = self.tempdir.joinpath(path)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_digest_depends_on_content_and_key(self):
+        a = self.write("a.psyexp", "<PsychoPy2experiment/>")
+        b = self.write("b.psyexp", "<PsychoPy2experiment/>")
+
+        digest = self.cache.digest(a, "a.psyexp")
+        self.assertEqual(digest, self.cache.digest(a, "a.psyexp"))
+        self.assertNotEqual(digest, self.cache.digest(b, "b.psyexp"))
+
+        self.write("a.psyexp", "<PsychoPy2experiment></PsychoPy2experiment>")
+        self.assertNotEqual(digest, self.cache.digest(a, "a.psyexp"))
+
+    def test_persist_entries(self):
+        entry = CachedExperiment(
+            resources=["foo.png"],
+            expInfo={"participant": "", "session": "001", "date|hid": "now"},
+        )
+        self.assertIsNone(self.cache.get("abcd"))
+        self.cache.put("abcd", entry)
+
+        self.cache = ExperimentCache(maxEntries=10)
+        got = self.cache.get("abcd")
+        self.assertEqual(got, entry)
+        self.assertEqual(got.parameters, ["participant", "session"])
+
+    def test_invalid_entries_are_misses(self):
+        with open(ExperimentCache._dirpath.joinpath("abcd.json"), "w") as f:
+            f.write("{not json")
+
+        self.assertIsNone(self.cache.get("abcd"))
+
+    def test_evicts_least_recently_used(self):
+        entry = CachedExperiment(resources=[], expInfo={})
+        for i in range(10):
+            self.cache.put(f"{i}", entry)
+            os.utime(ExperimentCache._dirpath.joinpath(f"{i}.json"), ns=(i, i))
+
+        self.cache.put("10", entry)
+
+        self.assertIsNone(self.cache.get("0"))
+        self.assertIsNotNone(self.cache.get("9"))
+        self.assertIsNotNone(self.cache.get("10"))
+        self.assertLessEqual(len(list(ExperimentCache._dirpath.glob("*.json"))), 10)
+
+    def test_concurrent_puts(self):
+        entry = CachedExperiment(resources=["foo.png"], expInfo={})
+
+        def put(i):
+            for j in range(20):
+                self.cache.put(f"{(i + j) % 12}", entry)
+
+        threads = [threading.Thread(target=put, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        entries = list(ExperimentCache._dirpath.glob("*.json"))
+        self.assertLessEqual(len(entries), 10)
+        self.assertEqual(self.cache._size, len(entries))
+        self.assertEqual(list(ExperimentCache._dirpath.glob("*.tmp")), [])
+        for p in entries:
+            self.assertEqual(self.cache.get(p.stem), entry)
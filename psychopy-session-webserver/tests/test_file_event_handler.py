@@ -6,20 +6,31 @@ import unittest
 from pathlib import Path
 from unittest.mock import Mock, call
 
-from psychopy_session_webserver.file_event_handler import FileEventHandler
+from psychopy_session_webserver.file_event_handler import FileEventHandler, PathFilter
 from watchdog.observers import Observer
 
 
-class FileEventHandlerTest(unittest.TestCase):
+class FileEventHandlerFixture:
+    window = 0.0
+    ignoredPatterns = []
 
     def setUp(self):
         self.tempdir = tempfile.TemporaryDirectory()
         self.addCleanup(self.tempdir.cleanup)
         self.observer = Observer()
         self.mock = Mock()
+        self.dataHandler = Mock()
         self.handler = FileEventHandler(
             session=self.mock,
             root=self.tempdir.name,
+            window=self.window,
+            ignore=PathFilter(
+                root=self.tempdir.name,
+                directories=[Path(self.tempdir.name).joinpath("data")],
+                patterns=self.ignoredPatterns,
+            ),
+            dataDir=Path(self.tempdir.name).joinpath("data"),
+            dataHandler=self.dataHandler,
         )
         self.observer = Observer()
         self.observer.schedule(self.handler, self.tempdir.name, recursive=True)
@@ -30,6 +41,7 @@ class FileEventHandlerTest(unittest.TestCase):
             self.observer.join()
 
         self.addCleanup(stopAndJoin)
+        self.addCleanup(self.handler.close)
 
     def local_filepath(self, path):
         return Path(self.tempdir.name).joinpath(path)
@@ -38,11 +50,16 @@ class FileEventHandlerTest(unittest.TestCase):
         with open(self.local_filepath(path), "w+") as f:
             f.write("One more thing\n")
 
+
+class FileEventHandlerTest(FileEventHandlerFixture, unittest.TestCase):
+
     def test_add_experiment(self):
         self.local_filepath("blue.psyexp").touch()
         time.sleep(0.02)
 
-        self.mock.addExperiment.assert_called_once_with(file="blue.psyexp")
+        self.mock.updateExperiments.assert_called_once_with(
+            added=["blue.psyexp"], removed=[]
+        )
 
     def test_add_experiment_only_once(self):
         p = self.local_filepath("once.psyexp")
@@ -54,15 +71,19 @@ class FileEventHandlerTest(unittest.TestCase):
             self.assertEqual(f.readlines(), ["One line\n"])
 
         time.sleep(0.02)
-        self.mock.addExperiment.assert_called_once_with(file="once.psyexp")
+        self.mock.updateExperiments.assert_called_once_with(
+            added=["once.psyexp"], removed=[]
+        )
 
     def test_remove_experiment(self):
         p = self.local_filepath("remove.psyexp")
         p.touch()
         os.remove(p)
         time.sleep(0.02)
-        self.mock.addExperiment.assert_called_once()
-        self.mock.removeExperiment.assert_called_once_with(key="remove.psyexp")
+        self.mock.assert_has_calls([
+            call.updateExperiments(added=["remove.psyexp"], removed=[]),
+            call.updateExperiments(added=[], removed=["remove.psyexp"]),
+        ])
 
     def test_move_experiment(self):
         src = self.local_filepath("src.psyexp")
@@ -72,9 +93,8 @@ class FileEventHandlerTest(unittest.TestCase):
         os.rename(src, dest)
         time.sleep(0.02)
         self.mock.assert_has_calls([
-            call.addExperiment(file="src.psyexp"),
-            call.removeExperiment(key="src.psyexp"),
-            call.addExperiment(file="dest.psyexp"),
+            call.updateExperiments(added=["src.psyexp"], removed=[]),
+            call.updateExperiments(added=["dest.psyexp"], removed=["src.psyexp"]),
         ])
 
     def test_add_non_experiment(self):
@@ -100,5 +120,121 @@ class FileEventHandlerTest(unittest.TestCase):
         ])
 
 
+class FilteringFileEventHandlerTest(FileEventHandlerFixture, unittest.TestCase):
+    ignoredPatterns = ["*.py"]
+
+    def test_ignores_data_directory(self):
+        os.makedirs(self.local_filepath("data/participant"))
+        self.modify("data/participant/foo.csv")
+        self.modify("foo.py")
+        time.sleep(0.02)
+        self.mock.validateResources.assert_not_called()
+        self.assertGreater(self.handler.filtered, 0)
+        # the data directory events are only forwarded.
+        paths = {c.args[0].src_path for c in self.dataHandler.dispatch.call_args_list}
+        self.assertIn(str(self.local_filepath("data/participant/foo.csv")), paths)
+        self.assertNotIn(str(self.local_filepath("foo.py")), paths)
+
+        self.modify("foo.csv")
+        time.sleep(0.02)
+        self.mock.validateResources.assert_called_once_with(paths=["foo.csv"])
+        self.assertGreater(self.handler.processed, 0)
+
+    def test_moves_across_ignored_paths(self):
+        os.makedirs(self.local_filepath("data"))
+        self.local_filepath("data/foo").touch()
+        # lets the observer watch the new directory.
+        time.sleep(0.02)
+        os.rename(self.local_filepath("data/foo"), self.local_filepath("foo"))
+        os.rename(self.local_filepath("foo"), self.local_filepath("foo.py"))
+        time.sleep(0.02)
+        self.mock.assert_has_calls([
+            call.validateResources(paths=["foo"]),
+            call.validateResources(paths=["foo"]),
+        ])
+
+
+class PathFilterTest(unittest.TestCase):
+    def test_filters_directories_and_patterns(self):
+        f = PathFilter(directories=["/session/data/"], patterns=["*.py", "*.log"])
+        self.assertTrue(f("/session/data/foo.png"))
+        self.assertTrue(f("/session/data/participant/foo.csv"))
+        self.assertFalse(f("/session/database.png"))
+        self.assertTrue(f("/session/foo.py"))
+        self.assertTrue(f("/session/images/foo.log"))
+        self.assertFalse(f("/session/foo.psyexp"))
+        self.assertFalse(f("/session/py/foo.png"))
+        self.assertFalse(PathFilter()("/session/foo.py"))
+
+    def test_filters_subtrees(self):
+        f = PathFilter(
+            root="/session",
+            patterns=["__pycache__", ".git/", "stimuli/tmp", "/*.log", "*.pyc"],
+        )
+        self.assertTrue(f("/session/__pycache__/foo.png"))
+        self.assertTrue(f("/session/sub/__pycache__/foo.png"))
+        self.assertTrue(f("/session/.git/objects/ab/cdef"))
+        self.assertTrue(f("/session/sub/.git/HEAD"))
+        # a trailing '/' only matches directories.
+        self.assertFalse(f("/session/.git"))
+        self.assertTrue(f("/session/stimuli/tmp/foo.png"))
+        self.assertFalse(f("/session/other/stimuli/tmp/foo.png"))
+        self.assertTrue(f("/session/foo.log"))
+        self.assertFalse(f("/session/logs/foo.log"))
+        self.assertTrue(f("/session/sub/foo.pyc"))
+        # the components of the root are not matched.
+        self.assertFalse(PathFilter(root="/.git", patterns=[".git/"])("/.git/foo"))
+
+
+class CoalescingFileEventHandlerTest(FileEventHandlerFixture, unittest.TestCase):
+    window = 0.05
+
+    def test_move_non_experiment(self):
+        self.local_filepath("foo").touch()
+        os.rename(src=self.local_filepath("foo"), dst=self.local_filepath("bar"))
+        time.sleep(0.1)
+        self.mock.validateResources.assert_called_once_with(paths=["foo", "bar"])
+
+    def test_remove_non_experiment(self):
+        self.local_filepath("foo").touch()
+        os.remove(self.local_filepath("foo"))
+        time.sleep(0.1)
+        self.mock.validateResources.assert_called_once_with(paths=["foo"])
+
+    def test_remove_experiment(self):
+        p = self.local_filepath("remove.psyexp")
+        p.touch()
+        os.remove(p)
+        time.sleep(0.1)
+        self.mock.updateExperiments.assert_called_once_with(
+            added=[], removed=["remove.psyexp"]
+        )
+
+    def test_move_experiment(self):
+        src = self.local_filepath("src.psyexp")
+        dest = self.local_filepath("dest.psyexp")
+        src.touch()
+        os.rename(src, dest)
+        time.sleep(0.1)
+        self.mock.updateExperiments.assert_called_once_with(
+            added=["dest.psyexp"], removed=["src.psyexp"]
+        )
+
+    def test_bulk_changes_are_batched(self):
+        for i in range(10):
+            self.local_filepath(f"{i}.png").touch()
+        for i in range(3):
+            self.modify("blue.psyexp")
+            self.modify("red.psyexp")
+        time.sleep(0.1)
+
+        self.mock.validateResources.assert_called_once_with(
+            paths=[f"{i}.png" for i in range(10)]
+        )
+        self.mock.updateExperiments.assert_called_once_with(
+            added=["blue.psyexp", "red.psyexp"], removed=[]
+        )
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=42)
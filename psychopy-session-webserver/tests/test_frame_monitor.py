@@ -0,0 +1,83 @@
+import threading
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+
+from psychopy_session_webserver.frame_monitor import (
+    FrameMonitor,
+    dropped_frames,
+    interval_stats,
+)
+
+
+class FrameStatsTest(unittest.TestCase):
+    def test_dropped_frames(self):
+        expected = 1 / 60
+        intervals = np.array([1, 1, 1.4, 1.6, 2, 3.1, 1]) * expected
+        # 1.6 and 2 periods miss one refresh each, 3.1 periods miss two.
+        self.assertEqual(dropped_frames(intervals, expected), 4)
+        self.assertEqual(dropped_frames(np.zeros(0), expected), 0)
+
+    def test_interval_stats(self):
+        intervals = np.concatenate([np.full(99, 0.01), [0.05]])
+        mean, p99, max = interval_stats(intervals)
+        self.assertAlmostEqual(mean, 0.0104)
+        self.assertAlmostEqual(p99, 0.0104)
+        self.assertEqual(max, 0.05)
+        self.assertEqual(interval_stats(np.zeros(0)), (0.0, 0.0, 0.0))
+
+
+class FrameMonitorTest(unittest.TestCase):
+    def setUp(self):
+        self.win = SimpleNamespace(recordFrameIntervals=False, frameIntervals=[0.5])
+
+    def test_records_run_intervals(self):
+        monitor = FrameMonitor(self.win, 3, "foo.psyexp", frameRate=50.0)
+        monitor.start()
+        self.assertTrue(self.win.recordFrameIntervals)
+        self.assertEqual(self.win.frameIntervals, [])
+
+        self.win.frameIntervals.extend([0.02] * 10)
+        live = monitor.stats()
+        self.assertEqual(live.frames, 10)
+        self.assertEqual(live.dropped, 0)
+
+        self.win.frameIntervals.extend([0.04, 0.02])
+        stats = monitor.stop()
+        self.assertFalse(self.win.recordFrameIntervals)
+        self.assertEqual(stats.run, 3)
+        self.assertEqual(stats.experiment, "foo.psyexp")
+        self.assertEqual(stats.frames, 12)
+        self.assertEqual(stats.dropped, 1)
+        self.assertEqual(stats.expectedInterval, 0.02)
+        self.assertAlmostEqual(stats.meanInterval, 0.26 / 12)
+        self.assertEqual(stats.maxInterval, 0.04)
+
+    def test_live_stats_use_recent_frames(self):
+        monitor = FrameMonitor(self.win, 1, "foo.psyexp", window=4)
+        monitor.start()
+        self.win.frameIntervals.extend([0.1] * 4 + [0.02] * 4)
+        # without a measured frame rate, the median interval is expected.
+        live = monitor.stats()
+        self.assertEqual(live.frames, 8)
+        self.assertEqual(live.maxInterval, 0.02)
+        self.assertIsNone(live.expectedInterval)
+        monitor.stop()
+
+    def test_sends_live_stats(self):
+        received = threading.Event()
+        stats = []
+
+        def onStats(s):
+            stats.append(s)
+            received.set()
+
+        monitor = FrameMonitor(
+            self.win, 1, "foo.psyexp", frameRate=60.0, onStats=onStats, interval=0.01
+        )
+        monitor.start()
+        self.win.frameIntervals.append(1 / 60)
+        self.assertTrue(received.wait(1.0))
+        monitor.stop()
+        self.assertEqual(stats[-1].run, 1)
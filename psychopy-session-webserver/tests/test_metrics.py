@@ -0,0 +1,101 @@
+import threading
+import unittest
+
+# imports the modules registering metrics in the default registry.
+from psychopy_session_webserver import metrics, session
+from psychopy_session_webserver.metrics import Counter, Gauge, Histogram, Registry
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_sums_threads(self):
+        c = self.registry.register(Counter("events_total", "Events.", ["type"]))
+
+        def work():
+            for _ in range(1000):
+                c.labels("created").inc()
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        c.labels(type="deleted").inc(2)
+
+        self.assertEqual(
+            self.registry.render(),
+            "# HELP events_total Events.\n"
+            "# TYPE events_total counter\n"
+            'events_total{type="created"} 4000\n'
+            'events_total{type="deleted"} 2\n',
+        )
+
+    def test_gauge(self):
+        g = self.registry.register(Gauge("depth", "Depth."))
+        g.set(3)
+        self.assertIn("depth 3\n", self.registry.render())
+        g.setFunction(lambda: 1.5)
+        self.assertIn("depth 1.5\n", self.registry.render())
+
+    def test_histogram(self):
+        h = self.registry.register(Histogram("latency_seconds", "L.", buckets=[1, 0.1]))
+        for v in [0.05, 0.1, 0.25, 2.0]:
+            h.observe(v)
+
+        self.assertEqual(
+            self.registry.render(),
+            "# HELP latency_seconds L.\n"
+            "# TYPE latency_seconds histogram\n"
+            'latency_seconds_bucket{le="0.1"} 2\n'
+            'latency_seconds_bucket{le="1"} 3\n'
+            'latency_seconds_bucket{le="+Inf"} 4\n'
+            "latency_seconds_sum 2.4\n"
+            "latency_seconds_count 4\n",
+        )
+
+    def test_histogram_sums_short_lived_threads(self):
+        h = self.registry.register(Histogram("latency_seconds", "L.", buckets=[1]))
+        # like the threading.Timer flushing the file events.
+        for _ in range(200):
+            t = threading.Thread(target=h.observe, args=(0.5,))
+            t.start()
+            t.join()
+
+        self.assertIn('latency_seconds_bucket{le="1"} 200\n', self.registry.render())
+        self.assertIn("latency_seconds_sum 100\n", self.registry.render())
+
+    def test_histogram_time(self):
+        h = Histogram("duration_seconds", "D.", ["phase"])
+        with h.labels("run").time():
+            pass
+        samples = {(n, tuple(l)): v for n, l, v in h.samples()}
+        self.assertEqual(samples[("duration_seconds_count", (("phase", "run"),))], 1)
+
+    def test_checks_labels(self):
+        c = Counter("events_total", "Events.", ["type"])
+        with self.assertRaises(ValueError):
+            c.inc()
+        with self.assertRaises(ValueError):
+            c.labels("a", "b")
+
+    def test_escapes_label_values(self):
+        c = self.registry.register(Counter("events_total", "Events.", ["path"]))
+        c.labels('a "b"\\c').inc()
+        self.assertIn('events_total{path="a \\"b\\"\\\\c"} 1\n', self.registry.render())
+
+    def test_refuses_duplicates(self):
+        self.registry.register(Counter("events_total", "Events."))
+        with self.assertRaises(ValueError):
+            self.registry.register(Gauge("events_total", "Events."))
+
+    def test_default_registry(self):
+        text = metrics.REGISTRY.render()
+        for name in [
+            "psychopy_session_task_wait_seconds",
+            "psychopy_session_file_events_total",
+            "psychopy_session_resource_validation_seconds",
+            "psychopy_session_experiment_phase_seconds",
+        ]:
+            self.assertIn(f"# TYPE {name} ", text)
@@ -0,0 +1,75 @@
+import time
+import unittest
+
+from psychopy_session_webserver.participant_index import ParticipantIndex
+
+
+class ParticipantIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = ParticipantIndex()
+        for i, name in enumerate(["asari", "turian", "Krogan", "salarian", "quarian"]):
+            self.index.add(name, activity=i)
+
+    def pages(self, **kwargs):
+        cursor = None
+        pages = []
+        while True:
+            names, cursor = self.index.search(cursor=cursor, **kwargs)
+            pages.append(names)
+            if cursor is None:
+                return pages
+
+    def test_prefix(self):
+        self.assertEqual(self.index.withPrefix("s"), ["salarian"])
+        self.assertEqual(self.index.withPrefix("k"), [])
+        self.assertEqual(self.index.withPrefix(""), sorted(self.index._names))
+
+    def test_substring(self):
+        self.assertEqual(self.index.containing("ari"), {"asari", "salarian", "quarian"})
+        self.assertEqual(self.index.containing("ARIAN"), {"salarian", "quarian"})
+        self.assertEqual(self.index.containing("kro"), {"Krogan"})
+        self.assertEqual(self.index.containing("arians"), set())
+
+    def test_pagination(self):
+        self.assertEqual(
+            self.pages(limit=2),
+            [["Krogan", "asari"], ["quarian", "salarian"], ["turian"]],
+        )
+        self.assertEqual(
+            self.pages(limit=2, sort="recent"),
+            [["quarian", "salarian"], ["Krogan", "turian"], ["asari"]],
+        )
+        self.assertEqual(
+            self.pages(limit=1, contains="rian"),
+            [["quarian"], ["salarian"], ["turian"]],
+        )
+        self.assertEqual(
+            self.pages(limit=1, contains="rian", sort="recent"),
+            [["quarian"], ["salarian"], ["turian"]],
+        )
+        self.assertEqual(self.pages(limit=5, prefix="as"), [["asari"]])
+
+    def test_activity(self):
+        self.index.add("asari", activity=10)
+        self.index.touch("quarian", activity=1)
+        names, _ = self.index.search(sort="recent", limit=2)
+        self.assertEqual(names, ["asari", "quarian"])
+
+    def test_invalid_queries(self):
+        with self.assertRaises(ValueError):
+            self.index.search(sort="size")
+        with self.assertRaises(ValueError):
+            self.index.search(sort="recent", cursor="asari")
+
+    def test_lookup_is_fast(self):
+        index = ParticipantIndex()
+        for i in range(10000):
+            index.add(f"monkey-{i:05d}", activity=i)
+
+        start = time.perf_counter()
+        for _ in range(100):
+            index.search(prefix="monkey-05", limit=20)
+            index.search(contains="123", limit=20, sort="recent")
+        # generous bound to stay reliable on slow machines.
+        self.assertLess((time.perf_counter() - start) / 200, 0.005)
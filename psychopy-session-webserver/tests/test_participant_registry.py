@@ -1,13 +1,17 @@
 import os
+import time
 from tempfile import TemporaryDirectory
 import unittest
 
 from pathlib import Path
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
+
+from watchdog.observers import Observer
 
 from pydantic import ValidationError
 
 from psychopy_session_webserver.participants_registry import ParticipantRegistry
+from psychopy_session_webserver.psydat_index import PsydatIndex
 from psychopy_session_webserver.types import Participant
 
 
@@ -30,9 +34,18 @@ class ParticipantRegitryTest(unittest.TestCase):
 
         os.makedirs(ParticipantRegistry._filepath.parent)
 
+        actualCache = PsydatIndex._dirpath
+        PsydatIndex._dirpath = Path(self.tempdir).joinpath("xdg_cache_home")
+
+        def resetCache():
+            PsydatIndex._dirpath = actualCache
+
+        self.addCleanup(resetCache)
+
         self.dataDir = Path(self.tempdir).joinpath("data")
         self.updates = Mock()
         self.registry = ParticipantRegistry(self.updates, self.dataDir)
+        self.addCleanup(lambda: self.registry.close())
 
     def test_next_session_only_increase(self):
         self.registry["foo"] = 1
@@ -53,6 +66,138 @@ class ParticipantRegitryTest(unittest.TestCase):
         self.registry = ParticipantRegistry(self.updates, self.dataDir)
         self.assertEqual(self.registry["foo"], Participant(name="foo", nextSession=1))
 
+    def test_updates_are_journaled(self):
+        self.registry["foo"] = 1
+        self.registry["bar"] = 2
+        self.registry["foo"] = 3
+
+        self.assertFalse(ParticipantRegistry._filepath.exists())
+        with open(ParticipantRegistry._journalpath(), "rb") as f:
+            self.assertEqual(len(f.read().splitlines()), 3)
+
+        self.registry.close()
+        # a crash while appending a record
+        with open(ParticipantRegistry._journalpath(), "ab") as f:
+            f.write(b'{"name":"baz","nextSe')
+
+        self.registry = ParticipantRegistry(self.updates, self.dataDir)
+        self.assertEqual(self.registry["foo"], Participant(name="foo", nextSession=3))
+        self.assertEqual(self.registry["bar"], Participant(name="bar", nextSession=2))
+        with self.assertRaises(KeyError):
+            self.registry["baz"]
+        # the journal was compacted in the participants file
+        self.assertTrue(ParticipantRegistry._filepath.exists())
+        self.assertEqual(ParticipantRegistry._journalpath().stat().st_size, 0)
+
+    def test_journal_is_compacted(self):
+        self.registry.compactThreshold = 10
+        for i in range(1, 12):
+            self.registry["foo"] = i
+
+        with open(ParticipantRegistry._journalpath(), "rb") as f:
+            self.assertEqual(len(f.read().splitlines()), 1)
+        self.registry.close()
+
+        self.registry = ParticipantRegistry(self.updates, self.dataDir)
+        self.assertEqual(self.registry["foo"], Participant(name="foo", nextSession=11))
+
+    def psydat(self, path):
+        path = self.dataDir.joinpath(path)
+        os.makedirs(path.parent, exist_ok=True)
+        path.touch()
+
+    def test_sessions_are_counted_from_data(self):
+        self.psydat("a/foo_1.psydat")
+        self.psydat("a/foo_2.psydat")
+        self.psydat("b/foo_3.psydat")
+        self.psydat("b/bar_1.psydat")
+        self.psydat("b/bar.csv")
+        self.psydat("c/d/foo_4.psydat")
+        self.psydat("baz_1.psydat")
+
+        with patch.object(
+            PsydatIndex,
+            "_scanDirectory",
+            autospec=True,
+            side_effect=PsydatIndex._scanDirectory,
+        ) as scanDirectory:
+            self.registry = ParticipantRegistry(self.updates, self.dataDir)
+        self.assertEqual(scanDirectory.call_count, 3)
+        self.assertEqual(self.registry["foo"], Participant(name="foo", nextSession=4))
+        self.assertEqual(self.registry["bar"], Participant(name="bar", nextSession=2))
+        with self.assertRaises(KeyError):
+            self.registry["baz"]
+
+        # only the modified directory is scanned again
+        self.psydat("b/bar_2.psydat")
+        with patch.object(
+            PsydatIndex,
+            "_scanDirectory",
+            autospec=True,
+            side_effect=PsydatIndex._scanDirectory,
+        ) as scanDirectory:
+            self.registry = ParticipantRegistry(self.updates, self.dataDir)
+        scanDirectory.assert_called_once()
+        self.assertEqual(self.registry["bar"], Participant(name="bar", nextSession=3))
+        self.assertEqual(self.registry["foo"], Participant(name="foo", nextSession=4))
+
+    def test_new_data_are_counted_while_running(self):
+        observer = Observer()
+        onData = Mock()
+        self.registry = ParticipantRegistry(
+            self.updates, self.dataDir, observer=observer, onData=onData
+        )
+        observer.start()
+        self.addCleanup(observer.join)
+        self.addCleanup(observer.stop)
+
+        self.psydat("a/foo_1.psydat")
+        self.psydat("a/foo_2.psydat")
+        time.sleep(0.05)
+
+        self.assertEqual(self.registry["foo"], Participant(name="foo", nextSession=3))
+        self.updates.broadcastDict.assert_called_with(
+            "participants", "foo", Participant(name="foo", nextSession=3)
+        )
+        onData.assert_called_with("foo")
+
+        # a removed file is not saved data.
+        onData.reset_mock()
+        os.remove(self.dataDir.joinpath("a/foo_2.psydat"))
+        time.sleep(0.05)
+        onData.assert_not_called()
+
+        # the rescanned directory is persisted.
+        with patch.object(
+            PsydatIndex,
+            "_scanDirectory",
+            autospec=True,
+            side_effect=PsydatIndex._scanDirectory,
+        ) as scanDirectory:
+            ParticipantRegistry(self.updates, self.dataDir).close()
+        scanDirectory.assert_not_called()
+
+    def test_search(self):
+        self.registry["foo"] = 1
+        self.registry["bar"] = 1
+        self.registry["foobar"] = 1
+
+        page = self.registry.search(prefix="foo", limit=1)
+        self.assertEqual(page.participants, [Participant(name="foo", nextSession=1)])
+        page = self.registry.search(prefix="foo", limit=1, cursor=page.nextCursor)
+        self.assertEqual(page.participants, [Participant(name="foobar", nextSession=1)])
+        self.assertIsNone(page.nextCursor)
+
+        self.registry["bar"] = 2
+        self.registry.close()
+        # activity is persisted
+        self.registry = ParticipantRegistry(self.updates, self.dataDir)
+        page = self.registry.search(contains="bar", sort="recent")
+        self.assertEqual(
+            [p.name for p in page.participants],
+            ["bar", "foobar"],
+        )
+
     def test_starts_empty(self):
         with self.assertRaises(KeyError):
             self.registry["does-not-exist"]
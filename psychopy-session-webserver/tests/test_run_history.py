@@ -0,0 +1,53 @@
+import unittest
+from unittest.mock import Mock, call
+
+from psychopy_session_webserver.run_history import RunHistory
+
+
+class RunHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.updates = Mock()
+        self.history = RunHistory(self.updates, size=2)
+
+    def test_records_steps(self):
+        id = self.history.start("foo.psyexp", requested=1, participant=123, session="2")
+        self.history.mark(id, "started", at=10)
+        # a step is only recorded once.
+        self.history.mark(id, "started", at=20)
+        self.history.mark(id, "returned", at=30, error="boom")
+
+        run = self.history.runs()[0]
+        self.assertEqual(run.participant, "123")
+        self.assertEqual(run.session, 2)
+        self.assertEqual(run.requested, 1)
+        self.assertEqual(run.started, 10)
+        self.assertEqual(run.returned, 30)
+        self.assertEqual(run.error, "boom")
+
+        self.assertEqual(self.updates.broadcastDict.call_count, 3)
+        self.assertEqual(self.updates.broadcastDict.call_args, call("runs", "1", run))
+
+    def test_broadcast_runs_are_not_modified(self):
+        id = self.history.start("foo.psyexp", requested=1)
+        first = self.updates.broadcastDict.call_args.args[2]
+        self.history.mark(id, "started")
+        self.assertIsNone(first.started)
+
+    def test_evicts_oldest_runs(self):
+        ids = [self.history.start("foo.psyexp", requested=i) for i in range(3)]
+        self.assertEqual([r.id for r in self.history.runs()], ids[1:])
+        self.updates.broadcastDict.assert_called_with("runs", str(ids[0]), None)
+        # marking an evicted run is ignored.
+        self.history.mark(ids[0], "started")
+        self.assertEqual(self.updates.broadcastDict.call_count, 4)
+
+    def test_data_saved_for_last_started_run(self):
+        first = self.history.start("foo.psyexp", requested=1, participant="Lolo")
+        self.history.mark(first, "started")
+        second = self.history.start("foo.psyexp", requested=2, participant="Lolo")
+
+        self.history.dataSaved("Lolo")
+        self.history.dataSaved("Other")
+        runs = {r.id: r for r in self.history.runs()}
+        self.assertIsNotNone(runs[first].dataSaved)
+        self.assertIsNone(runs[second].dataSaved)
@@ -17,10 +17,22 @@ class ScriptArgumentTest(unittest.TestCase):
                 "listen": ["192.168.0.0/16", "10.0.0.0/8", "100.64.0.0/10"],
                 "port": 5000,
                 "data_dir": None,
+                "scan_workers": None,
+                "max_loaded_experiments": 8,
+                "event_window": 0.2,
+                "update_interval": 0.0,
+                "max_queued_tasks": 4,
+                "prepare_timeout": 60.0,
+                "compression_level": 6,
+                "ignore": ["*.py", "*.pyc"],
             },
             opts,
         )
 
+    def test_scan_workers(self):
+        opts = parse_options(["-j", "0", "./foo"])
+        self.assertEqual(opts["scan_workers"], 0)
+
     def test_listen_overrrides_default(self):
         opts = parse_options(["-l", "0.0.0.0", "-l", "::", "./foo"])
         self.assertDictEqual(
@@ -29,6 +41,14 @@ class ScriptArgumentTest(unittest.TestCase):
                 "listen": ["0.0.0.0", "::"],
                 "port": 5000,
                 "data_dir": None,
+                "scan_workers": None,
+                "max_loaded_experiments": 8,
+                "event_window": 0.2,
+                "update_interval": 0.0,
+                "max_queued_tasks": 4,
+                "prepare_timeout": 60.0,
+                "compression_level": 6,
+                "ignore": ["*.py", "*.pyc"],
             },
             opts,
         )
@@ -4,16 +4,26 @@ import tempfile
 import threading
 import time
 import unittest
+from concurrent.futures import Future
 from contextlib import contextmanager
 from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
 
 from pydantic import ValidationError
 from structlog import get_logger
 from xdg import BaseDirectory
 
+from psychopy_session_webserver.async_task_runner import TaskQueueFull
+from psychopy_session_webserver.catalog_snapshot import CatalogSnapshot
+from psychopy_session_webserver.experiment_cache import (
+    CachedExperiment,
+    ExperimentCache,
+)
 from psychopy_session_webserver.participants_registry import ParticipantRegistry
+from psychopy_session_webserver.psydat_index import PsydatIndex
 from psychopy_session_webserver.session import Session
-from psychopy_session_webserver.types import Experiment, Participant
+from psychopy_session_webserver.types import Experiment, FrameStats, Participant
 from psychopy_session_webserver.update_broadcaster import UpdateEvent
 
 from tests.mock_session import build_mock_session
@@ -30,6 +40,9 @@ class SessionTest(unittest.TestCase):
             "xdg_data_dir/participants.json"
         )
         os.makedirs(ParticipantRegistry._filepath.parent)
+        ExperimentCache._dirpath = Path(self.tempdir.name).joinpath("xdg_cache_dir")
+        CatalogSnapshot._dirpath = Path(self.tempdir.name).joinpath("xdg_cache_dir")
+        PsydatIndex._dirpath = Path(self.tempdir.name).joinpath("xdg_cache_dir")
 
         self.psy_session = build_mock_session(self.sessionDir)
 
@@ -48,6 +61,15 @@ class SessionTest(unittest.TestCase):
         ParticipantRegistry._filepath = Path(
             BaseDirectory.save_data_path("psychopy_session_webserver")
         ).joinpath("participants.json")
+        ExperimentCache._dirpath = Path(
+            BaseDirectory.save_cache_path("psychopy_session_webserver")
+        ).joinpath("experiments")
+        CatalogSnapshot._dirpath = Path(
+            BaseDirectory.save_cache_path("psychopy_session_webserver")
+        )
+        PsydatIndex._dirpath = Path(
+            BaseDirectory.save_cache_path("psychopy_session_webserver")
+        )
 
     def test_existing_experiment_are_listed(self):
         self.assertIn("foo.psyexp", self.session.experiments)
@@ -154,6 +176,430 @@ class SessionTest(unittest.TestCase):
             blocking=True,
         )
 
+    def window_settings(self, key, **settings):
+        self.psy_session.experimentObjects[key].settings.params = {
+            name: SimpleNamespace(val=value) for name, value in settings.items()
+        }
+
+    def test_prepared_experiment_starts_in_opened_window(self):
+        self.window_settings("foo.psyexp", Units="height")
+        with self.with_file("foo.png"):
+            self.session.prepareExperiment("foo.psyexp", participant="Lolo")
+            self.psy_session.setupWindowFromExperiment.assert_called_once()
+            # the participant session is only registered by the run.
+            self.assertNotIn("Lolo", self.session.participants)
+
+            self.session.runExperiment("foo.psyexp", participant="Lolo", session=2)
+
+        self.psy_session.setupWindowFromExperiment.assert_called_once()
+        self.psy_session.runExperiment.assert_called_once()
+        self.assertIsNone(self.session.runs()[0].windowOpened)
+
+    def test_frame_rate_is_measured_once_per_screen(self):
+        windows = []
+        openWindow = self.psy_session.setupWindowFromExperiment.side_effect
+
+        def recordWindow(*args, **kwargs):
+            openWindow(*args, **kwargs)
+            windows.append(self.psy_session.win)
+
+        self.psy_session.setupWindowFromExperiment.side_effect = recordWindow
+        with self.with_file("foo.png"):
+            self.window_settings("foo.psyexp", Screen="1", Units="height")
+            self.session.prepareExperiment("foo.psyexp")
+            self.window_settings("foo.psyexp", Screen="1", Units="pix")
+            self.session.prepareExperiment("foo.psyexp")
+            self.window_settings("foo.psyexp", Screen="2", Units="pix")
+            self.session.prepareExperiment("foo.psyexp")
+
+        self.assertEqual(len(windows), 3)
+        self.assertEqual([w.getActualFrameRate.call_count for w in windows], [1, 0, 1])
+        self.assertEqual(self.session._frameRate, 30.0)
+
+    def test_frame_stats_without_participant(self):
+        stats = FrameStats(
+            run=1,
+            experiment="foo.psyexp",
+            frames=0,
+            dropped=0,
+            expectedInterval=None,
+            meanInterval=0.0,
+            p99Interval=0.0,
+            maxInterval=0.0,
+        )
+        self.session._saveFrameStats(stats, None, get_logger())
+        summaries = [p.name for p in self.sessionDir.joinpath("data").iterdir()]
+        self.assertEqual(len(summaries), 1)
+        self.assertRegex(summaries[0], r"^foo_.*_frames\.json$")
+
+    def test_prepare_experiment_checks_parameters(self):
+        with self.with_file("foo.png"):
+            with self.assertRaises(RuntimeError) as e:
+                self.session.prepareExperiment("foo.psyexp", reward=3)
+        self.assertEqual(str(e.exception), "invalid experiment parameter(s) ['reward']")
+        self.psy_session.setupWindowFromExperiment.assert_not_called()
+
+    def test_window_is_reopened_with_different_settings(self):
+        self.window_settings("foo.psyexp", Units="height")
+        with self.with_file("foo.png"):
+            self.session.prepareExperiment("foo.psyexp")
+            firstWindow = self.psy_session.win
+            self.session.prepareExperiment("foo.psyexp")
+            self.psy_session.setupWindowFromExperiment.assert_called_once()
+
+            self.window_settings("foo.psyexp", Units="pix")
+            self.session.runExperiment("foo.psyexp", participant="Lolo", session=2)
+
+        firstWindow.close.assert_called_once()
+        self.assertEqual(self.psy_session.setupWindowFromExperiment.call_count, 2)
+        self.assertIsNotNone(self.session.runs()[0].windowOpened)
+
+    def test_window_is_reopened_with_unknown_settings(self):
+        with self.with_file("foo.png"):
+            self.session.prepareExperiment("foo.psyexp")
+            firstWindow = self.psy_session.win
+            self.session.runExperiment("foo.psyexp", participant="Lolo", session=2)
+
+        firstWindow.close.assert_called_once()
+        self.assertEqual(self.psy_session.setupWindowFromExperiment.call_count, 2)
+
+    def test_expired_timer_does_not_release_later_prepare(self):
+        self.window_settings("foo.psyexp", Units="height")
+        with self.with_file("foo.png"):
+            self.session.prepareExperiment("foo.psyexp")
+            generation = self.session._preparedGeneration
+            self.session.prepareExperiment("foo.psyexp")
+            window = self.psy_session.win
+
+            # the first timer fired before the second prepare.
+            self.session._expirePrepared(generation)
+            window.close.assert_not_called()
+            self.assertEqual(self.session._prepared, "foo.psyexp")
+
+            self.session._expirePrepared(self.session._preparedGeneration)
+            window.close.assert_called_once()
+
+    def test_prepared_window_is_closed_after_timeout(self):
+        self.session.prepareTimeout = 0.05
+        thread = threading.Thread(target=self.session.run)
+        thread.start()
+        try:
+            with self.with_file("foo.png"):
+                self.session.prepareExperiment("foo.psyexp")
+                window = self.psy_session.win
+                time.sleep(0.2)
+            window.close.assert_called_once()
+            self.assertIsNone(self.psy_session.win)
+        finally:
+            self.session.close()
+            thread.join()
+
+    def test_cached_experiment_are_compiled_lazily(self):
+        self.session.close()
+        self.psy_session = build_mock_session(self.sessionDir)
+        self.session = Session(root=self.sessionDir, session=self.psy_session)
+
+        self.psy_session.addExperiment.assert_not_called()
+        self.assertEqual(
+            self.session.experiments["foo.psyexp"],
+            Experiment(
+                key="foo.psyexp",
+                resources={"foo.png": False},
+                parameters=["participant", "session"],
+            ),
+        )
+
+        with self.with_file("foo.png"):
+            self.session.runExperiment("foo.psyexp", participant="Lolo", session=2)
+
+        self.psy_session.addExperiment.assert_called_once_with(
+            self.local_filepath("foo.psyexp"), "foo.psyexp"
+        )
+        self.psy_session.runExperiment.assert_called_once()
+
+    def restart(self, whileStopped=lambda: None):
+        self.session.close()
+        whileStopped()
+        self.psy_session = build_mock_session(self.sessionDir)
+        with patch.object(
+            ExperimentCache, "digest", autospec=True, side_effect=ExperimentCache.digest
+        ) as digest:
+            self.session = Session(root=self.sessionDir, session=self.psy_session)
+        return digest
+
+    def test_catalog_is_restored_from_snapshot(self):
+        self.local_filepath("bar.psyexp").touch()
+        time.sleep(0.02)
+
+        def modify():
+            with open(self.local_filepath("bar.psyexp"), "w") as f:
+                f.write("modified")
+
+        digest = self.restart(modify)
+
+        # only the modified experiment is read
+        digest.assert_called_once_with(
+            self.session._cache, self.local_filepath("bar.psyexp"), "bar.psyexp"
+        )
+        self.assertEqual(sorted(self.session.experiments), ["bar.psyexp", "foo.psyexp"])
+        self.assertEqual(
+            self.session.experiments["foo.psyexp"].parameters,
+            ["participant", "session"],
+        )
+
+        digest = self.restart(lambda: os.remove(self.local_filepath("bar.psyexp")))
+        digest.assert_not_called()
+        self.assertEqual(list(self.session.experiments), ["foo.psyexp"])
+
+    def test_snapshot_of_another_environment_is_ignored(self):
+        with patch(
+            "psychopy_session_webserver.experiment_cache._environment_fingerprint",
+            return_value="psychopy==0.0.0",
+        ):
+            digest = self.restart()
+
+        # the experiment is read again instead of being restored.
+        digest.assert_called_once_with(
+            self.session._cache, self.local_filepath("foo.psyexp"), "foo.psyexp"
+        )
+        self.assertIn("foo.psyexp", self.session.experiments)
+
+    def test_concurrent_snapshot_saves(self):
+        snapshot = CatalogSnapshot(self.sessionDir, environment="psychopy==1.0.0")
+        entries = dict(self.session._snapshotEntries)
+        threads = [
+            threading.Thread(target=snapshot.save, args=(entries,)) for _ in range(8)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(list(snapshot.load()), ["foo.psyexp"])
+        self.assertEqual(list(CatalogSnapshot._dirpath.glob("*.tmp")), [])
+
+    def test_compiled_experiments_are_evicted(self):
+        self.session.maxLoadedExperiments = 1
+        self.assertIn("foo.psyexp", self.session._loaded)
+
+        self.local_filepath("bar.psyexp").touch()
+        time.sleep(0.02)
+
+        self.assertIn("bar.psyexp", self.session.experiments)
+        self.assertEqual(list(self.session._loaded), ["bar.psyexp"])
+        self.assertNotIn("foo.psyexp", self.psy_session.experimentObjects)
+
+    def test_file_changes_are_broadcast_at_once(self):
+        self.local_filepath("bar.psyexp").touch()
+        time.sleep(0.02)
+        self.session._compiler.submit(lambda: None).result()
+
+        with patch.object(
+            self.session._updates,
+            "broadcastDictItems",
+            wraps=self.session._updates.broadcastDictItems,
+        ) as broadcast:
+            self.session.updateExperiments(
+                added=["bar.psyexp", "gone.psyexp"], removed=["foo.psyexp"]
+            )
+            self.session._compiler.submit(lambda: None).result()
+
+        # the file that disappeared is skipped.
+        broadcast.assert_called_once_with(
+            "catalog",
+            {
+                "foo.psyexp": None,
+                "bar.psyexp": self.session.experiments["bar.psyexp"],
+            },
+        )
+        self.assertEqual(list(self.session.experiments), ["bar.psyexp"])
+
+    def test_running_experiment_is_not_evicted(self):
+        self.session.maxLoadedExperiments = 1
+        objects = dict(self.psy_session.experimentObjects)
+
+        def addExperiment(file, key):
+            self.psy_session.experimentObjects[key] = objects[key]
+
+        self.psy_session.addExperiment.side_effect = addExperiment
+        with open(self.local_filepath("foo.psyexp"), "w") as f:
+            f.write("v1")
+        self.session.addExperiment("foo.psyexp")
+        self.local_filepath("bar.psyexp").touch()
+
+        started = threading.Event()
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def runExperiment(key, params, blocking):
+            self.psy_session.currentExperiment = key
+            started.set()
+            release.wait()
+            self.psy_session.currentExperiment = None
+
+        self.psy_session.runExperiment.side_effect = runExperiment
+
+        def run():
+            with self.with_file("foo.png"):
+                self.session.runExperiment("foo.psyexp", participant="Lolo", session=1)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.assertTrue(started.wait(1.0))
+
+        # neither loading another experiment nor switching back to the cached
+        # version of the running one unloads it.
+        self.session.addExperiment("bar.psyexp")
+        with open(self.local_filepath("foo.psyexp"), "w") as f:
+            f.write("")
+        self.session.addExperiment("foo.psyexp")
+        self.assertIn("foo.psyexp", self.session._loaded)
+        self.assertIn("foo.psyexp", self.psy_session.experimentObjects)
+
+        release.set()
+        thread.join()
+        # the version replaced during the run is unloaded once it returns.
+        self.assertNotIn("foo.psyexp", self.session._loaded)
+        self.assertNotIn("foo.psyexp", self.psy_session.experimentObjects)
+
+    def test_failed_reload_ends_the_run(self):
+        fooExp = self.psy_session.experimentObjects["foo.psyexp"]
+        startRun = self.session._startRun
+
+        def evictAndStartRun(*args):
+            # the experiment is evicted and broken after it was prepared.
+            self.session._unloadExperiment("foo.psyexp")
+            self.psy_session.addExperiment.side_effect = RuntimeError(
+                "broken experiment"
+            )
+            return startRun(*args)
+
+        with self.with_file("foo.png"):
+            with patch.object(self.session, "_startRun", side_effect=evictAndStartRun):
+                with self.assertRaises(RuntimeError):
+                    self.session.runExperiment(
+                        "foo.psyexp", participant="Lolo", session=1
+                    )
+
+        # the window is only opened once the experiment is loaded.
+        self.psy_session.setupWindowFromExperiment.assert_not_called()
+        self.assertIsNone(self.session._currentExperiment)
+        self.assertIsNone(self.session._currentRun)
+        run = self.session.runs()[0]
+        self.assertIsNotNone(run.returned)
+        self.assertEqual(run.error, "broken experiment")
+
+        self.psy_session.addExperiment.side_effect = None
+        self.psy_session.experimentObjects["foo.psyexp"] = fooExp
+        with self.with_file("foo.png"):
+            self.session.runExperiment("foo.psyexp", participant="Lolo", session=1)
+        self.psy_session.runExperiment.assert_called_once()
+
+    @contextmanager
+    def with_busy_compiler(self):
+        release = threading.Event()
+        self.session._compiler.submit(release.wait)
+        yield
+        release.set()
+        self.session._compiler.submit(lambda: None).result()
+
+    def test_superseded_compilations_are_skipped(self):
+        self.local_filepath("bar.psyexp").touch()
+        time.sleep(0.02)
+
+        with patch.object(
+            self.session,
+            "_publishExperiment",
+            wraps=self.session._publishExperiment,
+        ) as publish:
+            with self.with_busy_compiler():
+                self.session.addExperiment("bar.psyexp", blocking=False)
+                self.session.addExperiment("bar.psyexp", blocking=False)
+
+        publish.assert_called_once()
+        self.assertIn("bar.psyexp", self.session.experiments)
+
+    def test_removal_cancels_pending_compilation(self):
+        with self.with_busy_compiler():
+            self.session.addExperiment("foo.psyexp", blocking=False)
+            self.session.removeExperiment("foo.psyexp")
+
+        self.assertNotIn("foo.psyexp", self.session.experiments)
+
+    def test_parallel_scan(self):
+        class SynchronousScanner:
+            def __init__(self, workers):
+                pass
+
+            def submit(self, file, callback):
+                future = Future()
+                future.set_result(
+                    CachedExperiment(
+                        resources=["foo.png"],
+                        expInfo={"participant": "", "session": "001"},
+                    )
+                )
+                callback(future)
+
+            def shutdown(self, cancel=False):
+                pass
+
+        self.session.close()
+        ExperimentCache._dirpath = Path(self.tempdir.name).joinpath("empty_cache")
+        CatalogSnapshot._dirpath = Path(self.tempdir.name).joinpath("empty_cache")
+        self.psy_session = build_mock_session(self.sessionDir)
+        with patch(
+            "psychopy_session_webserver.session.ExperimentScanner", SynchronousScanner
+        ):
+            self.session = Session(
+                root=self.sessionDir, session=self.psy_session, scanWorkers=2
+            )
+            self.session._scanThread.join()
+
+        self.psy_session.addExperiment.assert_not_called()
+        self.assertEqual(
+            self.session.experiments["foo.psyexp"],
+            Experiment(
+                key="foo.psyexp",
+                resources={"foo.png": False},
+                parameters=["participant", "session"],
+            ),
+        )
+
+    def test_scan_results_are_superseded_by_file_changes(self):
+        callbacks = []
+
+        class DeferredScanner:
+            def __init__(self, workers):
+                pass
+
+            def submit(self, file, callback):
+                callbacks.append(callback)
+
+            def shutdown(self, cancel=False):
+                pass
+
+        self.session.close()
+        ExperimentCache._dirpath = Path(self.tempdir.name).joinpath("empty_cache")
+        CatalogSnapshot._dirpath = Path(self.tempdir.name).joinpath("empty_cache")
+        self.psy_session = build_mock_session(self.sessionDir)
+        with patch(
+            "psychopy_session_webserver.session.ExperimentScanner", DeferredScanner
+        ):
+            self.session = Session(
+                root=self.sessionDir, session=self.psy_session, scanWorkers=2
+            )
+            self.session._scanThread.join()
+
+        # the file is removed while it is scanned.
+        self.session.updateExperiments(removed=["foo.psyexp"])
+        future = Future()
+        future.set_result(CachedExperiment(resources=[], expInfo={}))
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0](future)
+
+        self.assertNotIn("foo.psyexp", self.session.experiments)
+
 
 class SessionEventTest(unittest.IsolatedAsyncioTestCase):
     async def asyncSetUp(self) -> None:
@@ -165,6 +611,9 @@ class SessionEventTest(unittest.IsolatedAsyncioTestCase):
             "xdg_data_dir/participants.json"
         )
         os.makedirs(ParticipantRegistry._filepath.parent)
+        ExperimentCache._dirpath = Path(self.tempdir.name).joinpath("xdg_cache_dir")
+        CatalogSnapshot._dirpath = Path(self.tempdir.name).joinpath("xdg_cache_dir")
+        PsydatIndex._dirpath = Path(self.tempdir.name).joinpath("xdg_cache_dir")
 
         self.sessionDir = Path(self.tempdir.name).joinpath("session")
 
@@ -197,6 +646,9 @@ class SessionEventTest(unittest.IsolatedAsyncioTestCase):
         event = await anext(self.updates)
         self.assertEqual("participantsUpdate", event.type)
 
+        event = await anext(self.updates)
+        self.assertEqual(UpdateEvent(type="runsUpdate", data={}), event)
+
         event = await anext(self.updates)
         self.assertEqual(UpdateEvent(type="windowUpdate", data=False), event)
 
@@ -206,6 +658,15 @@ class SessionEventTest(unittest.IsolatedAsyncioTestCase):
         ParticipantRegistry._filepath = Path(
             BaseDirectory.save_data_path("psychopy_session_webserver")
         ).joinpath("participants.json")
+        ExperimentCache._dirpath = Path(
+            BaseDirectory.save_cache_path("psychopy_session_webserver")
+        ).joinpath("experiments")
+        CatalogSnapshot._dirpath = Path(
+            BaseDirectory.save_cache_path("psychopy_session_webserver")
+        )
+        PsydatIndex._dirpath = Path(
+            BaseDirectory.save_cache_path("psychopy_session_webserver")
+        )
 
     def local_filepath(self, path):
         return self.sessionDir.joinpath(path)
@@ -214,16 +675,15 @@ class SessionEventTest(unittest.IsolatedAsyncioTestCase):
 
         self.local_filepath("foo.png").touch()
         event = await anext(self.updates)
-        self.assertEqual(event.type, "catalogUpdate")
-        self.assertDictEqual(
-            event.data,
-            {
-                "foo.psyexp": Experiment(
-                    key="foo.psyexp",
-                    parameters=["participant", "session"],
-                    resources={"foo.png": True},
-                )
-            },
+        self.assertEqual(event.type, "resourcesUpdate")
+        self.assertDictEqual(event.data, {"foo.psyexp": {"foo.png": True}})
+        self.assertEqual(
+            self.session.experiments["foo.psyexp"],
+            Experiment(
+                key="foo.psyexp",
+                parameters=["participant", "session"],
+                resources={"foo.png": True},
+            ),
         )
 
         os.remove(self.local_filepath("foo.psyexp"))
@@ -234,7 +694,7 @@ class SessionEventTest(unittest.IsolatedAsyncioTestCase):
     async def test_experiment_update(self):
         self.local_filepath("foo.png").touch()
         event = await anext(self.updates)
-        self.assertEqual(event.type, "catalogUpdate")
+        self.assertEqual(event.type, "resourcesUpdate")
 
         self.session.runExperiment(
             "foo.psyexp",
@@ -246,18 +706,59 @@ class SessionEventTest(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(event.type, "participantsUpdate")
         self.assertEqual(event.data, {"Lolo": Participant(name="Lolo", nextSession=3)})
 
+        event = await anext(self.updates)
+        self.assertEqual(event.type, "runsUpdate")
+        run = event.data["1"]
+        self.assertEqual(run.experiment, "foo.psyexp")
+        self.assertEqual(run.participant, "Lolo")
+        self.assertEqual(run.session, 2)
+        self.assertLessEqual(run.requested, run.prepared)
+
         event = await anext(self.updates)
         self.assertEqual(event.type, "windowUpdate")
         self.assertEqual(event.data, True)
 
+        event = await anext(self.updates)
+        self.assertEqual(event.type, "runsUpdate")
+        self.assertIsNotNone(event.data["1"].windowOpened)
+
         event = await anext(self.updates)
         self.assertEqual(event.type, "experimentUpdate")
         self.assertEqual(event.data, "foo.psyexp")
 
+        event = await anext(self.updates)
+        self.assertEqual(event.type, "runsUpdate")
+        self.assertIsNotNone(event.data["1"].started)
+
+        event = await anext(self.updates)
+        self.assertEqual(event.type, "framesUpdate")
+        self.assertEqual(event.data.run, 1)
+        self.assertEqual(event.data.frames, 0)
+        self.assertEqual(event.data.expectedInterval, 1.0 / 30.0)
+        self.psy_session.win.getActualFrameRate.assert_called_once()
+        summaries = list(
+            self.sessionDir.joinpath("data").glob("Lolo_foo_*_frames.json")
+        )
+        self.assertEqual(len(summaries), 1)
+
+        event = await anext(self.updates)
+        self.assertEqual(event.type, "runsUpdate")
+        self.assertIsNotNone(event.data["1"].returned)
+        self.assertIsNone(event.data["1"].error)
+
         event = await anext(self.updates)
         self.assertEqual(event.type, "experimentUpdate")
         self.assertEqual(event.data, "")
 
+        # the first frame is recorded by the window.
+        self.psy_session.win.callOnFlip.assert_called_once()
+        fn, *args = self.psy_session.win.callOnFlip.call_args.args
+        fn(*args)
+        event = await anext(self.updates)
+        self.assertEqual(event.type, "runsUpdate")
+        self.assertIsNotNone(event.data["1"].firstFrame)
+        self.assertEqual(self.session.runs(), [event.data["1"]])
+
         self.session.closeWindow()
         event = await anext(self.updates)
         self.assertEqual(event.type, "windowUpdate")
@@ -282,6 +783,73 @@ class SessionEventTest(unittest.IsolatedAsyncioTestCase):
             self.session.close()
             thread.join()
 
+    async def test_dropped_run_does_not_use_session(self):
+        with self.with_file("foo.png"):
+            task = asyncio.create_task(
+                self.session.asyncRunExperiment(
+                    "foo.psyexp", participant="Lolo", session=2
+                )
+            )
+            # the experiment is prepared before the run is queued.
+            while self.session.queueDepth() == 0:
+                await asyncio.sleep(0.001)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            # the loop drops the run.
+            with self.with_loop():
+                pass
+
+        self.psy_session.runExperiment.assert_not_called()
+        self.assertNotIn("Lolo", self.session.participants)
+        run = self.session.runs()[-1]
+        self.assertEqual(run.error, "cancelled")
+        self.assertIsNotNone(run.returned)
+        self.assertIsNone(run.started)
+
+    async def test_run_failing_before_start_is_returned(self):
+        with self.with_file("foo.png"), self.with_loop():
+            with self.assertRaises(ValidationError):
+                await self.session.asyncRunExperiment(
+                    "foo.psyexp", participant="some invalid name", session=2
+                )
+
+            with patch.object(
+                self.session, "_put_task", side_effect=TaskQueueFull("full")
+            ):
+                with self.assertRaises(TaskQueueFull):
+                    await self.session.asyncRunExperiment(
+                        "foo.psyexp", participant="Lolo", session=2
+                    )
+
+        self.psy_session.runExperiment.assert_not_called()
+        runs = self.session.runs()
+        self.assertEqual(len(runs), 2)
+        self.assertIn("validation error", runs[0].error)
+        self.assertEqual(runs[1].error, "full")
+        for run in runs:
+            self.assertIsNotNone(run.returned)
+            self.assertIsNone(run.started)
+
+    async def test_evicted_experiment_is_compiled_off_the_loop(self):
+        objects = dict(self.psy_session.experimentObjects)
+        self.session._unloadExperiment("foo.psyexp")
+        threads = []
+
+        def addExperiment(file, key):
+            threads.append(threading.current_thread())
+            self.psy_session.experimentObjects[key] = objects[key]
+
+        self.psy_session.addExperiment.side_effect = addExperiment
+
+        with self.with_file("foo.png"), self.with_loop():
+            await self.session.asyncRunExperiment(
+                "foo.psyexp", participant="Lolo", session=2
+            )
+
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+
     async def test_run_experiment_assert_none_running(self):
         with self.with_file("foo.png"), self.with_loop():
             await self.session.asyncRunExperiment(
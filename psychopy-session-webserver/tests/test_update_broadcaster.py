@@ -1,7 +1,12 @@
 import asyncio
 import unittest
 
-from psychopy_session_webserver.types import Participant
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from psychopy_session_webserver.types import Experiment, Participant, UpdateEvent
 from psychopy_session_webserver.update_broadcaster import UpdateBroadcaster
 from pydantic import BaseModel
 
@@ -57,3 +62,295 @@ class UpdateBroadcasterTest(unittest.IsolatedAsyncioTestCase):
 
         # we need some time so the queue are indeed cleaned up. Garbage collection?
         self.loop.call_later(0.02, lambda: self.assertEqual(0, len(b._queues)))
+
+    async def test_events_are_encoded_once(self):
+        b = UpdateBroadcaster(loop=self.loop)
+
+        first = b.updates()
+        second = b.updates()
+        b.broadcastDict(
+            "participants", "asari", Participant(name="asari", nextSession=2)
+        )
+
+        a = await anext(first)
+        c = await anext(second)
+        self.assertIs(a, c)
+        self.assertEqual(
+            a.frame,
+            b'event:participantsUpdate\ndata:{"asari":{"name":"asari","nextSession":2}}\n\n',
+        )
+        self.assertIs(a.frame, c.frame)
+
+    async def test_snapshot_is_cached_until_changed(self):
+        b = UpdateBroadcaster(loop=self.loop)
+        b.broadcastDict(
+            "participants", "asari", Participant(name="asari", nextSession=2)
+        )
+
+        first = await anext(b.updates())
+        self.assertIs(first, await anext(b.updates()))
+
+        b.broadcastDict(
+            "participants", "turian", Participant(name="turian", nextSession=1)
+        )
+
+        snapshot = await anext(b.updates())
+        self.assertIsNot(first, snapshot)
+        self.assertEqual(sorted(snapshot.data), ["asari", "turian"])
+
+    async def test_slow_subscribers_get_coalesced_updates(self):
+        b = UpdateBroadcaster(loop=self.loop, maxQueueSize=3)
+        b.broadcast("experiment", "")
+
+        updates = b.updates()
+        event = await anext(updates)
+        self.assertEqual(event.data, "")
+
+        for i in range(1, 5):
+            b.broadcastDict(
+                "participants", f"p{i}", Participant(name=f"p{i}", nextSession=i)
+            )
+        b.broadcast("experiment", "blue.psyexp")
+        b.broadcastDict("participants", "p1", None)
+        await asyncio.sleep(0)
+
+        event = await anext(updates)
+        self.assertEqual(event.type, "participantsUpdate")
+        self.assertEqual(list(event.data), ["p1", "p2", "p3", "p4"])
+        event = await anext(updates)
+        self.assertEqual(event.type, "experimentUpdate")
+        self.assertEqual(event.data, "blue.psyexp")
+        # the queue was not full anymore
+        event = await anext(updates)
+        self.assertEqual(event.data, {"p1": None})
+
+        stats = b.subscriberStats()
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(stats[0].coalesced, 3)
+        self.assertEqual(stats[0].resyncs, 0)
+        self.assertEqual(stats[0].pending, 0)
+
+    async def test_overflowing_subscribers_are_resynced(self):
+        b = UpdateBroadcaster(loop=self.loop, maxQueueSize=1)
+        b.broadcast("experiment", "")
+
+        updates = b.updates()
+        await anext(updates)
+
+        b.broadcast("window", True)
+        b.broadcast("experiment", "blue.psyexp")
+        await asyncio.sleep(0)
+
+        events = [await anext(updates), await anext(updates)]
+        self.assertEqual(
+            [(e.type, e.data) for e in events],
+            [("experimentUpdate", "blue.psyexp"), ("windowUpdate", True)],
+        )
+        self.assertEqual(b.subscriberStats()[0].resyncs, 1)
+
+    async def test_coalesce_updates_per_iteration(self):
+        b = UpdateBroadcaster(loop=self.loop, coalesceInterval=0)
+        b.broadcast("experiment", "")
+        await asyncio.sleep(0)
+        updates = b.updates()
+        await anext(updates)
+
+        b.broadcast("experiment", "green.psyexp")
+        for i in range(1, 100):
+            b.broadcastDict(
+                "participants", f"p{i}", Participant(name=f"p{i}", nextSession=i)
+            )
+        b.broadcast("experiment", "blue.psyexp")
+        b.broadcastDict("participants", "p1", None)
+
+        events = [await anext(updates) for _ in range(3)]
+        self.assertEqual(
+            [e.type for e in events],
+            ["experimentUpdate", "participantsUpdate", "experimentUpdate"],
+        )
+        self.assertEqual(len(events[1].data), 99)
+        self.assertIsNone(events[1].data["p1"])
+        self.assertEqual(events[2].data, "blue.psyexp")
+
+        b.broadcast("window", True)
+        event = await anext(updates)
+        self.assertEqual((event.type, event.data), ("windowUpdate", True))
+
+    async def test_coalesce_updates_per_interval(self):
+        b = UpdateBroadcaster(loop=self.loop, coalesceInterval=0.05)
+        b.broadcast("experiment", "")
+        await asyncio.sleep(0.06)
+        updates = b.updates()
+        await anext(updates)
+
+        b.broadcastDict("participants", "p1", Participant(name="p1", nextSession=1))
+        await asyncio.sleep(0.01)
+        b.broadcastDict("participants", "p2", Participant(name="p2", nextSession=1))
+
+        event = await anext(updates)
+        self.assertEqual(list(event.data), ["p1", "p2"])
+
+    async def test_patches_are_not_merged_across_their_store(self):
+        b = UpdateBroadcaster(loop=self.loop, coalesceInterval=0)
+        catalog = {"a": Experiment(key="a", resources={}, parameters=[])}
+        b.broadcast("catalog", catalog)
+        await asyncio.sleep(0)
+        updates = b.updates()
+        snapshot = await anext(updates)
+
+        b.broadcastPatch("catalog", "resources", {"a": {"x.png": True}})
+        b.broadcastPatch("catalog", "resources", {"a": {"y.png": True}})
+        b.broadcastDict("catalog", "b", None)
+        b.broadcastPatch("catalog", "resources", {"a": {"x.png": False}})
+
+        events = [await anext(updates) for _ in range(3)]
+        self.assertEqual(
+            [(e.type, e.data) for e in events],
+            [
+                ("resourcesUpdate", {"a": {"x.png": True, "y.png": True}}),
+                ("catalogUpdate", {"b": None}),
+                ("resourcesUpdate", {"a": {"x.png": False}}),
+            ],
+        )
+        # the patched store is sent again to new subscribers
+        self.assertIsNot(snapshot, await anext(b.updates()))
+
+    async def test_resume_from_last_event_id(self):
+        b = UpdateBroadcaster(loop=self.loop, replaySize=2)
+        b.broadcast("experiment", "")
+        b.broadcast("window", False)
+
+        events = b.events()
+        snapshot = [await anext(events) for _ in range(2)]
+        self.assertEqual(
+            [e.type for _, e in snapshot], ["experimentUpdate", "windowUpdate"]
+        )
+        lastEventId = snapshot[-1][0]
+
+        b.broadcast("experiment", "blue.psyexp")
+        b.broadcast("window", True)
+        await asyncio.sleep(0)
+        await events.aclose()
+
+        resumed = b.events(lastEventId)
+        id, event = await anext(resumed)
+        self.assertEqual((event.type, event.data), ("experimentUpdate", "blue.psyexp"))
+        id, event = await anext(resumed)
+        self.assertEqual((event.type, event.data), ("windowUpdate", True))
+        await resumed.aclose()
+
+        # the missed events are not known anymore
+        b.broadcast("experiment", "")
+        b.broadcast("window", False)
+        b.broadcast("experiment", "green.psyexp")
+        resumed = b.events(id)
+        self.assertEqual(
+            [(await anext(resumed))[1].type for _ in range(2)],
+            ["experimentUpdate", "windowUpdate"],
+        )
+        await resumed.aclose()
+
+        for unknown in [None, "garbage", "0000-1", b.eventId(100)]:
+            resumed = b.events(unknown)
+            _, event = await anext(resumed)
+            self.assertEqual(event.data, "green.psyexp")
+            await resumed.aclose()
+
+    async def test_resume_after_coalesced_updates(self):
+        b = UpdateBroadcaster(loop=self.loop, maxQueueSize=2)
+        b.broadcast("experiment", "")
+        b.broadcast("window", False)
+
+        events = b.events()
+        [await anext(events) for _ in range(2)]
+
+        b.broadcast("experiment", "blue.psyexp")
+        b.broadcast("window", True)
+        b.broadcast("experiment", "green.psyexp")
+        await asyncio.sleep(0)
+
+        # the client leaves after the first event, ids are delivered in order.
+        id, event = await anext(events)
+        self.assertEqual((event.type, event.data), ("windowUpdate", True))
+        await events.aclose()
+
+        resumed = b.events(id)
+        id, event = await anext(resumed)
+        self.assertEqual((event.type, event.data), ("experimentUpdate", "green.psyexp"))
+        self.assertEqual(id, b.eventId(b._seq))
+        await resumed.aclose()
+
+    async def test_subscribe_to_topics(self):
+        b = UpdateBroadcaster(loop=self.loop)
+        b.broadcast("experiment", "")
+        b.broadcast("window", False)
+        b.broadcast("catalog", {})
+
+        events = b.events(topics=["catalog"])
+        _, event = await anext(events)
+        self.assertEqual(event.type, "catalogUpdate")
+
+        b.broadcast("experiment", "blue.psyexp")
+        b.broadcastPatch("catalog", "resources", {"blue.psyexp": {"a.png": True}})
+
+        _, event = await anext(events)
+        self.assertEqual(event.type, "resourcesUpdate")
+        # the experiment event was never queued
+        stats = b.subscriberStats()[0]
+        self.assertEqual((stats.delivered, stats.pending), (2, 0))
+
+    def test_message_encodings(self):
+        event = UpdateEvent(
+            type="participantsUpdate",
+            data={"asari": Participant(name="asari", nextSession=2)},
+        )
+        self.assertEqual(
+            event.message,
+            '{"type":"participantsUpdate","data":{"asari":{"name":"asari","nextSession":2}}}',
+        )
+        if msgpack is None:
+            self.skipTest("msgpack is not installed")
+        self.assertEqual(
+            msgpack.unpackb(event.packedMessage),
+            {
+                "type": "participantsUpdate",
+                "data": {"asari": {"name": "asari", "nextSession": 2}},
+            },
+        )
+
+    def test_encoded_bodies_are_cached_until_changed(self):
+        b = UpdateBroadcaster(loop=self.loop)
+        b.broadcast("participants", {})
+        b.broadcastDict(
+            "participants", "asari", Participant(name="asari", nextSession=2)
+        )
+
+        etag, body = b.body("participants")
+        self.assertEqual(body, b'{"asari":{"name":"asari","nextSession":2}}')
+        self.assertIs(b.body("participants")[1], body)
+
+        b.broadcastDict(
+            "participants", "turian", Participant(name="turian", nextSession=1)
+        )
+        newEtag, newBody = b.body("participants")
+        self.assertNotEqual(etag, newEtag)
+        self.assertIn(b'"turian"', newBody)
+
+        b.broadcastPatch("participants", "flags", {"asari": {"active": True}})
+        self.assertNotEqual(newEtag, b.body("participants")[0])
+
+        # ETags of another broadcaster, e.g. before a restart, never match.
+        other = UpdateBroadcaster(loop=self.loop)
+        other.broadcast("participants", {})
+        other.broadcastDict(
+            "participants", "asari", Participant(name="asari", nextSession=2)
+        )
+        self.assertNotEqual(other.body("participants")[0], etag)
+
+    def test_etags_identify_the_store(self):
+        b = UpdateBroadcaster(loop=self.loop)
+        b.broadcast("catalog", {})
+        b.broadcast("participants", {})
+
+        self.assertEqual(b._versions["catalog"], b._versions["participants"])
+        self.assertNotEqual(b.body("catalog")[0], b.body("participants")[0])
@@ -1,6 +1,7 @@
 import { get } from 'svelte/store';
 import { describe, it, expect } from 'vitest';
 import { testing } from '$lib/application_state';
+import { patchResources } from '$lib/types';
 const { dictStore, dictDiff } = testing;
 
 describe('dictStore', () => {
@@ -46,3 +47,19 @@ describe('dictDiff', () => {
 		expect(dictDiff({ a: 1 }, {})).toStrictEqual({ a: null });
 	});
 });
+
+describe('patchResources', () => {
+	const catalog = {
+		'a.psyexp': { key: 'a.psyexp', resources: { 'a.png': false, 'b.png': true }, parameters: [] }
+	};
+
+	it('should update only the given resources', () => {
+		expect(patchResources(catalog, { 'a.psyexp': { 'a.png': true } })).toStrictEqual({
+			'a.psyexp': { key: 'a.psyexp', resources: { 'a.png': true, 'b.png': true }, parameters: [] }
+		});
+	});
+
+	it('should ignore unknown experiments', () => {
+		expect(patchResources(catalog, { 'b.psyexp': { 'a.png': true } })).toStrictEqual({});
+	});
+});
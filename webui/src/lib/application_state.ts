@@ -1,5 +1,20 @@
-import { readonly, writable, type Writable, type Readable, type Unsubscriber } from 'svelte/store';
-import type { BatteryState, Catalog, Experiment, Participant, ParticipantByName } from './types';
+import {
+	get,
+	readonly,
+	writable,
+	type Writable,
+	type Readable,
+	type Unsubscriber
+} from 'svelte/store';
+import {
+	patchResources,
+	type BatteryState,
+	type Catalog,
+	type Experiment,
+	type Participant,
+	type ParticipantByName,
+	type ResourcesUpdate
+} from './types';
 import { browser } from '$app/environment';
 
 function dictDiff<Value, Dict extends { [key: string]: Value }>(a: Dict, b: Dict): Dict {
@@ -77,6 +92,10 @@ const _eventListeners = {
 		const updates = JSON.parse(event.data) as Catalog;
 		_catalog.mergeDiffs(updates);
 	},
+	resourcesUpdate: (event: MessageEvent): void => {
+		const updates = JSON.parse(event.data) as ResourcesUpdate;
+		_catalog.mergeDiffs(patchResources(get(_catalog), updates));
+	},
 	windowUpdate: (event: MessageEvent): void => {
 		const data = JSON.parse(event.data) as boolean;
 		_window.set(data);
@@ -14,6 +14,25 @@ export interface Experiment {
 	parameters: string[];
 }
 
+// the resources whose existence changed, by experiment key.
+export interface ResourcesUpdate {
+	[key: string]: { [key: string]: boolean };
+}
+
+// returns the experiments of catalog modified by a resources update, unknown experiments
+// are ignored.
+export function patchResources(catalog: Catalog, update: ResourcesUpdate): Catalog {
+	const diff: Catalog = {};
+	for (const [key, resources] of Object.entries(update)) {
+		const experiment = catalog[key];
+		if (experiment === undefined) {
+			continue;
+		}
+		diff[key] = { ...experiment, resources: { ...experiment.resources, ...resources } };
+	}
+	return diff;
+}
+
 export class Participant {
 	public constructor(
 		public name: string,
@@ -1,5 +1,20 @@
-import { readonly, writable, type Writable, type Readable, type Unsubscriber } from 'svelte/store';
-import type { BatteryState, Catalog, Experiment, Participant, ParticipantByName } from './types';
+import {
+	get,
+	readonly,
+	writable,
+	type Writable,
+	type Readable,
+	type Unsubscriber
+} from 'svelte/store';
+import {
+	patchResources,
+	type BatteryState,
+	type Catalog,
+	type Experiment,
+	type Participant,
+	type ParticipantByName,
+	type ResourcesUpdate
+} from './types';
 
 // a custom store that incrementally merge a dict. If a key points to a null object it is
 // removed. the backend can the incrementally sends diff to the frontend.
@@ -107,6 +122,10 @@ export class VertigoState {
 			const updates = JSON.parse(event.data) as Catalog;
 			this._catalog.mergeDiffs(updates);
 		});
+		eventSource.addEventListener('resourcesUpdate', (event) => {
+			const updates = JSON.parse(event.data) as ResourcesUpdate;
+			this._catalog.mergeDiffs(patchResources(get(this._catalog), updates));
+		});
 		eventSource.addEventListener('participantsUpdate', (event) => {
 			const updates = JSON.parse(event.data) as ParticipantByName;
 			this._participants.mergeDiffs(updates);